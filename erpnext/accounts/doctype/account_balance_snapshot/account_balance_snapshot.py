@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from bisect import bisect_left
+from frappe import _
+from frappe.utils import cint, cstr, flt, getdate, get_first_day, get_last_day, add_days, nowdate, now
+from frappe.model.document import Document
+
+AMOUNT_FIELDS = ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency")
+KEY_FIELDS = ("company", "account", "party_type", "party", "period_end_date")
+
+class AccountBalanceSnapshot(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index("Account Balance Snapshot", ["account", "period_end_date"])
+	frappe.db.add_index("Account Balance Snapshot", ["party", "period_end_date"])
+	frappe.db.add_unique("Account Balance Snapshot", KEY_FIELDS, constraint_name="unique_snapshot_key")
+
+def snapshots_enabled():
+	return cint(frappe.db.get_single_value("Accounts Settings", "use_account_balance_snapshots"))
+
+def get_period_end_date(date):
+	return getdate(get_last_day(date))
+
+def get_last_closed_period_end_date(date):
+	"""end date of the latest snapshot period ending on or before `date`"""
+	date = getdate(date)
+	if date == get_period_end_date(date):
+		return date
+	return getdate(add_days(get_first_day(date), -1))
+
+def update_account_balance_snapshots(gl_entries, cancel=False):
+	"""
+		Add posted GL entries to the closing balance of their month and of every later month.
+		With `cancel`, the entries are removed instead.
+	"""
+	if not gl_entries or not snapshots_enabled():
+		return
+
+	pl_accounts = get_profit_and_loss_accounts(list(set(d.get("account") for d in gl_entries)))
+
+	movements = {}
+	for gle in gl_entries:
+		# P&L balances are taken within the fiscal year, before period closing
+		if gle.get("voucher_type") == "Period Closing Voucher" and gle.get("account") in pl_accounts:
+			continue
+
+		key = (gle.get("company"), gle.get("account"), cstr(gle.get("party_type")), cstr(gle.get("party")),
+			get_period_end_date(gle.get("posting_date")))
+
+		amounts = movements.setdefault(key, [0.0] * len(AMOUNT_FIELDS))
+		for i, fieldname in enumerate(AMOUNT_FIELDS):
+			amounts[i] += flt(gle.get(fieldname)) * (-1 if cancel else 1)
+
+	for key, amounts in movements.items():
+		apply_movement(key, amounts)
+
+def remove_voucher_from_account_balance_snapshots(voucher_type, voucher_no):
+	"""remove the posted GL entries of a voucher from the snapshots, before they are deleted"""
+	if not snapshots_enabled():
+		return
+
+	gl_entries = frappe.db.sql("""
+		select company, account, party_type, party, posting_date, voucher_type, {0}
+		from `tabGL Entry`
+		where voucher_type=%s and voucher_no=%s""".format(", ".join(AMOUNT_FIELDS)),
+		(voucher_type, voucher_no), as_dict=True)
+
+	update_account_balance_snapshots(gl_entries, cancel=True)
+
+def apply_movement(key, amounts):
+	company, account, party_type, party, period_end_date = key
+	args = frappe._dict(company=company, account=account, party_type=party_type, party=party,
+		period_end_date=period_end_date)
+
+	key_condition = """company=%(company)s and account=%(account)s
+		and ifnull(party_type, '')=%(party_type)s and ifnull(party, '')=%(party)s"""
+
+	if not frappe.db.sql("""select name from `tabAccount Balance Snapshot`
+		where {0} and period_end_date=%(period_end_date)s""".format(key_condition), args):
+			# start the period from the closing balance of the previous one
+			previous = frappe.db.sql("""select {0} from `tabAccount Balance Snapshot`
+				where {1} and period_end_date < %(period_end_date)s
+				order by period_end_date desc limit 1""".format(", ".join(AMOUNT_FIELDS), key_condition), args)
+
+			# a concurrent posting may have added the period since, keep its row
+			insert_snapshots([list(key) + list(previous[0] if previous else [0.0] * len(AMOUNT_FIELDS))],
+				ignore_existing=True)
+
+	args.update(dict(zip(AMOUNT_FIELDS, amounts)))
+	frappe.db.sql("""update `tabAccount Balance Snapshot`
+		set {0}
+		where {1} and period_end_date >= %(period_end_date)s""".format(
+			", ".join("{0} = {0} + %({0})s".format(d) for d in AMOUNT_FIELDS), key_condition), args)
+
+def insert_snapshots(rows, ignore_existing=False, chunk_size=500):
+	"""rows of (company, account, party_type, party, period_end_date, debit, credit,
+		debit_in_account_currency, credit_in_account_currency). With `ignore_existing`,
+		rows whose key already has a snapshot are skipped."""
+	timestamp, user = now(), frappe.session.user
+	columns = ("name", "creation", "modified", "owner", "modified_by", "docstatus") + KEY_FIELDS + AMOUNT_FIELDS
+
+	for i in range(0, len(rows), chunk_size):
+		chunk = rows[i:i + chunk_size]
+		values = []
+		for row in chunk:
+			values.extend([frappe.generate_hash("Account Balance Snapshot", 10), timestamp, timestamp,
+				user, user, 0] + list(row))
+
+		frappe.db.sql("""insert into `tabAccount Balance Snapshot` ({0}) values {1} {2}""".format(
+			", ".join(columns), ", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(chunk)),
+			"on duplicate key update name=name" if ignore_existing else ""), tuple(values))
+
+def get_balance_from_snapshots(conditions, date=None, from_date=None, in_account_currency=True,
+	exclude_period_closing_voucher=False):
+	"""
+		Balance of GL Entries matching `conditions` (on alias `gle`) up to `date`, and from
+		`from_date` if given, from the last closing snapshot and the GL entries posted after it.
+	"""
+	balance = get_closing_balance(conditions, date, in_account_currency, exclude_period_closing_voucher)
+	if from_date:
+		balance -= get_closing_balance(conditions, add_days(from_date, -1), in_account_currency,
+			exclude_period_closing_voucher)
+
+	return balance
+
+def get_closing_balance(conditions, date=None, in_account_currency=True, exclude_period_closing_voucher=False):
+	if in_account_currency:
+		select_field = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
+	else:
+		select_field = "sum(debit) - sum(credit)"
+
+	period_end_date = get_last_closed_period_end_date(date or nowdate())
+	# conditions are already escaped literals, keep their % signs out of parameter substitution
+	conditions = (" and ".join(conditions) or "1=1").replace("%", "%%")
+
+	snapshot_balance = frappe.db.sql("""
+		select {0}
+		from `tabAccount Balance Snapshot` gle
+		where {1}
+		and gle.period_end_date = (select max(s.period_end_date)
+			from `tabAccount Balance Snapshot` s
+			where s.company = gle.company and s.account = gle.account
+			and ifnull(s.party_type, '') = ifnull(gle.party_type, '')
+			and ifnull(s.party, '') = ifnull(gle.party, '')
+			and s.period_end_date <= %(period_end_date)s)""".format(select_field, conditions),
+		{"period_end_date": period_end_date})[0][0]
+
+	gle_conditions = ["gle.posting_date > %(period_end_date)s"]
+	if date:
+		gle_conditions.append("gle.posting_date <= %(date)s")
+	if exclude_period_closing_voucher:
+		gle_conditions.append("gle.voucher_type != 'Period Closing Voucher'")
+
+	delta = frappe.db.sql("""
+		select {0}
+		from `tabGL Entry` gle
+		where {1} and {2}""".format(select_field, conditions, " and ".join(gle_conditions)),
+		{"period_end_date": period_end_date, "date": date})[0][0]
+
+	return flt(snapshot_balance) + flt(delta)
+
+def get_profit_and_loss_accounts(accounts=None):
+	condition = ""
+	if accounts:
+		condition = " and name in ({0})".format(", ".join(["%s"] * len(accounts)))
+
+	return set(frappe.db.sql_list("""select name from tabAccount
+		where report_type='Profit and Loss' {0}""".format(condition), tuple(accounts or ())))
+
+def get_closing_balances_from_gl(company=None, account=None):
+	"""cumulative closing balance per (company, account, party type, party, month) from raw GL"""
+	condition = " and gle.company=%(company)s" if company else ""
+	if account:
+		condition += " and gle.account=%(account)s"
+
+	movements = frappe.db.sql("""
+		select
+			gle.company, gle.account, ifnull(gle.party_type, ''), ifnull(gle.party, ''),
+			last_day(gle.posting_date), {0}
+		from `tabGL Entry` gle
+		where not (gle.voucher_type = 'Period Closing Voucher' and exists(select name from tabAccount
+			where name=gle.account and report_type='Profit and Loss')) {1}
+		group by gle.company, gle.account, ifnull(gle.party_type, ''), ifnull(gle.party, ''),
+			last_day(gle.posting_date)
+		order by gle.company, gle.account, ifnull(gle.party_type, ''), ifnull(gle.party, ''),
+			last_day(gle.posting_date)""".format(", ".join("sum({0})".format(d) for d in AMOUNT_FIELDS),
+			condition), {"company": company, "account": account})
+
+	closing_balances, previous_key, running = [], None, None
+	for d in movements:
+		key = tuple(d[:4])
+		if key != previous_key:
+			previous_key, running = key, [0.0] * len(AMOUNT_FIELDS)
+
+		running = [flt(running[i]) + flt(d[5 + i]) for i in range(len(AMOUNT_FIELDS))]
+		closing_balances.append(list(key) + [getdate(d[4])] + running)
+
+	return closing_balances
+
+def rebuild_account_balance_snapshots(company=None):
+	"""rebuild all snapshots, of the given company if any, from the General Ledger"""
+	if company:
+		frappe.db.sql("delete from `tabAccount Balance Snapshot` where company=%s", company)
+	else:
+		frappe.db.sql("delete from `tabAccount Balance Snapshot`")
+
+	insert_snapshots(get_closing_balances_from_gl(company))
+
+def repair_account_balance_snapshots(company, account):
+	"""
+		Rebuild the snapshots of an account from the General Ledger, with its snapshot rows locked.
+		Postings to the account wait for the rebuild and then add their entries to the rebuilt rows.
+	"""
+	# a new transaction, reading the General Ledger after the postings holding these rows commit
+	frappe.db.commit()
+	frappe.db.sql("""select name from `tabAccount Balance Snapshot`
+		where company=%s and account=%s for update""", (company, account))
+
+	frappe.db.sql("""delete from `tabAccount Balance Snapshot`
+		where company=%s and account=%s""", (company, account))
+	insert_snapshots(get_closing_balances_from_gl(company, account))
+	frappe.db.commit()
+
+def check_account_balance_snapshots(company=None, repair=False):
+	"""
+		Compare snapshots with closing balances computed from the General Ledger and return the
+		mismatches. With `repair`, the snapshots of the affected accounts are rebuilt one account
+		at a time, see `repair_account_balance_snapshots`.
+	"""
+	expected = dict(((d[0], d[1], d[2], d[3], d[4]), d[5:]) for d in get_closing_balances_from_gl(company))
+
+	# balances are read as the sum of the rows of a key, so more than one row is a mismatch too
+	condition = " where company=%(company)s" if company else ""
+	actual, row_count = {}, {}
+	for d in frappe.db.sql("""
+		select company, account, ifnull(party_type, ''), ifnull(party, ''), period_end_date, {0}
+		from `tabAccount Balance Snapshot` {1}""".format(", ".join(AMOUNT_FIELDS), condition),
+		{"company": company}):
+			key = (d[0], d[1], d[2], d[3], getdate(d[4]))
+			row_count[key] = row_count.get(key, 0) + 1
+			actual[key] = [flt(a) + flt(b) for a, b in zip(actual.get(key, [0.0] * len(AMOUNT_FIELDS)), d[5:])]
+
+	# closing balances per key in period order, to look up balances carried into months without movement
+	expected_periods = {}
+	for key in sorted(expected):
+		expected_periods.setdefault(key[:4], []).append(key[4])
+
+	mismatches = []
+	for key in set(expected) | set(actual):
+		if key in expected:
+			expected_amounts = expected[key]
+		else:
+			periods = expected_periods.get(key[:4], [])
+			index = bisect_left(periods, key[4])
+			expected_amounts = expected[key[:4] + (periods[index - 1],)] if index else [0.0] * len(AMOUNT_FIELDS)
+
+		# a posted month must have a snapshot, later months without movement may not
+		actual_amounts = actual.get(key)
+		if (key in expected and actual_amounts is None) or row_count.get(key, 0) > 1 or (actual_amounts is not None
+			and any(flt(a, 6) != flt(b, 6) for a, b in zip(expected_amounts, actual_amounts))):
+				mismatches.append(frappe._dict(zip(KEY_FIELDS, key),
+					expected=dict(zip(AMOUNT_FIELDS, expected_amounts)),
+					actual=dict(zip(AMOUNT_FIELDS, actual_amounts)) if actual_amounts else None,
+					rows=row_count.get(key, 0)))
+
+	if repair:
+		for company, account in sorted(set((d.company, d.account) for d in mismatches)):
+			repair_account_balance_snapshots(company, account)
+
+	return mismatches
+
+def verify_account_balance_snapshots():
+	"""daily: repair snapshots that drifted from the General Ledger, e.g. after direct ledger fixes"""
+	if not snapshots_enabled():
+		return
+
+	mismatches = check_account_balance_snapshots(repair=True)
+	if mismatches:
+		frappe.log_error(title=_("Account Balance Snapshot mismatch"),
+			message="\n".join("{0} {1} {2} {3}: expected {4}, found {5} in {6} rows".format(d.company,
+				d.account, d.party or "", d.period_end_date, d.expected, d.actual, d.rows) for d in mismatches[:100]))
+
+	frappe.db.commit()
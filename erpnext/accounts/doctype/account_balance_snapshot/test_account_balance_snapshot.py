@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from erpnext.accounts.utils import get_balance_on
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot import \
+	rebuild_account_balance_snapshots, check_account_balance_snapshots, insert_snapshots
+
+class TestAccountBalanceSnapshot(unittest.TestCase):
+	def setUp(self):
+		frappe.db.set_value("Accounts Settings", None, "use_account_balance_snapshots", 1)
+		rebuild_account_balance_snapshots("_Test Company")
+
+	def tearDown(self):
+		frappe.db.set_value("Accounts Settings", None, "use_account_balance_snapshots", 0)
+
+	def get_balances(self, account, date):
+		frappe.db.set_value("Accounts Settings", None, "use_account_balance_snapshots", 0)
+		from_gl = get_balance_on(account, date)
+		frappe.db.set_value("Accounts Settings", None, "use_account_balance_snapshots", 1)
+		return from_gl, get_balance_on(account, date)
+
+	def test_balance_after_posting_and_cancelling(self):
+		account = "_Test Bank - _TC"
+		jv = make_journal_entry(account, "_Test Account Cost for Goods Sold - _TC", 100,
+			posting_date="2013-02-14", submit=True)
+
+		for date in ("2013-02-13", "2013-02-14", "2013-02-28", "2013-03-15", None):
+			from_gl, from_snapshots = self.get_balances(account, date)
+			self.assertEqual(from_gl, from_snapshots)
+
+		self.assertEqual(check_account_balance_snapshots("_Test Company"), [])
+
+		jv.cancel()
+		from_gl, from_snapshots = self.get_balances(account, "2013-03-15")
+		self.assertEqual(from_gl, from_snapshots)
+		self.assertEqual(check_account_balance_snapshots("_Test Company"), [])
+
+	def test_profit_and_loss_balance_within_fiscal_year(self):
+		account = "_Test Account Cost for Goods Sold - _TC"
+		make_journal_entry(account, "_Test Bank - _TC", 100, posting_date="2013-02-14", submit=True)
+
+		from_gl, from_snapshots = self.get_balances(account, "2013-06-30")
+		self.assertEqual(from_gl, from_snapshots)
+
+	def test_one_snapshot_per_period(self):
+		# a second posting adding the same period keeps the existing row
+		row = ["_Test Company", "_Test Bank - _TC", "", "", "2013-04-30", 0.0, 0.0, 0.0, 0.0]
+		insert_snapshots([row], ignore_existing=True)
+		insert_snapshots([row], ignore_existing=True)
+
+		self.assertEqual(frappe.db.sql("""select count(*) from `tabAccount Balance Snapshot`
+			where company=%s and account=%s and period_end_date=%s""", (row[0], row[1], row[4]))[0][0], 1)
+
+	def test_repair_drifted_snapshot(self):
+		account = "_Test Bank - _TC"
+		make_journal_entry(account, "_Test Account Cost for Goods Sold - _TC", 100,
+			posting_date="2013-02-14", submit=True)
+
+		frappe.db.sql("""update `tabAccount Balance Snapshot` set debit = debit + 50
+			where company='_Test Company' and account=%s and period_end_date='2013-02-28'""", account)
+
+		mismatches = check_account_balance_snapshots("_Test Company", repair=True)
+		self.assertEqual(set(d.account for d in mismatches), set([account]))
+		self.assertEqual(check_account_balance_snapshots("_Test Company"), [])
+
+		from_gl, from_snapshots = self.get_balances(account, "2013-03-15")
+		self.assertEqual(from_gl, from_snapshots)
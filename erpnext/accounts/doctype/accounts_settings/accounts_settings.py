@@ -5,6 +5,7 @@
 
 from __future__ import unicode_literals
 import frappe
+from frappe import _
 from frappe.utils import cint
 from frappe.model.document import Document
 from frappe.custom.doctype.property_setter.property_setter import make_property_setter
@@ -12,11 +13,20 @@ from frappe.custom.doctype.property_setter.property_setter import make_property_
 
 class AccountsSettings(Document):
 	def on_update(self):
-		pass
+		if self.flags.rebuild_account_balance_snapshots:
+			frappe.enqueue("erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot.rebuild_account_balance_snapshots",
+				queue="long", timeout=3000)
+			frappe.msgprint(_("Account Balance Snapshots will be rebuilt in the background"))
 
 	def validate(self):
 		self.validate_stale_days()
 		self.enable_payment_schedule_in_print()
+		self.check_account_balance_snapshots_enabled()
+
+	def check_account_balance_snapshots_enabled(self):
+		# snapshots are not maintained while disabled, rebuild them when enabled
+		self.flags.rebuild_account_balance_snapshots = cint(self.use_account_balance_snapshots) \
+			and not cint(frappe.db.get_single_value("Accounts Settings", "use_account_balance_snapshots"))
 
 	def validate_stale_days(self):
 		if not self.allow_stale and cint(self.stale_days) <= 0:
@@ -4,6 +4,7 @@
 from __future__ import unicode_literals
 
 import frappe, unittest
+from frappe.utils import getdate
 
 test_records = frappe.get_test_records('Fiscal Year')
 test_ignore = ["Company"]
@@ -21,3 +22,32 @@ class TestFiscalYear(unittest.TestCase):
 		fy.insert()
 		self.assertEquals(fy.year_end_date, '2001-03-31')
 
+
+	def test_fiscal_years_for_dates(self):
+		from erpnext.accounts.utils import get_fiscal_year, get_fiscal_years_for_dates
+
+		dates = ["2013-01-01", "2013-06-30", "2014-12-31"]
+		fiscal_years = get_fiscal_years_for_dates(dates, company="_Test Company")
+
+		for date in dates:
+			self.assertEqual(fiscal_years[getdate(date)], get_fiscal_year(date, company="_Test Company"))
+
+		self.assertEqual(get_fiscal_years_for_dates(["1900-01-01"], raise_exception=False),
+			{getdate("1900-01-01"): None})
+
+	def test_new_year_is_resolved(self):
+		from erpnext.accounts.utils import get_fiscal_year
+
+		if frappe.db.exists("Fiscal Year", "_Test Fiscal Year 1990"):
+			frappe.delete_doc("Fiscal Year", "_Test Fiscal Year 1990")
+
+		self.assertRaises(frappe.ValidationError, get_fiscal_year, "1990-06-01", verbose=0)
+
+		frappe.get_doc({
+			"doctype": "Fiscal Year",
+			"year": "_Test Fiscal Year 1990",
+			"year_start_date": "1990-01-01",
+			"year_end_date": "1990-12-31"
+		}).insert()
+
+		self.assertEqual(get_fiscal_year("1990-06-01")[0], "_Test Fiscal Year 1990")
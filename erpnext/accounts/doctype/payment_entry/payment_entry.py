@@ -6,7 +6,8 @@ from __future__ import unicode_literals
 import frappe, erpnext, json
 from frappe import _, scrub, ValidationError
 from frappe.utils import flt, comma_or, nowdate
-from erpnext.accounts.utils import get_outstanding_invoices, get_account_currency, get_balance_on
+from erpnext.accounts.utils import get_outstanding_invoices, get_account_currency, get_balance_on, \
+	get_voucher_values
 from erpnext.accounts.party import get_party_account
 from erpnext.accounts.doctype.journal_entry.journal_entry import get_default_bank_cash_account
 from erpnext.setup.utils import get_exchange_rate
@@ -532,19 +533,27 @@ def get_outstanding_reference_documents(args):
 			.format(frappe.db.escape(args["voucher_type"]), frappe.db.escape(args["voucher_no"]))
 
 	outstanding_invoices = get_outstanding_invoices(args.get("party_type"), args.get("party"),
-		args.get("party_account"), condition=condition)
+		args.get("party_account"), condition=condition, limit=args.get("limit"), start=args.get("start"))
+
+	conversion_rates = {}
+	if party_account_currency != company_currency:
+		conversion_rates = get_voucher_values([(d.voucher_type, d.voucher_no) for d in outstanding_invoices
+			if d.voucher_type in ("Sales Invoice", "Purchase Invoice", "Expense Claim")], ["conversion_rate"])
+
+	bill_nos = get_voucher_values([(d.voucher_type, d.voucher_no) for d in outstanding_invoices
+		if d.voucher_type == "Purchase Invoice"], ["bill_no"])
 
 	for d in outstanding_invoices:
 		d["exchange_rate"] = 1
 		if party_account_currency != company_currency:
 			if d.voucher_type in ("Sales Invoice", "Purchase Invoice", "Expense Claim"):
-				d["exchange_rate"] = frappe.db.get_value(d.voucher_type, d.voucher_no, "conversion_rate")
+				d["exchange_rate"] = conversion_rates.get((d.voucher_type, d.voucher_no), {}).get("conversion_rate")
 			elif d.voucher_type == "Journal Entry":
 				d["exchange_rate"] = get_exchange_rate(
 					party_account_currency,	company_currency, d.posting_date
 				)
 		if d.voucher_type in ("Purchase Invoice"):
-			d["bill_no"] = frappe.db.get_value(d.voucher_type, d.voucher_no, "bill_no")
+			d["bill_no"] = bill_nos.get((d.voucher_type, d.voucher_no), {}).get("bill_no")
 
 	# Get all SO / PO which are not fully billed or aginst which full advance not paid
 	orders_to_be_billed = []
@@ -331,3 +331,24 @@ class TestPaymentEntry(unittest.TestCase):
 
 		outstanding_amount = flt(frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount"))
 		self.assertEqual(outstanding_amount, 0)
+
+	def test_outstanding_invoices_after_partial_payment(self):
+		from erpnext.accounts.utils import get_outstanding_invoices
+
+		si = create_sales_invoice(qty=1, rate=100)
+		pe = get_payment_entry("Sales Invoice", si.name, bank_account="_Test Cash - _TC")
+		pe.paid_amount = pe.received_amount = 40
+		pe.references[0].allocated_amount = 40
+		pe.reference_no = "1"
+		pe.reference_date = nowdate()
+		pe.insert()
+		pe.submit()
+
+		outstanding_invoices = get_outstanding_invoices("Customer", si.customer, si.debit_to)
+		invoice = [d for d in outstanding_invoices if d.voucher_no == si.name][0]
+		self.assertEqual(invoice.payment_amount, 40)
+		self.assertEqual(invoice.outstanding_amount, 60)
+		self.assertEqual(invoice.due_date, si.due_date)
+
+		first_page = get_outstanding_invoices("Customer", si.customer, si.debit_to, limit=1)
+		self.assertEqual(first_page, outstanding_invoices[:1])
@@ -6,14 +6,16 @@
 from __future__ import unicode_literals
 import frappe
 import json
-import copy
 from frappe import throw, _
-from frappe.utils import flt, cint
+from frappe.utils import flt, cint, cstr, getdate
 from frappe.model.document import Document
 
 
 class MultiplePricingRuleConflict(frappe.ValidationError): pass
 
+# compiled pricing rules per site, as (version, index)
+_pricing_rule_index = {}
+
 class PricingRule(Document):
 	def validate(self):
 		self.validate_mandatory()
@@ -25,6 +27,12 @@ class PricingRule(Document):
 
 		if not self.margin_type: self.margin_rate_or_amount = 0.0
 
+	def on_update(self):
+		clear_pricing_rule_index()
+
+	def on_trash(self):
+		clear_pricing_rule_index()
+
 	def validate_mandatory(self):
 		for field in ["apply_on", "applicable_for"]:
 			tocheck = frappe.scrub(self.get(field) or "")
@@ -115,10 +123,15 @@ def apply_pricing_rule(args):
 	set_serial_nos_based_on_fifo = frappe.db.get_single_value("Stock Settings",
 		"automatically_set_serial_nos_based_on_fifo")
 
+	# party, items and groups are looked up once for the whole list
+	set_party_details(args)
+	lookup_cache = {}
+	set_items_for_pricing_rule([item.get("item_code") for item in item_list], lookup_cache)
+
 	for item in item_list:
-		args_copy = copy.deepcopy(args)
+		args_copy = frappe._dict(args)
 		args_copy.update(item)
-		out.append(get_pricing_rule_for_item(args_copy))
+		out.append(get_pricing_rule_for_item(args_copy, lookup_cache))
 		if set_serial_nos_based_on_fifo and not args.get('is_return'):
 			out.append(get_serial_no_for_item(args_copy))
 	return out
@@ -135,9 +148,14 @@ def get_serial_no_for_item(args):
 		item_details.serial_no = get_serial_no(args)
 	return item_details
 
-def get_pricing_rule_for_item(args):
+def get_pricing_rule_for_item(args, lookup_cache=None):
+	"""`lookup_cache` keeps Item and group tree lookups and the pricing rule version
+		across the items of a transaction"""
 	if args.get("parenttype") == "Material Request": return {}
 
+	if lookup_cache is None:
+		lookup_cache = {}
+
 	item_details = frappe._dict({
 		"doctype": args.doctype,
 		"name": args.name,
@@ -150,27 +168,18 @@ def get_pricing_rule_for_item(args):
 		return item_details
 
 	if not (args.item_group and args.brand):
-		try:
-			args.item_group, args.brand = frappe.db.get_value("Item", args.item_code, ["item_group", "brand"])
-		except TypeError:
+		item = get_item_for_pricing_rule(args.item_code, lookup_cache)
+		if not item:
 			# invalid item_code
 			return item_details
+
+		args.item_group, args.brand = item.item_group, item.brand
 		if not args.item_group:
 			frappe.throw(_("Item Group not mentioned in item master for item {0}").format(args.item_code))
 
-	if args.transaction_type=="selling":
-		if args.customer and not (args.customer_group and args.territory):
-			customer = frappe.db.get_value("Customer", args.customer, ["customer_group", "territory"])
-			if customer:
-				args.customer_group, args.territory = customer
+	set_party_details(args)
 
-		args.supplier = args.supplier_type = None
-
-	elif args.supplier and not args.supplier_type:
-		args.supplier_type = frappe.db.get_value("Supplier", args.supplier, "supplier_type")
-		args.customer = args.customer_group = args.territory = None
-
-	pricing_rules = get_pricing_rules(args)
+	pricing_rules = get_pricing_rules(args, lookup_cache)
 	pricing_rule = filter_pricing_rules(args, pricing_rules)
 
 	if pricing_rule:
@@ -192,6 +201,39 @@ def get_pricing_rule_for_item(args):
 
 	return item_details
 
+def set_party_details(args):
+	if args.transaction_type=="selling":
+		if args.customer and not (args.customer_group and args.territory):
+			customer = frappe.db.get_value("Customer", args.customer, ["customer_group", "territory"])
+			if customer:
+				args.customer_group, args.territory = customer
+
+		args.supplier = args.supplier_type = None
+
+	elif args.supplier and not args.supplier_type:
+		args.supplier_type = frappe.db.get_value("Supplier", args.supplier, "supplier_type")
+		args.customer = args.customer_group = args.territory = None
+
+def set_items_for_pricing_rule(item_codes, lookup_cache):
+	"""load item group, brand and template of all the items with one query"""
+	item_codes = list(set(d for d in item_codes if d and ("Item", d) not in lookup_cache))
+	if not item_codes:
+		return
+
+	for item in frappe.db.sql("""select name, item_group, brand, variant_of from tabItem
+		where name in ({0})""".format(", ".join(["%s"] * len(item_codes))), tuple(item_codes), as_dict=1):
+			lookup_cache[("Item", item.name)] = item
+
+	for item_code in item_codes:
+		lookup_cache.setdefault(("Item", item_code), None)
+
+def get_item_for_pricing_rule(item_code, lookup_cache):
+	if ("Item", item_code) not in lookup_cache:
+		lookup_cache[("Item", item_code)] = frappe.db.get_value("Item", item_code,
+			["name", "item_group", "brand", "variant_of"], as_dict=1)
+
+	return lookup_cache[("Item", item_code)]
+
 def remove_pricing_rule_for_item(pricing_rule, item_details):
 	pricing_rule = frappe.db.get_value('Pricing Rule', pricing_rule,
 		['price_or_discount', 'margin_type'], as_dict=1)
@@ -218,71 +260,113 @@ def remove_pricing_rules(item_list):
 
 	return out
 
-def get_pricing_rules(args):
-	def _get_tree_conditions(parenttype, allow_blank=True):
+def get_pricing_rules(args, lookup_cache=None):
+	"""
+		Pricing rules matching the item and party in `args`, in priority order,
+		resolved in memory against the compiled pricing rule index.
+	"""
+	if lookup_cache is None:
+		lookup_cache = {}
+
+	index = get_pricing_rule_index(lookup_cache)
+
+	# load variant of if not defined
+	if "variant_of" not in args:
+		item = get_item_for_pricing_rule(args.item_code, lookup_cache)
+		args.variant_of = item.variant_of if item else None
+
+	# rules on the item, its template, its brand or any parent of its item group
+	pricing_rules = {}
+	for field, values in (("item_code", [args.item_code, args.variant_of]), ("brand", [args.brand]),
+		("item_group", get_parent_groups("Item Group", args.item_group, lookup_cache) if args.item_group else [])):
+			for value in values:
+				for rule in index[field].get(value, []) if value else []:
+					pricing_rules[rule.name] = rule
+
+	parent_groups = {}
+	for parenttype in ["Customer Group", "Territory"]:
 		field = frappe.scrub(parenttype)
-		condition = ""
 		if args.get(field):
-			try:
-				lft, rgt = frappe.db.get_value(parenttype, args[field], ["lft", "rgt"])
-			except TypeError:
-				frappe.throw(_("Invalid {0}").format(args[field]))
+			parent_groups[field] = get_parent_groups(parenttype, args.get(field), lookup_cache) | set([""])
 
-			parent_groups = frappe.db.sql_list("""select name from `tab%s`
-				where lft<=%s and rgt>=%s""" % (parenttype, '%s', '%s'), (lft, rgt))
+	if not args.price_list: args.price_list = None
+	transaction_date = getdate(args.transaction_date) if args.get("transaction_date") else None
 
-			if parent_groups:
-				if allow_blank: parent_groups.append('')
-				condition = " ifnull("+field+", '') in ('" + \
-					"', '".join([frappe.db.escape(d) for d in parent_groups])+"')"
-		return condition
+	def is_applicable(rule):
+		if not rule.get(args.transaction_type):
+			return False
 
+		for field in ["company", "customer", "supplier", "supplier_type", "campaign", "sales_partner"]:
+			if cstr(rule.get(field)) not in (cstr(args.get(field)), ""):
+				return False
 
-	conditions = item_variant_condition = ""
-	values =  {"item_code": args.get("item_code"), "brand": args.get("brand")}
+		for field, groups in parent_groups.items():
+			if cstr(rule.get(field)) not in groups:
+				return False
 
-	for field in ["company", "customer", "supplier", "supplier_type", "campaign", "sales_partner"]:
-		if args.get(field):
-			conditions += " and ifnull("+field+", '') in (%("+field+")s, '')"
-			values[field] = args.get(field)
-		else:
-			conditions += " and ifnull("+field+", '') = ''"
+		if cstr(rule.for_price_list) not in (cstr(args.price_list), ""):
+			return False
 
-	for parenttype in ["Customer Group", "Territory"]:
-		group_condition = _get_tree_conditions(parenttype)
-		if group_condition:
-			conditions += " and " + group_condition
+		if transaction_date and not (getdate(rule.valid_from or "2000-01-01") <= transaction_date
+			<= getdate(rule.valid_upto or "2500-12-31")):
+				return False
 
-	if not args.price_list: args.price_list = None
-	conditions += " and ifnull(for_price_list, '') in (%(price_list)s, '')"
-	values["price_list"] = args.get("price_list")
+		return True
 
-	if args.get("transaction_date"):
-		conditions += """ and %(transaction_date)s between ifnull(valid_from, '2000-01-01')
-			and ifnull(valid_upto, '2500-12-31')"""
-		values['transaction_date'] = args.get('transaction_date')
+	# copies, as filter_pricing_rules sets variant_of on the rules
+	return [frappe._dict(rule) for rule in sorted(pricing_rules.values(),
+		key=lambda rule: (cstr(rule.priority), rule.name), reverse=True) if is_applicable(rule)]
 
-	item_group_condition = _get_tree_conditions("Item Group", False)
-	if item_group_condition:
-		item_group_condition = " or " + item_group_condition
+def get_parent_groups(parenttype, name, lookup_cache):
+	"""names of the group and all its parents in the tree"""
+	if (parenttype, name) not in lookup_cache:
+		try:
+			lft, rgt = frappe.db.get_value(parenttype, name, ["lft", "rgt"])
+		except TypeError:
+			frappe.throw(_("Invalid {0}").format(name))
 
-	# load variant of if not defined
-	if "variant_of" not in args:
-		args.variant_of = frappe.db.get_value("Item", args.item_code, "variant_of")
-
-	if args.variant_of:
-		item_variant_condition = ' or item_code=%(variant_of)s '
-		values['variant_of'] = args.variant_of
-
-	return frappe.db.sql("""select * from `tabPricing Rule`
-		where (item_code=%(item_code)s {item_variant_condition} {item_group_condition} or brand=%(brand)s)
-			and docstatus < 2 and disable = 0
-			and {transaction_type} = 1 {conditions}
-		order by priority desc, name desc""".format(
-			item_group_condition = item_group_condition,
-			item_variant_condition = item_variant_condition,
-			transaction_type = args.transaction_type,
-			conditions = conditions), values, as_dict=1)
+		lookup_cache[(parenttype, name)] = set(frappe.db.sql_list("""select name from `tab%s`
+			where lft<=%s and rgt>=%s""" % (parenttype, '%s', '%s'), (lft, rgt)))
+
+	return lookup_cache[(parenttype, name)]
+
+def get_pricing_rule_index(lookup_cache=None):
+	"""
+		Enabled pricing rules by item code, brand and item group. Compiled once per process
+		and version, see `get_pricing_rule_version`. The version is read once per `lookup_cache`,
+		i.e. once per transaction.
+	"""
+	if lookup_cache is None:
+		lookup_cache = {}
+
+	if "pricing_rule_version" not in lookup_cache:
+		lookup_cache["pricing_rule_version"] = get_pricing_rule_version()
+
+	version = lookup_cache["pricing_rule_version"]
+
+	cached = _pricing_rule_index.get(frappe.local.site)
+	if not cached or cached[0] != version:
+		index = frappe._dict(item_code={}, brand={}, item_group={})
+		for rule in frappe.db.sql("""select * from `tabPricing Rule`
+			where docstatus < 2 and disable = 0""", as_dict=1):
+				for field in ("item_code", "brand", "item_group"):
+					if rule.get(field):
+						index[field].setdefault(rule.get(field), []).append(rule)
+
+		cached = _pricing_rule_index[frappe.local.site] = (version, index)
+
+	return cached[1]
+
+def get_pricing_rule_version():
+	"""number of pricing rules and a checksum of all their values, computed by the database,
+		so that rules changed by direct updates or by other processes are compiled again"""
+	columns = ", ".join("ifnull(`{0}`, '')".format(d) for d in frappe.get_meta("Pricing Rule").get_valid_columns())
+
+	return tuple(frappe.db.sql("""select count(name), sum(crc32(concat_ws('|', {0})))
+		from `tabPricing Rule`""".format(columns))[0])
+
+def clear_pricing_rule_index():
+	_pricing_rule_index.pop(frappe.local.site, None)
 
 def filter_pricing_rules(args, pricing_rules):
 	# filter for qty
@@ -260,6 +260,37 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEquals(item.discount_amount, 110)
 		self.assertEquals(item.rate, 990)
 
+	def test_apply_pricing_rule_for_item_list(self):
+		from erpnext.accounts.doctype.pricing_rule.pricing_rule import apply_pricing_rule
+
+		make_pricing_rule(selling=1, discount_percentage=10)
+
+		args = {
+			"items": [
+				{"doctype": "Sales Order Item", "name": "row1", "item_code": "_Test Item", "qty": 1},
+				{"doctype": "Sales Order Item", "name": "row2", "item_code": "_Test Item 2", "qty": 1},
+				{"doctype": "Sales Order Item", "name": "row3", "item_code": "_Test Item", "qty": 5}
+			],
+			"customer": "_Test Customer",
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"transaction_type": "selling",
+			"doctype": "Sales Order",
+			"conversion_rate": 1
+		}
+
+		details = [d for d in apply_pricing_rule(args) if "pricing_rule" in d]
+		self.assertEquals([d.name for d in details], ["row1", "row2", "row3"])
+		self.assertEquals([d.get("discount_percentage") for d in details], [10, None, 10])
+
+		# saving a rule invalidates the compiled rules
+		rule = frappe.get_doc("Pricing Rule", details[0].pricing_rule)
+		rule.discount_percentage = 20
+		rule.save()
+
+		details = [d for d in apply_pricing_rule(args) if "pricing_rule" in d]
+		self.assertEquals(details[0].discount_percentage, 20)
+
 def make_pricing_rule(**args):
 	args = frappe._dict(args)
 
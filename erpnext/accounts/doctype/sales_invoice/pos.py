@@ -4,15 +4,32 @@
 from __future__ import unicode_literals
 import frappe, json
 from frappe import _
-from frappe.utils import nowdate
+from frappe.utils import nowdate, now, cint, cstr, getdate, get_datetime, add_to_date, time_diff_in_seconds
 from erpnext.setup.utils import get_exchange_rate
 from frappe.core.doctype.communication.email import make
 from erpnext.stock.get_item_details import get_pos_profile
 from erpnext.accounts.party import get_party_account_currency
 from erpnext.controllers.accounts_controller import get_taxes_and_charges
 
+# bump when the synced datasets change shape, clients with an older sync token then sync in full
+POS_SYNC_VERSION = 1
+
+# rows modified this many seconds before the last sync are sent again, so that rows
+# committed by transactions still running during the last sync are not missed
+POS_SYNC_OVERLAP = 300
+
 @frappe.whitelist()
-def get_pos_data():
+def get_pos_data(sync_token=None, columnar=0):
+	"""
+		Master data for offline POS.
+
+		With the `sync_token` returned by the previous call, items, customers (with their address
+		and contacts), serial nos, batches, item taxes, prices and stock levels only contain rows
+		modified since then, and `deleted` lists the keys to drop from each of them. The token
+		is ignored, and everything sent, if it is from another protocol version or POS Profile,
+		or if the POS Profile changed since. With `columnar`, lists of records are sent as
+		column names and rows of values.
+	"""
 	doc = frappe.new_doc('Sales Invoice')
 	doc.is_pos = 1;
 	pos_profile = get_pos_profile(doc.company) or {}
@@ -30,27 +47,147 @@ def get_pos_data():
 	update_multi_mode_option(doc, pos_profile)
 	default_print_format = pos_profile.get('print_format') or "Point of Sale"
 	print_template = frappe.db.get_value('Print Format', default_print_format, 'html')
-	customers = get_customers_list(pos_profile)
 
-	return {
+	# taken before reading, rows changed while reading are sent again next time
+	new_sync_token = make_sync_token(pos_profile)
+	modified_since = get_modified_since(sync_token, pos_profile)
+	customers = get_customers_list(pos_profile, modified_since)
+
+	data = {
 		'doc': doc,
 		'default_customer': pos_profile.get('customer'),
-		'items': get_items_list(pos_profile),
+		'items': get_items_list(pos_profile, modified_since),
 		'item_groups': get_item_groups(pos_profile),
 		'customers': customers,
 		'address': get_customers_address(customers),
 		'contacts': get_contacts(customers),
-		'serial_no_data': get_serial_no_data(pos_profile, doc.company),
-		'batch_no_data': get_batch_no_data(),
-		'tax_data': get_item_tax_data(),
-		'price_list_data': get_price_list_data(doc.selling_price_list),
-		'bin_data': get_bin_data(pos_profile),
+		'serial_no_data': get_serial_no_data(pos_profile, doc.company, modified_since),
+		'batch_no_data': get_batch_no_data(modified_since),
+		'tax_data': get_item_tax_data(modified_since),
+		'price_list_data': get_price_list_data(doc.selling_price_list, modified_since),
+		'bin_data': get_bin_data(pos_profile, modified_since),
 		'pricing_rules': get_pricing_rule_data(doc),
 		'print_template': print_template,
 		'pos_profile': pos_profile,
-		'meta': get_meta()
+		'meta': get_meta(),
+		'sync_token': new_sync_token,
+		'full_sync': 0 if modified_since else 1
 	}
 
+	if modified_since:
+		data['deleted'] = get_deleted_pos_data(pos_profile, doc, modified_since)
+
+	if cint(columnar):
+		data['items'] = to_columnar(data['items'])
+		data['customers'] = to_columnar(data['customers'])
+		data['address'] = to_columnar(data['address'], key='customer')
+		data['contacts'] = to_columnar(data['contacts'], key='customer')
+
+	return data
+
+def make_sync_token(pos_profile):
+	return "{0}|{1}|{2}".format(POS_SYNC_VERSION, cstr(pos_profile.get('name')), now())
+
+def get_modified_since(sync_token, pos_profile):
+	"""time from which rows are to be sent for the given sync token, None for a full sync"""
+	if not sync_token:
+		return None
+
+	try:
+		version, token = sync_token.split("|", 1)
+		pos_profile_name, timestamp = token.rsplit("|", 1)
+		timestamp = get_datetime(timestamp)
+	except ValueError:
+		return None
+
+	if cint(version) != POS_SYNC_VERSION or pos_profile_name != cstr(pos_profile.get('name')):
+		return None
+
+	# item groups, customer groups, warehouse and price list of the profile decide what is sent
+	if pos_profile.get('modified') and get_datetime(pos_profile.get('modified')) > timestamp:
+		return None
+
+	return add_to_date(timestamp, seconds=-POS_SYNC_OVERLAP)
+
+def to_columnar(data, key=None):
+	"""
+		Compact a list of records, or a dict of records by `key`, to column names and rows
+		of values, so that field names are not repeated in every row.
+	"""
+	if isinstance(data, dict):
+		records = []
+		for name, record in data.items():
+			record = dict(record)
+			record[key] = name
+			records.append(record)
+		data = records
+
+	columns = [key] if key else []
+	for record in data:
+		columns.extend(d for d in sorted(record) if d not in columns)
+
+	return {
+		'columns': columns,
+		'rows': [[record.get(d) for d in columns] for record in data]
+	}
+
+def get_deleted_pos_data(pos_profile, doc, modified_since):
+	"""keys to drop from each dataset, of rows deleted or no longer matching the profile since the last sync"""
+	return {
+		'items': get_removed_items(pos_profile, modified_since),
+		'customers': get_removed_customers(pos_profile, modified_since),
+		'serial_no_data': get_removed_serial_nos(pos_profile, doc.company, modified_since),
+		'batch_no_data': get_removed_batches(modified_since),
+		'price_list_data': get_removed_item_prices(doc.selling_price_list, modified_since)
+	}
+
+def get_deleted_documents(doctype, modified_since):
+	return frappe.db.sql("""select deleted_name, data from `tabDeleted Document`
+		where deleted_doctype=%s and creation > %s""", (doctype, modified_since), as_dict=1)
+
+def get_removed_items(pos_profile, modified_since):
+	cond, values = get_item_condition(pos_profile)
+	removed = frappe.db.sql_list("""select name from tabItem
+		where modified > %s and not (disabled = 0 and has_variants = 0 and is_sales_item = 1 and {cond})
+		""".format(cond=cond), tuple([modified_since] + values))
+
+	return removed + [d.deleted_name for d in get_deleted_documents('Item', modified_since)]
+
+def get_removed_customers(pos_profile, modified_since):
+	cond, values = get_customer_condition(pos_profile)
+	removed = frappe.db.sql_list("""select name from tabCustomer
+		where modified > %s and not (disabled = 0 and {cond})""".format(cond=cond),
+		tuple([modified_since] + values))
+
+	return removed + [d.deleted_name for d in get_deleted_documents('Customer', modified_since)]
+
+def get_removed_serial_nos(pos_profile, company, modified_since):
+	# delivered serial nos have no warehouse
+	cond, values = get_serial_no_condition(pos_profile)
+	values.update({'modified_since': modified_since, 'company': company})
+	removed = frappe.db.sql_list("""select name from `tabSerial No`
+		where modified > %(modified_since)s and company = %(company)s and not ({0})""".format(cond), values)
+
+	return removed + [d.deleted_name for d in get_deleted_documents('Serial No', modified_since)]
+
+def get_removed_batches(modified_since):
+	# batches that expired since the last sync are dropped as well
+	removed = frappe.db.sql_list("""select name from `tabBatch`
+		where (modified > %(modified_since)s or expiry_date >= %(since_date)s)
+		and ifnull(expiry_date, '4000-10-10') < curdate()""",
+		{'modified_since': modified_since, 'since_date': getdate(modified_since)})
+
+	return removed + [d.deleted_name for d in get_deleted_documents('Batch', modified_since)]
+
+def get_removed_item_prices(selling_price_list, modified_since):
+	removed = []
+	for d in get_deleted_documents('Item Price', modified_since):
+		item_price = json.loads(d.data)
+		if item_price.get('price_list') == selling_price_list:
+			removed.append(item_price.get('item_code'))
+
+	return removed
+
 def get_meta():
 	doctype_meta = {
 		'customer': frappe.get_meta('Customer'),
@@ -132,7 +269,7 @@ def update_tax_table(doc):
 	for tax in taxes:
 		doc.append('taxes', tax)
 
-def get_items_list(pos_profile):
+def get_item_condition(pos_profile):
 	cond = "1=1"
 	item_groups = []
 	if pos_profile.get('item_groups'):
@@ -141,6 +278,14 @@ def get_items_list(pos_profile):
 			item_groups.extend([d.name for d in get_child_nodes('Item Group', d.item_group)])
 		cond = "item_group in (%s)"%(', '.join(['%s']*len(item_groups)))
 
+	return cond, item_groups
+
+def get_items_list(pos_profile, modified_since=None):
+	cond, values = get_item_condition(pos_profile)
+	if modified_since:
+		cond += " and modified > %s"
+		values = values + [modified_since]
+
 	return frappe.db.sql(""" 
 		select
 			name, item_code, item_name, description, item_group, expense_account, has_batch_no,
@@ -150,7 +295,7 @@ def get_items_list(pos_profile):
 			tabItem
 		where
 			disabled = 0 and has_variants = 0 and is_sales_item = 1 and {cond}
-		""".format(cond=cond), tuple(item_groups), as_dict=1)
+		""".format(cond=cond), tuple(values), as_dict=1)
 
 def get_item_groups(pos_profile):
 	item_group_dict = {}
@@ -161,7 +306,7 @@ def get_item_groups(pos_profile):
 		item_group_dict[data.name] = [data.lft, data.rgt]
 	return item_group_dict
 
-def get_customers_list(pos_profile={}):
+def get_customer_condition(pos_profile):
 	cond = "1=1"
 	customer_groups = []
 	if pos_profile.get('customer_groups'):
@@ -170,59 +315,80 @@ def get_customers_list(pos_profile={}):
 			customer_groups.extend([d.name for d in get_child_nodes('Customer Group', d.customer_group)])
 		cond = "customer_group in (%s)"%(', '.join(['%s']*len(customer_groups)))
 
+	return cond, customer_groups
+
+def get_customers_list(pos_profile={}, modified_since=None):
+	cond, values = get_customer_condition(pos_profile)
+	if modified_since:
+		# a changed address or contact is sent with its customer
+		cond += """ and (modified > %s or name in (select link_name from `tabDynamic Link`
+			where link_doctype = 'Customer' and parenttype in ('Address', 'Contact') and modified > %s))"""
+		values = values + [modified_since, modified_since]
+
 	return frappe.db.sql(""" select name, customer_name, customer_group,
 		territory, customer_pos_id from tabCustomer where disabled = 0
-		and {cond}""".format(cond=cond), tuple(customer_groups), as_dict=1) or {}
+		and {cond}""".format(cond=cond), tuple(values), as_dict=1) or {}
+
+def get_linked_records(doctype, fields, filters, customers, chunk_size=1000):
+	"""first `doctype` record matching `filters` linked to each of the customers, in one query per chunk"""
+	records = {}
+	for i in range(0, len(customers), chunk_size):
+		names = [d.name for d in customers[i:i + chunk_size]]
+		for d in frappe.db.sql(""" select dl.link_name as customer, {fields}
+			from `tab{doctype}` rec, `tabDynamic Link` dl
+			where dl.parent = rec.name and dl.parenttype = %s and dl.link_doctype = 'Customer'
+			and dl.link_name in ({names}) and {filters}""".format(doctype=doctype,
+			fields=", ".join("rec.{0}".format(f) for f in fields), filters=filters,
+			names=", ".join(["%s"] * len(names))), tuple([doctype] + names), as_dict=1):
+				records.setdefault(d.pop('customer'), d)
+
+	return records
 
 def get_customers_address(customers):
 	customer_address = {}
 	if isinstance(customers, basestring):
 		customers = [frappe._dict({'name': customers})]
 
-	for data in customers:
-		address = frappe.db.sql(""" select name, address_line1, address_line2, city, state,
-			email_id, phone, fax, pincode from `tabAddress` where is_primary_address =1 and name in
-			(select parent from `tabDynamic Link` where link_doctype = 'Customer' and link_name = %s
-			and parenttype = 'Address')""", data.name, as_dict=1)
-		address_data = {}
-		if address: address_data = address[0]
+	addresses = get_linked_records('Address', ['name', 'address_line1', 'address_line2', 'city', 'state',
+		'email_id', 'phone', 'fax', 'pincode'], 'rec.is_primary_address = 1', customers)
 
+	for data in customers:
+		address_data = addresses.get(data.name) or {}
 		address_data.update({'full_name': data.customer_name, 'customer_pos_id': data.customer_pos_id})
 		customer_address[data.name] = address_data
 
 	return customer_address
 
 def get_contacts(customers):
-	customer_contact = {}
 	if isinstance(customers, basestring):
 		customers = [frappe._dict({'name': customers})]
 
-	for data in customers:
-		contact = frappe.db.sql(""" select email_id, phone, mobile_no from `tabContact` 
-			where is_primary_contact =1 and name in
-			(select parent from `tabDynamic Link` where link_doctype = 'Customer' and link_name = %s
-			and parenttype = 'Contact')""", data.name, as_dict=1)
-		if contact: 
-			customer_contact[data.name] = contact[0]
-
-	return customer_contact
+	return get_linked_records('Contact', ['email_id', 'phone', 'mobile_no'],
+		'rec.is_primary_contact = 1', customers)
 
 def get_child_nodes(group_type, root):
 	lft, rgt = frappe.db.get_value(group_type, root, ["lft", "rgt"])
 	return frappe.db.sql(""" Select name, lft, rgt from `tab{tab}` where
 			lft >= {lft} and rgt <= {rgt} order by lft""".format(tab=group_type, lft=lft, rgt=rgt), as_dict=1)
 
-def get_serial_no_data(pos_profile, company):
+def get_serial_no_condition(pos_profile):
+	if pos_profile.get('update_stock') and pos_profile.get('warehouse'):
+		return "ifnull(warehouse, '') = %(warehouse)s", {'warehouse': pos_profile.get('warehouse')}
+
+	return "1=1", {}
+
+def get_serial_no_data(pos_profile, company, modified_since=None):
 	# get itemwise serial no data
 	# example {'Nokia Lumia 1020': {'SN0001': 'Pune'}}
 	# where Nokia Lumia 1020 is item code, SN0001 is serial no and Pune is warehouse
 
-	cond = "1=1"
-	if pos_profile.get('update_stock') and pos_profile.get('warehouse'):
-		cond = "warehouse = '{0}'".format(pos_profile.get('warehouse'))
+	cond, values = get_serial_no_condition(pos_profile)
+	if modified_since:
+		cond += " and modified > %(modified_since)s"
 
+	values.update({'company': company, 'modified_since': modified_since})
 	serial_nos = frappe.db.sql("""select name, warehouse, item_code from `tabSerial No` where {0}
-				and company = %(company)s """.format(cond), {'company': company}, as_dict=1)
+				and company = %(company)s """.format(cond), values, as_dict=1)
 
 	itemwise_serial_no = {}
 	for sn in serial_nos:
@@ -232,14 +398,16 @@ def get_serial_no_data(pos_profile, company):
 
 	return itemwise_serial_no
 
-def get_batch_no_data():
+def get_batch_no_data(modified_since=None):
 	# get itemwise batch no data
 	# exmaple: {'LED-GRE': [Batch001, Batch002]}
 	# where LED-GRE is item code, SN0001 is serial no and Pune is warehouse
 
 	itemwise_batch = {}
 	batches = frappe.db.sql("""select name, item from `tabBatch`
-		where ifnull(expiry_date, '4000-10-10') >= curdate()""", as_dict=1)
+		where ifnull(expiry_date, '4000-10-10') >= curdate() {0}""".format(
+			"and modified > %(modified_since)s" if modified_since else ""),
+		{'modified_since': modified_since}, as_dict=1)
 
 	for batch in batches:
 		if batch.item not in itemwise_batch:
@@ -248,12 +416,20 @@ def get_batch_no_data():
 
 	return itemwise_batch
 
-def get_item_tax_data():
+def get_item_tax_data(modified_since=None):
 	# get default tax of an item
 	# example: {'Consulting Services': {'Excise 12 - TS': '12.000'}}
 
 	itemwise_tax = {}
-	taxes = frappe.db.sql(""" select parent, tax_type, tax_rate from `tabItem Tax`""", as_dict=1)
+	cond = ""
+	if modified_since:
+		# the taxes of every changed item are sent, even if none are left
+		for item_code in frappe.db.sql_list("""select name from tabItem where modified > %s""", modified_since):
+			itemwise_tax[item_code] = {}
+		cond = "where parent in (select name from tabItem where modified > %(modified_since)s)"
+
+	taxes = frappe.db.sql(""" select parent, tax_type, tax_rate from `tabItem Tax` {0}""".format(cond),
+		{'modified_since': modified_since}, as_dict=1)
 
 	for tax in taxes:
 		if tax.parent not in itemwise_tax:
@@ -262,25 +438,32 @@ def get_item_tax_data():
 
 	return itemwise_tax
 
-def get_price_list_data(selling_price_list):
+def get_price_list_data(selling_price_list, modified_since=None):
 	itemwise_price_list = {}
 	price_lists = frappe.db.sql("""Select ifnull(price_list_rate, 0) as price_list_rate,
-		item_code from `tabItem Price` ip where price_list = %(price_list)s""",
-		{'price_list': selling_price_list}, as_dict=1)
+		item_code from `tabItem Price` ip where price_list = %(price_list)s {0}""".format(
+			"and modified > %(modified_since)s" if modified_since else ""),
+		{'price_list': selling_price_list, 'modified_since': modified_since}, as_dict=1)
 
 	for item in price_lists:
 		itemwise_price_list[item.item_code] = item.price_list_rate
 
 	return itemwise_price_list
 
-def get_bin_data(pos_profile):
+def get_bin_data(pos_profile, modified_since=None):
 	itemwise_bin_data = {}
 	cond = "1=1"
 	if pos_profile.get('warehouse'):
 		cond = "warehouse = '{0}'".format(pos_profile.get('warehouse'))
 
+	if modified_since:
+		# Bins that ran out of stock are sent too, to overwrite their last qty
+		cond += " and modified > %(modified_since)s"
+	else:
+		cond += " and actual_qty > 0"
+
 	bin_data = frappe.db.sql(""" select item_code, warehouse, actual_qty from `tabBin`
-		where actual_qty > 0 and {cond}""".format(cond=cond), as_dict=1)
+		where {cond}""".format(cond=cond), {'modified_since': modified_since}, as_dict=1)
 
 	for bins in bin_data:
 		if bins.item_code not in itemwise_bin_data:
@@ -312,18 +495,12 @@ def make_invoice(doc_list={}, email_queue_list={}, customers_list={}):
 		customers_list = json.loads(customers_list)
 
 	customers_list = make_customer_and_address(customers_list)
+	synced_invoices = get_synced_invoices([cstr(name) for docs in doc_list for name in docs])
 	name_list = []
 	for docs in doc_list:
 		for name, doc in docs.items():
-			if not frappe.db.exists('Sales Invoice', {'offline_pos_name': name}):
-				validate_records(doc)
-				si_doc = frappe.new_doc('Sales Invoice')
-				si_doc.offline_pos_name = name
-				si_doc.update(doc)
-				si_doc.set_posting_time = 1
-				si_doc.customer = get_customer_id(doc)
-				si_doc.due_date = doc.get('posting_date')
-				name_list = submit_invoice(si_doc, name, doc, name_list)
+			if cstr(name) not in synced_invoices:
+				name_list = make_pos_invoice(name, doc, name_list)
 			else:
 				name_list.append(name)
 
@@ -338,6 +515,148 @@ def make_invoice(doc_list={}, email_queue_list={}, customers_list={}):
 		'synced_contacts': get_contacts(customers)
 	}
 
+# offline invoices submitted by one background job
+POS_INVOICE_CHUNK_SIZE = 20
+# seconds a job may run, invoices still queued after that are queued again
+POS_INVOICE_JOB_TIMEOUT = 1500
+
+@frappe.whitelist()
+def enqueue_invoices(doc_list={}, email_queue_list={}, customers_list={}):
+	"""
+		Queue offline POS invoices to be submitted in chunks by background workers.
+
+		Returns the invoices already synced, which the client can drop, and those queued, whose
+		status can be polled with `get_invoice_sync_status`. Invoices still queued are skipped
+		when sent again, unless queued longer than the job timeout. Failed ones are queued again.
+		Emails are sent for invoices already made only, the others are sent by a later sync.
+	"""
+	if isinstance(doc_list, basestring):
+		doc_list = json.loads(doc_list)
+
+	if isinstance(email_queue_list, basestring):
+		email_queue_list = json.loads(email_queue_list)
+
+	if isinstance(customers_list, basestring):
+		customers_list = json.loads(customers_list)
+
+	customers_list = make_customer_and_address(customers_list)
+
+	invoices = [(cstr(name), doc) for docs in doc_list for name, doc in docs.items()]
+	synced_invoices = get_synced_invoices([d[0] for d in invoices])
+	sync_status = get_invoice_sync_status_from_cache([d[0] for d in invoices])
+
+	to_queue = [d for d in invoices if d[0] not in synced_invoices
+		and not is_invoice_in_queue(sync_status.get(d[0]))]
+	queued = [d[0] for d in invoices if d[0] not in synced_invoices]
+
+	# emails of the other invoices stay with the client until their invoice is made
+	email_queue = make_email_queue(dict((key, data) for key, data in email_queue_list.items()
+		if key in synced_invoices))
+
+	for i in range(0, len(to_queue), POS_INVOICE_CHUNK_SIZE):
+		chunk = to_queue[i:i + POS_INVOICE_CHUNK_SIZE]
+		for name, doc in chunk:
+			set_invoice_sync_status(name, 'Queued')
+
+		frappe.enqueue('erpnext.accounts.doctype.sales_invoice.pos.ingest_invoices', queue='long',
+			timeout=POS_INVOICE_JOB_TIMEOUT, invoices=chunk, now=frappe.flags.in_test)
+
+	return {
+		'invoice': list(synced_invoices),
+		'queued': queued,
+		'email_queue': email_queue,
+		'customers': customers_list
+	}
+
+def is_invoice_in_queue(sync_status):
+	"""queued or being made, and not lost with a killed or timed out job"""
+	return bool(sync_status and sync_status.get('status') == 'Queued' and sync_status.get('timestamp')
+		and time_diff_in_seconds(now(), sync_status.get('timestamp')) < POS_INVOICE_JOB_TIMEOUT)
+
+def ingest_invoices(invoices):
+	"""background job: make a chunk of offline POS invoices, in order of posting"""
+	from erpnext.stock.utils import get_posting_datetime
+
+	# posting in order appends to the stock ledger instead of reposting later entries
+	invoices = sorted(invoices, key=lambda d: get_posting_datetime(d[1].get('posting_date') or nowdate(),
+		d[1].get('posting_time')))
+
+	synced_invoices = get_synced_invoices([d[0] for d in invoices])
+	# the job timeout runs from now, not from when the chunk was queued
+	for name, doc in invoices:
+		if name not in synced_invoices:
+			set_invoice_sync_status(name, 'Queued')
+
+	for name, doc in invoices:
+		try:
+			if name in synced_invoices or make_pos_invoice(name, doc, []):
+				clear_invoice_sync_status(name)
+			else:
+				set_invoice_sync_status(name, 'Failed', _("Invoice could not be saved, please check the Error Log"))
+		except Exception:
+			frappe.db.rollback()
+			set_invoice_sync_status(name, 'Failed', frappe.get_traceback())
+
+	frappe.db.commit()
+
+@frappe.whitelist()
+def get_invoice_sync_status(offline_pos_names):
+	"""
+		{offline_pos_name: {'status', 'invoice', 'error'}}, status being Submitted or Draft
+		once the invoice is made, else Queued, Failed or Unknown
+	"""
+	if isinstance(offline_pos_names, basestring):
+		offline_pos_names = json.loads(offline_pos_names)
+
+	synced_invoices = get_synced_invoices(offline_pos_names)
+	sync_status = get_invoice_sync_status_from_cache(offline_pos_names)
+
+	status = {}
+	for name in offline_pos_names:
+		if name in synced_invoices:
+			invoice, docstatus = synced_invoices[name]
+			status[name] = {'status': 'Submitted' if docstatus == 1 else 'Draft', 'invoice': invoice}
+		else:
+			status[name] = sync_status.get(name) or {'status': 'Unknown'}
+
+	return status
+
+def get_synced_invoices(offline_pos_names):
+	"""{offline_pos_name: (name, docstatus)} of the invoices already made, in one query"""
+	if not offline_pos_names:
+		return {}
+
+	return dict((d[0], (d[1], d[2])) for d in frappe.db.sql("""select offline_pos_name, name, docstatus
+		from `tabSales Invoice` where offline_pos_name in ({0}) and docstatus < 2""".format(
+			", ".join(["%s"] * len(offline_pos_names))), tuple(offline_pos_names)))
+
+def get_invoice_sync_status_from_cache(offline_pos_names):
+	status = {}
+	for name in offline_pos_names:
+		value = frappe.cache().hget('pos_invoice_sync_status', name)
+		if value:
+			status[name] = value
+
+	return status
+
+def set_invoice_sync_status(offline_pos_name, status, error=None):
+	frappe.cache().hset('pos_invoice_sync_status', offline_pos_name,
+		{'status': status, 'error': error, 'timestamp': now()})
+
+def clear_invoice_sync_status(offline_pos_name):
+	frappe.cache().hdel('pos_invoice_sync_status', offline_pos_name)
+
+def make_pos_invoice(name, doc, name_list):
+	"""submit the offline invoice, or save it as draft if it cannot be submitted"""
+	validate_records(doc)
+	si_doc = frappe.new_doc('Sales Invoice')
+	si_doc.offline_pos_name = name
+	si_doc.update(doc)
+	si_doc.set_posting_time = 1
+	si_doc.customer = get_customer_id(doc)
+	si_doc.due_date = doc.get('posting_date')
+	return submit_invoice(si_doc, name, doc, name_list)
+
 def validate_records(doc):
 	validate_item(doc)
 
@@ -4,8 +4,8 @@ from __future__ import unicode_literals
 
 import frappe
 
-import unittest, copy, time
-from frappe.utils import nowdate, flt, getdate, cint
+import unittest, copy, time, json
+from frappe.utils import nowdate, flt, getdate, cint, cstr, now, add_to_date
 from frappe.model.dynamic_links import get_dynamic_link_map
 from erpnext.stock.doctype.stock_entry.test_stock_entry import make_stock_entry, get_qty_after_transaction
 from erpnext.accounts.doctype.purchase_invoice.test_purchase_invoice import unlink_payment_on_cancel_of_invoice
@@ -716,6 +716,113 @@ class TestSalesInvoice(unittest.TestCase):
 		if allow_negative_stock:
 			frappe.db.set_value('Stock Settings', None, 'allow_negative_stock', 1)
 
+	def test_enqueue_pos_invoices(self):
+		from erpnext.accounts.doctype.sales_invoice.pos import enqueue_invoices, get_invoice_sync_status
+
+		set_perpetual_inventory()
+
+		make_pos_profile()
+		self._insert_purchase_receipt()
+
+		pos = copy.deepcopy(test_records[1])
+		pos["is_pos"] = 1
+		pos["update_stock"] = 1
+		pos["payments"] = [{'mode_of_payment': 'Bank Draft', 'account': '_Test Bank - _TC', 'amount': 300},
+							{'mode_of_payment': 'Cash', 'account': 'Cash - _TC', 'amount': 330}]
+
+		offline_pos_name = cstr(cint(time.time())) + '-queued'
+		email_queue_list = {offline_pos_name: json.dumps({'subject': 'POS Invoice', 'content': 'Invoice',
+			'recipients': 'test@example.com'})}
+		result = enqueue_invoices([{offline_pos_name: pos}], email_queue_list)
+		self.assertEquals(result.get('queued'), [offline_pos_name])
+		# the email is kept by the client until its invoice is reported as made
+		self.assertEquals(result.get('email_queue'), [])
+
+		# jobs run at once in tests
+		status = get_invoice_sync_status([offline_pos_name])[offline_pos_name]
+		self.assertEquals(status.get('status'), 'Submitted')
+
+		# sent again, the invoice is reported as synced and not made twice
+		result = enqueue_invoices([{offline_pos_name: pos}])
+		self.assertEquals(result.get('invoice'), [offline_pos_name])
+		self.assertEquals(len(frappe.get_all('Sales Invoice', filters={'offline_pos_name': offline_pos_name})), 1)
+
+	def test_requeue_lost_pos_invoices(self):
+		from erpnext.accounts.doctype.sales_invoice.pos import (enqueue_invoices, get_invoice_sync_status,
+			POS_INVOICE_JOB_TIMEOUT)
+
+		make_pos_profile()
+		pos = copy.deepcopy(test_records[1])
+		pos["is_pos"] = 1
+		pos["payments"] = [{'mode_of_payment': 'Cash', 'account': 'Cash - _TC', 'amount': 630}]
+
+		# queued by a job that is still running
+		offline_pos_name = cstr(cint(time.time())) + '-running'
+		frappe.cache().hset('pos_invoice_sync_status', offline_pos_name, {'status': 'Queued', 'timestamp': now()})
+		enqueue_invoices([{offline_pos_name: pos}])
+		self.assertEquals(get_invoice_sync_status([offline_pos_name])[offline_pos_name].get('status'), 'Queued')
+
+		# queued by a job that was killed or timed out
+		offline_pos_name = cstr(cint(time.time())) + '-lost'
+		frappe.cache().hset('pos_invoice_sync_status', offline_pos_name, {'status': 'Queued',
+			'timestamp': add_to_date(now(), seconds=-POS_INVOICE_JOB_TIMEOUT - 60)})
+		enqueue_invoices([{offline_pos_name: pos}])
+		self.assertEquals(get_invoice_sync_status([offline_pos_name])[offline_pos_name].get('status'), 'Submitted')
+
+		frappe.db.sql("delete from `tabPOS Profile`")
+
+	def test_pos_data_delta_sync(self):
+		from erpnext.accounts.doctype.sales_invoice.pos import get_pos_data
+
+		make_pos_profile()
+
+		data = get_pos_data()
+		self.assertEquals(data.get('full_sync'), 1)
+		self.assertTrue(data.get('sync_token'))
+
+		frappe.db.set_value('Item', '_Test Item', 'description', '_Test Item synced')
+		delta = get_pos_data(sync_token=data.get('sync_token'))
+		self.assertEquals(delta.get('full_sync'), 0)
+		self.assertTrue('_Test Item' in [d.name for d in delta.get('items')])
+		self.assertTrue(len(delta.get('items')) <= len(data.get('items')))
+		self.assertTrue('deleted' in delta)
+
+		# a token of another protocol version falls back to a full sync
+		self.assertEquals(get_pos_data(sync_token='0|' + data.get('sync_token').split('|', 1)[1]).get('full_sync'), 1)
+
+		columnar = get_pos_data(sync_token=data.get('sync_token'), columnar=1)
+		item = dict(zip(columnar['items']['columns'], columnar['items']['rows'][0]))
+		self.assertTrue('item_code' in item)
+
+	def test_pos_data_delta_sync_of_delivered_serial_no(self):
+		from erpnext.accounts.doctype.sales_invoice.pos import get_pos_data
+		from erpnext.stock.doctype.stock_entry.test_stock_entry import make_serialized_item
+		from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
+
+		make_pos_profile()
+		frappe.db.set_value('POS Profile', '_Test POS Profile', 'update_stock', 1)
+
+		se = make_serialized_item()
+		serial_no = get_serial_nos(se.get("items")[0].serial_no)[0]
+
+		data = get_pos_data()
+		self.assertTrue(serial_no in data.get('serial_no_data').get('_Test Serialized Item With Series', {}))
+
+		si = frappe.copy_doc(test_records[0])
+		si.update_stock = 1
+		si.get("items")[0].item_code = "_Test Serialized Item With Series"
+		si.get("items")[0].qty = 1
+		si.get("items")[0].serial_no = serial_no
+		si.insert()
+		si.submit()
+
+		# the delivered serial no is removed from the terminal
+		delta = get_pos_data(sync_token=data.get('sync_token'))
+		self.assertTrue(serial_no in delta.get('deleted').get('serial_no_data'))
+		self.assertFalse(serial_no in delta.get('serial_no_data').get('_Test Serialized Item With Series', {}))
+
+		frappe.db.sql("delete from `tabPOS Profile`")
+
 	def pos_gl_entry(self, si, pos, cash_amount):
 		# check stock ledger entries
 		sle = frappe.db.sql("""select * from `tabStock Ledger Entry`
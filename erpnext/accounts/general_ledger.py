@@ -7,10 +7,16 @@ from frappe.utils import flt, cstr, cint
 from frappe import _
 from frappe.model.meta import get_field_precision
 from erpnext.accounts.doctype.budget.budget import validate_expense_against_budget
+from erpnext.utilities.bulk import bulk_insert
+from erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot import \
+	update_account_balance_snapshots, remove_voucher_from_account_balance_snapshots
 
 
 class StockAccountInvalidTransaction(frappe.ValidationError): pass
 
+# gl maps with at least these many rows are validated and inserted in bulk
+BULK_GL_ENTRY_THRESHOLD = 100
+
 def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes', from_repost=False):
 	if gl_map:
 		if not cancel:
@@ -49,10 +55,12 @@ def process_gl_map(gl_map, merge_entries=True):
 
 def merge_similar_entries(gl_map):
 	merged_gl_map = []
+	merged_entries = {}
 	for entry in gl_map:
 		# if there is already an entry in this account then just add it
 		# to that entry
-		same_head = check_if_in_list(entry, merged_gl_map)
+		key = get_merge_key(entry)
+		same_head = merged_entries.get(key)
 		if same_head:
 			same_head.debit	= flt(same_head.debit) + flt(entry.debit)
 			same_head.debit_in_account_currency	= \
@@ -61,22 +69,18 @@ def merge_similar_entries(gl_map):
 			same_head.credit_in_account_currency = \
 				flt(same_head.credit_in_account_currency) + flt(entry.credit_in_account_currency)
 		else:
+			merged_entries[key] = entry
 			merged_gl_map.append(entry)
 
 	# filter zero debit and credit entries
-	merged_gl_map = filter(lambda x: flt(x.debit, 9)!=0 or flt(x.credit, 9)!=0, merged_gl_map)
+	merged_gl_map = [d for d in merged_gl_map if flt(d.debit, 9)!=0 or flt(d.credit, 9)!=0]
 	return merged_gl_map
 
-def check_if_in_list(gle, gl_map):
-	for e in gl_map:
-		if e.account == gle.account \
-			and cstr(e.get('party_type'))==cstr(gle.get('party_type')) \
-			and cstr(e.get('party'))==cstr(gle.get('party')) \
-			and cstr(e.get('against_voucher'))==cstr(gle.get('against_voucher')) \
-			and cstr(e.get('against_voucher_type')) == cstr(gle.get('against_voucher_type')) \
-			and cstr(e.get('cost_center')) == cstr(gle.get('cost_center')) \
-			and cstr(e.get('project')) == cstr(gle.get('project')):
-				return e
+def get_merge_key(gle):
+	"""entries with the same key are merged into one by merge_similar_entries"""
+	return (gle.account, cstr(gle.get('party_type')), cstr(gle.get('party')),
+		cstr(gle.get('against_voucher')), cstr(gle.get('against_voucher_type')),
+		cstr(gle.get('cost_center')), cstr(gle.get('project')))
 
 def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
 	if not from_repost:
@@ -84,12 +88,17 @@ def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
 		
 	round_off_debit_credit(gl_map)
 
-	for entry in gl_map:
-		make_entry(entry, adv_adj, update_outstanding, from_repost)
-		
-		# check against budget
-		if not from_repost:
-			validate_expense_against_budget(entry)
+	if len(gl_map) >= BULK_GL_ENTRY_THRESHOLD:
+		save_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost)
+	else:
+		for entry in gl_map:
+			make_entry(entry, adv_adj, update_outstanding, from_repost)
+
+			# check against budget
+			if not from_repost:
+				validate_expense_against_budget(entry)
+
+	update_account_balance_snapshots(gl_map)
 
 def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	args.update({"doctype": "GL Entry"})
@@ -100,6 +109,86 @@ def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	gle.run_method("on_update_with_args", adv_adj, update_outstanding, from_repost)
 	gle.submit()
 
+def save_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost=False):
+	"""
+		Validate the gl_map once per distinct set of validation inputs and insert all rows
+		with multi-row inserts. Account checks, outstanding amounts and budgets are then
+		processed once per account, against voucher and (account, cost center) respectively
+		instead of once per row.
+	"""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_balance_type, \
+		update_outstanding_amt, validate_frozen_account
+
+	gl_entries = validate_gl_map_in_bulk(gl_map, adv_adj, from_repost)
+	bulk_insert("GL Entry", gl_entries, "GL", 7, docstatus=1)
+
+	accounts, against_vouchers, budget_heads = [], [], {}
+	for gle in gl_entries:
+		if gle.account not in accounts:
+			accounts.append(gle.account)
+
+		if gle.against_voucher_type in ['Journal Entry', 'Sales Invoice', 'Purchase Invoice', 'Fees'] \
+			and gle.against_voucher and update_outstanding == 'Yes' and not from_repost:
+				key = (gle.account, gle.party_type, gle.party, gle.against_voucher_type, gle.against_voucher)
+				if key not in against_vouchers:
+					against_vouchers.append(key)
+
+		# budget is checked against the posted total, so one row per head is enough
+		budget_heads.setdefault((gle.account, gle.cost_center, gle.project,
+			gle.fiscal_year, gle.posting_date), gle)
+
+	for account in accounts:
+		validate_frozen_account(account, adv_adj)
+		validate_balance_type(account, adv_adj)
+
+	for account, party_type, party, against_voucher_type, against_voucher in against_vouchers:
+		update_outstanding_amt(account, party_type, party, against_voucher_type, against_voucher)
+
+	if not from_repost:
+		for gle in budget_heads.values():
+			validate_expense_against_budget(gle.as_dict())
+
+def validate_gl_map_in_bulk(gl_map, adv_adj, from_repost=False):
+	"""
+		Run GL Entry validations for the first row of each distinct combination of
+		account, party, cost center, project and posting date, and copy the values set
+		during validation to the other rows of that combination.
+	"""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import check_freezing_date
+
+	validated, posting_dates, gl_entries = {}, [], []
+	for args in gl_map:
+		args.update({"doctype": "GL Entry"})
+		gle = frappe.get_doc(args)
+		gle.flags.from_repost = from_repost
+		# same defaults as Document.insert
+		gle._set_defaults()
+
+		key = (gle.account, cstr(gle.party_type), cstr(gle.party), cstr(gle.cost_center),
+			cstr(gle.project), gle.company, cstr(gle.is_opening), cstr(gle.account_currency),
+			cstr(gle.posting_date), cstr(gle.fiscal_year))
+
+		if key not in validated:
+			gle.validate()
+			if not from_repost:
+				gle.validate_account_details(adv_adj)
+			validated[key] = gle
+		else:
+			if not (flt(gle.debit) or flt(gle.credit)):
+				frappe.throw(_("{0} {1}: Either debit or credit amount is required for {2}")
+					.format(gle.voucher_type, gle.voucher_no, gle.account))
+
+			for fieldname in ("cost_center", "project", "account_currency", "fiscal_year"):
+				gle.set(fieldname, validated[key].get(fieldname))
+
+		if not from_repost and gle.posting_date not in posting_dates:
+			check_freezing_date(gle.posting_date, adv_adj)
+			posting_dates.append(gle.posting_date)
+
+		gl_entries.append(gle)
+
+	return gl_entries
+
 def validate_account_for_perpetual_inventory(gl_map):
 	if cint(erpnext.is_perpetual_inventory_enabled(gl_map[0].company)) \
 		and gl_map[0].voucher_type=="Journal Entry":
@@ -185,6 +274,9 @@ def delete_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 	if gl_entries:
 		check_freezing_date(gl_entries[0]["posting_date"], adv_adj)
 
+	remove_voucher_from_account_balance_snapshots(voucher_type or gl_entries[0]["voucher_type"],
+		voucher_no or gl_entries[0]["voucher_no"])
+
 	frappe.db.sql("""delete from `tabGL Entry` where voucher_type=%s and voucher_no=%s""",
 		(voucher_type or gl_entries[0]["voucher_type"], voucher_no or gl_entries[0]["voucher_no"]))
 
@@ -276,11 +276,23 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 
 	get_data_from_server: function (callback) {
 		var me = this;
+		var master_data = this.get_master_data();
 		frappe.call({
 			method: "erpnext.accounts.doctype.sales_invoice.pos.get_pos_data",
+			args: {
+				// only the rows changed since the last sync are sent with the token
+				sync_token: master_data ? master_data.sync_token : null,
+				columnar: 1
+			},
 			freeze: true,
 			freeze_message: __("Master data syncing, it might take some time"),
 			callback: function (r) {
+				r.message = me.decode_columnar_data(r.message);
+				if (master_data && !r.message.full_sync) {
+					r.message = me.merge_master_data(master_data, r.message);
+				}
+
+				me.update_master_data(r.message);
 				localStorage.setItem('doc', JSON.stringify(r.message.doc));
 				me.init_master_data(r)
 				me.set_interval_for_si_sync();
@@ -292,6 +304,121 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 		})
 	},
 
+	get_master_data: function () {
+		try {
+			return JSON.parse(localStorage.getItem('pos_master_data'));
+		} catch (e) {
+			return null
+		}
+	},
+
+	update_master_data: function (data) {
+		try {
+			localStorage.setItem('pos_master_data', JSON.stringify(data));
+		} catch (e) {
+			// does not fit, the next sync is a full sync
+			localStorage.removeItem('pos_master_data');
+		}
+	},
+
+	decode_columnar_data: function (data) {
+		var to_records = function (columnar) {
+			return $.map(columnar.rows, function (row) {
+				var record = {};
+				$.each(columnar.columns, function (i, column) {
+					record[column] = row[i];
+				})
+				return record;
+			})
+		}
+
+		var to_dict = function (columnar, key) {
+			var records = {};
+			$.each(to_records(columnar), function (i, record) {
+				records[record[key]] = record;
+				delete record[key];
+			})
+			return records;
+		}
+
+		data.items = to_records(data.items);
+		data.customers = to_records(data.customers);
+		data.address = to_dict(data.address, 'customer');
+		data.contacts = to_dict(data.contacts, 'customer');
+		return data;
+	},
+
+	merge_master_data: function (data, delta) {
+		// delta has the changed rows of each dataset and the keys deleted from them in `deleted`
+		var deleted = delta.deleted || {};
+		var merged = $.extend({}, delta);
+
+		var merge_records = function (records, changed, deleted_names) {
+			var changed_names = {};
+			$.each(changed, function (i, record) {
+				changed_names[record.name] = true;
+			})
+			$.each(deleted_names || [], function (i, name) {
+				changed_names[name] = true;
+			})
+
+			return $.grep(records || [], function (record) {
+				return !changed_names[record.name];
+			}).concat(changed);
+		}
+
+		var merge_itemwise = function (itemwise_data, changed) {
+			itemwise_data = itemwise_data || {};
+			$.each(changed, function (item_code, values) {
+				itemwise_data[item_code] = $.extend(itemwise_data[item_code] || {}, values);
+			})
+			return itemwise_data;
+		}
+
+		merged.items = merge_records(data.items, delta.items, deleted.items);
+		merged.customers = merge_records(data.customers, delta.customers, deleted.customers);
+
+		merged.address = $.extend(data.address || {}, delta.address);
+		merged.contacts = $.extend(data.contacts || {}, delta.contacts);
+		$.each(deleted.customers || [], function (i, customer) {
+			delete merged.address[customer];
+			delete merged.contacts[customer];
+		})
+
+		merged.serial_no_data = merge_itemwise(data.serial_no_data, delta.serial_no_data);
+		$.each(deleted.serial_no_data || [], function (i, serial_no) {
+			$.each(merged.serial_no_data, function (item_code, serial_nos) {
+				delete serial_nos[serial_no];
+			})
+		})
+
+		merged.batch_no_data = data.batch_no_data || {};
+		$.each(delta.batch_no_data, function (item_code, batches) {
+			var item_batches = merged.batch_no_data[item_code] || [];
+			merged.batch_no_data[item_code] = item_batches.concat($.grep(batches, function (batch) {
+				return item_batches.indexOf(batch) === -1;
+			}));
+		})
+		$.each(merged.batch_no_data, function (item_code, batches) {
+			merged.batch_no_data[item_code] = $.grep(batches, function (batch) {
+				return (deleted.batch_no_data || []).indexOf(batch) === -1;
+			});
+		})
+
+		// the taxes of a changed item are all sent again
+		merged.tax_data = $.extend(data.tax_data || {}, delta.tax_data);
+
+		merged.price_list_data = $.extend(data.price_list_data || {}, delta.price_list_data);
+		$.each(deleted.price_list_data || [], function (i, item_code) {
+			delete merged.price_list_data[item_code];
+		})
+
+		merged.bin_data = merge_itemwise(data.bin_data, delta.bin_data);
+		delete merged.deleted;
+
+		return merged;
+	},
+
 	init_master_data: function (r) {
 		var me = this;
 		this.doc = JSON.parse(localStorage.getItem('doc'));
@@ -1703,7 +1830,7 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 			this.freeze = true;
 
 			frappe.call({
-				method: "erpnext.accounts.doctype.sales_invoice.pos.make_invoice",
+				method: "erpnext.accounts.doctype.sales_invoice.pos.enqueue_invoices",
 				freeze: freeze_screen,
 				args: {
 					doc_list: me.si_docs,
@@ -1713,9 +1840,7 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 				callback: function (r) {
 					if (r.message) {
 						me.freeze = false;
-						me.customers = r.message.synced_customers_list;
-						me.address = r.message.synced_address;
-						me.contacts = r.message.synced_contacts;
+						// queued invoices stay in localstorage until a later sync reports them as made
 						me.removed_items = r.message.invoice;
 						me.removed_email = r.message.email_queue;
 						me.removed_customers = r.message.customers;
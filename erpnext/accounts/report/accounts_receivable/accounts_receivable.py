@@ -14,6 +14,13 @@ class ReceivablePayableReport(object):
 			if self.filters.report_date > getdate(nowdate()) \
 			else self.filters.report_date
 
+		if not "range1" in self.filters:
+			self.filters["range1"] = "30"
+		if not "range2" in self.filters:
+			self.filters["range2"] = "60"
+		if not "range3" in self.filters:
+			self.filters["range3"] = "90"
+
 	def run(self, args):
 		party_naming_by = frappe.db.get_value(args.get("naming_by")[0], None, args.get("naming_by")[1])
 		columns = self.get_columns(party_naming_by, args)
@@ -70,13 +77,6 @@ class ReceivablePayableReport(object):
 
 		self.ageing_col_idx_start = len(columns)
 
-		if not "range1" in self.filters:
-			self.filters["range1"] = "30"
-		if not "range2" in self.filters:
-			self.filters["range2"] = "60"
-		if not "range3" in self.filters:
-			self.filters["range3"] = "90"
-
 		for label in ("0-{range1}".format(range1=self.filters["range1"]),
 			"{range1}-{range2}".format(range1=cint(self.filters["range1"])+ 1, range2=self.filters["range2"]),
 			"{range2}-{range3}".format(range2=cint(self.filters["range2"])+ 1, range3=self.filters["range3"]),
@@ -144,12 +144,67 @@ class ReceivablePayableReport(object):
 		return columns
 
 	def get_data(self, party_naming_by, args):
+		data = []
+		pdc_details = get_pdc_details(args.get("party_type"), self.filters.report_date)
+
+		for gle in self.get_outstanding_vouchers(args):
+			row = [gle.posting_date, gle.party]
+
+			# customer / supplier name
+			if party_naming_by == "Naming Series":
+				row += [self.get_party_name(gle.party_type, gle.party)]
+
+			row += [gle.voucher_type, gle.voucher_no, gle.due_date]
+
+			# get supplier bill details
+			if args.get("party_type") == "Supplier":
+				row += [gle.voucher_details.get("bill_no", ""), gle.bill_date]
+
+			# invoiced and paid amounts
+			row += [gle.invoiced_amount, gle.paid_amount, gle.credit_note_amount, gle.outstanding_amount]
+
+			# ageing data
+			row += [gle.age] + gle.ageing
+
+			row.append(gle.currency)
+
+			pdc = pdc_details.get((gle.voucher_no, gle.party), {})
+
+			remaining_balance = gle.outstanding_amount - flt(pdc.get("pdc_amount"))
+			row += [pdc.get("pdc_date"), pdc.get("pdc_ref"),
+				flt(pdc.get("pdc_amount")), remaining_balance]
+
+			if args.get('party_type') == 'Customer':
+				# customer LPO
+				row += [gle.voucher_details.get("po_no")]
+
+				# Delivery Note
+				row += [gle.voucher_details.get("delivery_note")]
+
+			# customer territory / supplier type
+			if args.get("party_type") == "Customer":
+				row += [self.get_territory(gle.party), self.get_customer_group(gle.party)]
+			if args.get("party_type") == "Supplier":
+				row += [self.get_supplier_type(gle.party)]
+
+			row.append(gle.remarks)
+			data.append(row)
+
+		return data
+
+	def get_outstanding_vouchers(self, args, summary_only=False):
+		"""
+			Yields the receivable / payable GL entries with an outstanding amount as on the report
+			date, with their invoiced, paid, credit note and outstanding amounts and ageing.
+
+			The party GL entries are read once: entries after the report date only mark their
+			vouchers as future vouchers, and the others are summed per against voucher.
+			With `summary_only`, details only shown in voucher rows are not fetched.
+		"""
 		from erpnext.accounts.utils import get_currency_precision
 		currency_precision = get_currency_precision() or 2
 		dr_or_cr = "debit" if args.get("party_type") == "Customer" else "credit"
 
-		future_vouchers = self.get_entries_after(self.filters.report_date, args.get("party_type"))
-
 		if not self.filters.get("company"):
 			self.filters["company"] = frappe.db.get_single_value('Global Defaults', 'default_company')
 
@@ -157,100 +212,70 @@ class ReceivablePayableReport(object):
 
 		return_entries = self.get_return_entries(args.get("party_type"))
 
-		data = []
-		pdc_details = get_pdc_details(args.get("party_type"), self.filters.report_date)
-		gl_entries_data = self.get_entries_till(self.filters.report_date, args.get("party_type"))
+		future_vouchers, gl_entries_data, against_voucher_amounts = set(), [], {}
+		for gle in self.get_gl_entries(args.get("party_type")):
+			if getdate(gle.posting_date) > self.filters.report_date:
+				future_vouchers.add((gle.voucher_type, gle.voucher_no))
+				continue
+
+			gl_entries_data.append(gle)
+			if gle.against_voucher_type and gle.against_voucher:
+				# [payments, credit / debit notes] adjusted against the voucher
+				amounts = against_voucher_amounts.setdefault((gle.party,
+					gle.against_voucher_type, gle.against_voucher), [0.0, 0.0])
+				adjusted_amount = self.get_adjusted_amount(gle, dr_or_cr, currency_precision)
+				if gle.voucher_no in return_entries:
+					amounts[1] += adjusted_amount
+				else:
+					amounts[0] += adjusted_amount
 
+		voucher_details = {}
 		if gl_entries_data:
-			voucher_nos = [d.voucher_no for d in gl_entries_data] or []
-			dn_details = get_dn_details(args.get("party_type"), voucher_nos)
+			voucher_nos = list(set(d.voucher_no for d in gl_entries_data))
+			dn_details = {} if summary_only else get_dn_details(args.get("party_type"), voucher_nos)
 			voucher_details = get_voucher_details(args.get("party_type"), voucher_nos, dn_details)
 
 		for gle in gl_entries_data:
-			if self.is_receivable_or_payable(gle, dr_or_cr, future_vouchers):
-				outstanding_amount, credit_note_amount = self.get_outstanding_amount(gle,
-					self.filters.report_date, dr_or_cr, return_entries, currency_precision)
-				if abs(outstanding_amount) > 0.1/10**currency_precision:
-					row = [gle.posting_date, gle.party]
-
-					# customer / supplier name
-					if party_naming_by == "Naming Series":
-						row += [self.get_party_name(gle.party_type, gle.party)]
-
-					# get due date
-					due_date = voucher_details.get(gle.voucher_no, {}).get("due_date", "")
-					bill_date = voucher_details.get(gle.voucher_no, {}).get("bill_date", "")
-
-					row += [gle.voucher_type, gle.voucher_no, due_date]
-
-					# get supplier bill details
-					if args.get("party_type") == "Supplier":
-						row += [
-							voucher_details.get(gle.voucher_no, {}).get("bill_no", ""),
-							voucher_details.get(gle.voucher_no, {}).get("bill_date", "")
-						]
-
-					# invoiced and paid amounts
-					invoiced_amount = gle.get(dr_or_cr) if (gle.get(dr_or_cr) > 0) else 0
-					paid_amt = invoiced_amount - outstanding_amount - credit_note_amount
-					row += [invoiced_amount, paid_amt, credit_note_amount, outstanding_amount]
-
-					# ageing data
-					if self.filters.ageing_based_on == "Due Date":
-						entry_date = due_date 
-					elif self.filters.ageing_based_on == "Supplier Invoice Date": 
-						entry_date = bill_date
-					else:
-						entry_date = gle.posting_date
-					row += get_ageing_data(cint(self.filters.range1), cint(self.filters.range2),
-						cint(self.filters.range3), self.age_as_on, entry_date, outstanding_amount)
-
-
-					# issue 6371-Ageing buckets should not have amounts if due date is not reached
-					if self.filters.ageing_based_on == "Due Date" \
-							and getdate(due_date) > getdate(self.filters.report_date):
-						row[-1]=row[-2]=row[-3]=row[-4]=0
-
-					if self.filters.ageing_based_on == "Supplier Invoice Date" \
-							and getdate(bill_date) > getdate(self.filters.report_date):
-						row[-1]=row[-2]=row[-3]=row[-4]=0
-
-					if self.filters.get(scrub(args.get("party_type"))):
-						row.append(gle.account_currency)
-					else:
-						row.append(company_currency)
-
-					pdc = pdc_details.get((gle.voucher_no, gle.party), {})
-
-					remaining_balance = outstanding_amount - flt(pdc.get("pdc_amount"))
-					row += [pdc.get("pdc_date"), pdc.get("pdc_ref"),
-						flt(pdc.get("pdc_amount")), remaining_balance]
-
-					if args.get('party_type') == 'Customer':
-						# customer LPO
-						row += [voucher_details.get(gle.voucher_no, {}).get("po_no")]
-
-						# Delivery Note
-						row += [voucher_details.get(gle.voucher_no, {}).get("delivery_note")]
-
-					# customer territory / supplier type
-					if args.get("party_type") == "Customer":
-						row += [self.get_territory(gle.party), self.get_customer_group(gle.party)]
-					if args.get("party_type") == "Supplier":
-						row += [self.get_supplier_type(gle.party)]
-
-					row.append(gle.remarks)
-					data.append(row)
+			if not self.is_receivable_or_payable(gle, dr_or_cr, future_vouchers):
+				continue
+
+			outstanding_amount, credit_note_amount = self.get_outstanding_amount(gle, dr_or_cr,
+				against_voucher_amounts, return_entries, currency_precision)
+			if abs(outstanding_amount) <= 0.1/10**currency_precision:
+				continue
+
+			gle.voucher_details = voucher_details.get(gle.voucher_no, {})
+			gle.due_date = gle.voucher_details.get("due_date", "")
+			gle.bill_date = gle.voucher_details.get("bill_date", "")
+
+			gle.invoiced_amount = gle.get(dr_or_cr) if (gle.get(dr_or_cr) > 0) else 0
+			gle.outstanding_amount = outstanding_amount
+			gle.credit_note_amount = credit_note_amount
+			gle.paid_amount = gle.invoiced_amount - outstanding_amount - credit_note_amount
+
+			# ageing data
+			if self.filters.ageing_based_on == "Due Date":
+				entry_date = gle.due_date
+			elif self.filters.ageing_based_on == "Supplier Invoice Date":
+				entry_date = gle.bill_date
+			else:
+				entry_date = gle.posting_date
 
-		return data
+			ageing = get_ageing_data(cint(self.filters.range1), cint(self.filters.range2),
+				cint(self.filters.range3), self.age_as_on, entry_date, outstanding_amount)
+			gle.age, gle.ageing = ageing[0], ageing[1:]
+
+			# issue 6371-Ageing buckets should not have amounts if due date is not reached
+			if self.filters.ageing_based_on in ("Due Date", "Supplier Invoice Date") \
+					and getdate(entry_date) > getdate(self.filters.report_date):
+				gle.ageing = [0, 0, 0, 0]
 
-	def get_entries_after(self, report_date, party_type):
-		# returns a distinct list
-		return list(set([(e.voucher_type, e.voucher_no) for e in self.get_gl_entries(party_type, report_date, for_future=True)]))
+			if self.filters.get(scrub(args.get("party_type"))):
+				gle.currency = gle.account_currency
+			else:
+				gle.currency = company_currency
 
-	def get_entries_till(self, report_date, party_type):
-		# returns a generator
-		return self.get_gl_entries(party_type, report_date)
+			yield gle
 
 	def is_receivable_or_payable(self, gle, dr_or_cr, future_vouchers):
 		return (
@@ -269,19 +294,24 @@ class ReceivablePayableReport(object):
 
 	def get_return_entries(self, party_type):
 		doctype = "Sales Invoice" if party_type=="Customer" else "Purchase Invoice"
-		return [d.name for d in frappe.get_all(doctype, filters={"is_return": 1, "docstatus": 1})]
+		return set(frappe.db.sql_list("""select name from `tab{0}`
+			where is_return=1 and docstatus=1""".format(doctype)))
 
-	def get_outstanding_amount(self, gle, report_date, dr_or_cr, return_entries, currency_precision):
-		payment_amount, credit_note_amount = 0.0, 0.0
+	def get_adjusted_amount(self, gle, dr_or_cr, currency_precision):
 		reverse_dr_or_cr = "credit" if dr_or_cr=="debit" else "debit"
+		return flt(gle.get(reverse_dr_or_cr), currency_precision) - flt(gle.get(dr_or_cr), currency_precision)
 
-		for e in self.get_gl_entries_for(gle.party, gle.party_type, gle.voucher_type, gle.voucher_no):
-			if getdate(e.posting_date) <= report_date and e.name!=gle.name:
-				amount = flt(e.get(reverse_dr_or_cr), currency_precision) - flt(e.get(dr_or_cr), currency_precision)
-				if e.voucher_no not in return_entries:
-					payment_amount += amount
-				else:
-					credit_note_amount += amount
+	def get_outstanding_amount(self, gle, dr_or_cr, against_voucher_amounts, return_entries, currency_precision):
+		reverse_dr_or_cr = "credit" if dr_or_cr=="debit" else "debit"
+		payment_amount, credit_note_amount = against_voucher_amounts.get((gle.party,
+			gle.voucher_type, gle.voucher_no), [0.0, 0.0])
+
+		# the entry itself is not adjusted against its own voucher
+		if (gle.against_voucher_type, gle.against_voucher) == (gle.voucher_type, gle.voucher_no):
+			if gle.voucher_no in return_entries:
+				credit_note_amount -= self.get_adjusted_amount(gle, dr_or_cr, currency_precision)
+			else:
+				payment_amount -= self.get_adjusted_amount(gle, dr_or_cr, currency_precision)
 
 		outstanding_amount = (flt((flt(gle.get(dr_or_cr), currency_precision)
 			- flt(gle.get(reverse_dr_or_cr), currency_precision)
@@ -372,20 +402,6 @@ class ReceivablePayableReport(object):
 
 		return " and ".join(conditions), values
 
-	def get_gl_entries_for(self, party, party_type, against_voucher_type, against_voucher):
-		if not hasattr(self, "gl_entries_map"):
-			self.gl_entries_map = {}
-			for gle in self.get_gl_entries(party_type):
-				if gle.against_voucher_type and gle.against_voucher:
-					self.gl_entries_map.setdefault(gle.party, {})\
-						.setdefault(gle.against_voucher_type, {})\
-						.setdefault(gle.against_voucher, [])\
-						.append(gle)
-
-		return self.gl_entries_map.get(party, {})\
-			.get(against_voucher_type, {})\
-			.get(against_voucher, [])
-
 	def get_chart_data(self, columns, data):
 		ageing_columns = columns[self.ageing_col_idx_start : self.ageing_col_idx_start+4]
 
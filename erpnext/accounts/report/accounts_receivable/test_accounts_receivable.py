@@ -0,0 +1,87 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import nowdate, add_days, flt
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.accounts.report.accounts_receivable.accounts_receivable import ReceivablePayableReport
+from erpnext.accounts.report.accounts_receivable_summary.accounts_receivable_summary import \
+	AccountsReceivableSummary
+
+args = {
+	"party_type": "Customer",
+	"naming_by": ["Selling Settings", "cust_master_name"]
+}
+
+class TestAccountsReceivable(unittest.TestCase):
+	def setUp(self):
+		self.customer = make_customer("_Test Accounts Receivable Customer")
+
+	def get_outstanding_vouchers(self, report_date):
+		return dict((d.voucher_no, d) for d in ReceivablePayableReport({
+			"company": "_Test Company",
+			"customer": self.customer,
+			"report_date": report_date
+		}).get_outstanding_vouchers(args))
+
+	def test_partly_paid_invoice_with_credit_note(self):
+		si = create_sales_invoice(customer=self.customer, rate=1000, posting_date=add_days(nowdate(), -10))
+
+		make_payment(si.name, 300, nowdate())
+		create_sales_invoice(customer=self.customer, is_return=1, return_against=si.name, qty=-1, rate=200,
+			posting_date=add_days(nowdate(), -5))
+
+		# paid after the report date, so still outstanding on it
+		make_payment(si.name, 100, add_days(nowdate(), 5))
+
+		row = self.get_outstanding_vouchers(nowdate())[si.name]
+		self.assertEqual([flt(row.invoiced_amount), flt(row.paid_amount), flt(row.credit_note_amount),
+			flt(row.outstanding_amount)], [1000, 300, 200, 500])
+
+		row = self.get_outstanding_vouchers(add_days(nowdate(), 10))[si.name]
+		self.assertEqual([flt(row.paid_amount), flt(row.outstanding_amount)], [400, 400])
+
+	def test_summary_total_of_voucher_rows(self):
+		si = create_sales_invoice(customer=self.customer, rate=700, posting_date=add_days(nowdate(), -40))
+		make_payment(si.name, 200, nowdate())
+		create_sales_invoice(customer=self.customer, rate=300)
+
+		filters = {
+			"company": "_Test Company",
+			"customer": self.customer,
+			"report_date": nowdate()
+		}
+
+		rows = list(ReceivablePayableReport(filters).get_outstanding_vouchers(args))
+		total = AccountsReceivableSummary(filters).get_partywise_total(None, args)[self.customer]
+
+		for fieldname, row_fieldname in (("invoiced_amt", "invoiced_amount"), ("paid_amt", "paid_amount"),
+			("credit_amt", "credit_note_amount"), ("outstanding_amt", "outstanding_amount")):
+				self.assertAlmostEqual(flt(total[fieldname]), sum(flt(d.get(row_fieldname)) for d in rows))
+
+		for i in range(4):
+			self.assertAlmostEqual(flt(total["range{0}".format(i + 1)]), sum(flt(d.ageing[i]) for d in rows))
+
+def make_customer(customer_name):
+	if not frappe.db.exists("Customer", customer_name):
+		frappe.get_doc({
+			"doctype": "Customer",
+			"customer_name": customer_name,
+			"customer_type": "Company",
+			"customer_group": "_Test Customer Group",
+			"territory": "_Test Territory"
+		}).insert()
+
+	return customer_name
+
+def make_payment(sales_invoice, amount, posting_date):
+	pe = get_payment_entry("Sales Invoice", sales_invoice, party_amount=amount, bank_account="_Test Cash - _TC")
+	pe.posting_date = posting_date
+	pe.reference_no = "1"
+	pe.reference_date = posting_date
+	pe.insert()
+	pe.submit()
+	return pe
@@ -143,7 +143,7 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 
 	def get_partywise_total(self, party_naming_by, args):
 		party_total = frappe._dict()
-		for d in self.get_voucherwise_data(party_naming_by, args):
+		for d in self.get_outstanding_vouchers(args, summary_only=True):
 			party_total.setdefault(d.party,
 				frappe._dict({
 					"invoiced_amt": 0,
@@ -156,43 +156,18 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 					"range4": 0
 				})
 			)
-			for k in party_total[d.party].keys():
-				if k != "currency":
-					party_total[d.party][k] += flt(d.get(k, 0))
 
-			party_total[d.party].currency = d.currency
+			totals = party_total[d.party]
+			totals.invoiced_amt += flt(d.invoiced_amount)
+			totals.paid_amt += flt(d.paid_amount)
+			totals.credit_amt += flt(d.credit_note_amount)
+			totals.outstanding_amt += flt(d.outstanding_amount)
+			for i, amount in enumerate(d.ageing):
+				totals["range{0}".format(i + 1)] += flt(amount)
 
-		return party_total
-
-	def get_voucherwise_data(self, party_naming_by, args):
-		voucherwise_data = ReceivablePayableReport(self.filters).run(args)[1]
-
-		cols = ["posting_date", "party"]
-
-		if party_naming_by == "Naming Series":
-			cols += ["party_name"]
-
-		cols += ["voucher_type", "voucher_no", "due_date"]
-
-		if args.get("party_type") == "Supplier":
-			cols += ["bill_no", "bill_date"]
+			totals.currency = d.currency
 
-		cols += ["invoiced_amt", "paid_amt", "credit_amt",
-		"outstanding_amt", "age", "range1", "range2", "range3", "range4", "currency"]
-
-		if args.get("party_type") == "Supplier":
-			cols += ["supplier_type", "remarks"]
-		if args.get("party_type") == "Customer":
-			cols += ["territory", "customer_group", "remarks"]
-
-		return self.make_data_dict(cols, voucherwise_data)
-
-	def make_data_dict(self, cols, data):
-		data_dict = []
-		for d in data:
-			data_dict.append(frappe._dict(zip(cols, d)))
-
-		return data_dict
+		return party_total
 
 def execute(filters=None):
 	args = {
@@ -7,7 +7,7 @@ import re
 from frappe import _
 from frappe.utils import (flt, getdate, get_first_day, get_last_day, date_diff,
 	add_months, add_days, formatdate, cint)
-from erpnext.accounts.utils import get_fiscal_year
+from erpnext.accounts.utils import get_fiscal_years_for_dates
 
 
 def get_period_list(from_fiscal_year, to_fiscal_year, periodicity, accumulated_values=False,
@@ -53,14 +53,17 @@ def get_period_list(from_fiscal_year, to_fiscal_year, periodicity, accumulated_v
 			# if a fiscal year ends before a 12 month period
 			period.to_date = year_end_date
 
-		period.to_date_fiscal_year = get_fiscal_year(period.to_date, company=company)[0]
-		period.from_date_fiscal_year_start_date = get_fiscal_year(period.from_date, company=company)[1]
-
 		period_list.append(period)
 
 		if period.to_date == year_end_date:
 			break
 
+	fiscal_years = get_fiscal_years_for_dates([d.to_date for d in period_list]
+		+ [d.from_date for d in period_list], company=company)
+	for period in period_list:
+		period.to_date_fiscal_year = fiscal_years[getdate(period.to_date)][0]
+		period.from_date_fiscal_year_start_date = fiscal_years[getdate(period.from_date)][1]
+
 	# common processing
 	for opts in period_list:
 		key = opts["to_date"].strftime("%b_%Y").lower()
@@ -8,6 +8,8 @@ from erpnext.stock.utils import get_incoming_rate
 from erpnext.controllers.queries import get_match_cond
 from frappe.utils import flt
 
+# invoice rows whose stock ledger entries, product bundles and items are loaded together
+PROCESS_CHUNK_SIZE = 500
 
 def execute(filters=None):
 	if not filters: filters = frappe._dict()
@@ -98,56 +100,75 @@ class GrossProfitGenerator(object):
 		self.average_buying_rate = {}
 		self.filters = frappe._dict(filters)
 		self.load_invoice_items()
-		self.load_stock_ledger_entries()
-		self.load_product_bundle()
-		self.load_non_stock_items()
-		self.get_returned_invoice_items()
 		self.process()
 
 	def process(self):
 		self.grouped = {}
 		self.grouped_data = []
+		self.non_stock_items = set()
+		self.items_with_sle = {}
+		self.returned_invoices = frappe._dict()
 
-		for row in self.si_list:
-			if self.skip_row(row, self.product_bundles):
-				continue
+		# only the stock ledger entries of a chunk of rows are held at a time
+		for i in range(0, len(self.si_list), PROCESS_CHUNK_SIZE):
+			rows = self.si_list[i:i + PROCESS_CHUNK_SIZE]
+			self.load_product_bundle(rows)
+			self.load_non_stock_items(rows)
+			self.load_stock_ledger_entries(rows)
+			if self.filters.get("group_by") == "Invoice":
+				self.get_returned_invoice_items(rows)
 
-			row.base_amount = flt(row.base_net_amount)
+			for row in rows:
+				self.process_row(row)
 
-			product_bundles = []
-			if row.update_stock:
-				product_bundles = self.product_bundles.get(row.parenttype, {}).get(row.parent, frappe._dict())
-			elif row.dn_detail:
-				product_bundles = self.product_bundles.get("Delivery Note", {})\
-					.get(row.delivery_note, frappe._dict())
-				row.item_row = row.dn_detail
-
-			# get buying amount
-			if row.item_code in product_bundles:
-				row.buying_amount = self.get_buying_amount_from_product_bundle(row,
-					product_bundles[row.item_code])
-			else:
-				row.buying_amount = self.get_buying_amount(row, row.item_code)
+		if self.grouped:
+			self.get_average_rate_based_on_group_by()
 
-			# get buying rate
-			if row.qty:
-				row.buying_rate = row.buying_amount / row.qty
-				row.base_rate = row.base_amount / row.qty
-			else:
-				row.buying_rate, row.base_rate = 0.0, 0.0
+	def process_row(self, row):
+		if self.skip_row(row, self.product_bundles):
+			return
 
-			# calculate gross profit
-			row.gross_profit = row.base_amount - row.buying_amount
-			if row.base_amount:
-				row.gross_profit_percent = (row.gross_profit / row.base_amount) * 100.0
-			else:
-				row.gross_profit_percent = 0.0
+		row.base_amount = flt(row.base_net_amount)
 
-			# add to grouped
-			self.grouped.setdefault(row.get(scrub(self.filters.group_by)), []).append(row)
+		product_bundles = []
+		if row.update_stock:
+			product_bundles = self.product_bundles.get(row.parenttype, {}).get(row.parent, frappe._dict())
+		elif row.dn_detail:
+			product_bundles = self.product_bundles.get("Delivery Note", {})\
+				.get(row.delivery_note, frappe._dict())
+			row.item_row = row.dn_detail
 
-		if self.grouped:
-			self.get_average_rate_based_on_group_by()
+		# get buying amount
+		if row.item_code in product_bundles:
+			row.buying_amount = self.get_buying_amount_from_product_bundle(row,
+				product_bundles[row.item_code])
+		else:
+			row.buying_amount = self.get_buying_amount(row, row.item_code)
+
+		# get buying rate
+		if row.qty:
+			row.buying_rate = row.buying_amount / row.qty
+			row.base_rate = row.base_amount / row.qty
+		else:
+			row.buying_rate, row.base_rate = 0.0, 0.0
+
+		# calculate gross profit
+		row.gross_profit = row.base_amount - row.buying_amount
+		if row.base_amount:
+			row.gross_profit_percent = (row.gross_profit / row.base_amount) * 100.0
+		else:
+			row.gross_profit_percent = 0.0
+
+		# add to grouped
+		key = row.get(scrub(self.filters.group_by))
+		if self.filters.get("group_by") != "Invoice" and key in self.grouped:
+			# only the totals of the group are kept
+			new_row = self.grouped[key][0]
+			new_row.qty += row.qty
+			new_row.buying_amount += row.buying_amount
+			new_row.base_amount += row.base_amount
+		else:
+			self.grouped.setdefault(key, []).append(row)
 
 	def get_average_rate_based_on_group_by(self):
 		# sum buying / selling totals for group
@@ -183,7 +204,9 @@ class GrossProfitGenerator(object):
 		new_row.base_rate = (new_row.base_amount / new_row.qty) if new_row.qty else 0
 		return new_row
 
-	def get_returned_invoice_items(self):
+	def get_returned_invoice_items(self, rows):
+		invoices = list(set(row.parent for row in rows))
+
 		returned_invoices = frappe.db.sql("""
 			select
 				si.name, si_item.item_code, si_item.qty, si_item.base_amount, si.return_against
@@ -193,9 +216,9 @@ class GrossProfitGenerator(object):
 				si.name = si_item.parent
 				and si.docstatus = 1
 				and si.is_return = 1
-		""", as_dict=1)
+				and si.return_against in ({0})
+		""".format(", ".join(["%s"] * len(invoices))), tuple(invoices), as_dict=1)
 
-		self.returned_invoices = frappe._dict()
 		for inv in returned_invoices:
 			self.returned_invoices.setdefault(inv.return_against, frappe._dict())\
 				.setdefault(inv.item_code, []).append(inv)
@@ -225,27 +248,32 @@ class GrossProfitGenerator(object):
 			return flt(row.qty) * item_rate
 
 		else:
-			my_sle = self.sle.get((item_code, row.warehouse))
-			if (row.update_stock or row.dn_detail) and my_sle:
+			if (row.update_stock or row.dn_detail) and self.has_stock_ledger_entries(item_code, row.warehouse):
 				parenttype, parent = row.parenttype, row.parent
 				if row.dn_detail:
 					parenttype, parent = "Delivery Note", row.delivery_note
 
-				for i, sle in enumerate(my_sle):
-					# find the stock valution rate from stock ledger entry
-					if sle.voucher_type == parenttype and parent == sle.voucher_no and \
-						sle.voucher_detail_no == row.item_row:
-							previous_stock_value = len(my_sle) > i+1 and \
-								flt(my_sle[i+1].stock_value) or 0.0
-							if previous_stock_value:
-								return previous_stock_value - flt(sle.stock_value)
-							else:
-								return flt(row.qty) * self.get_average_buying_rate(row, item_code)
+				# find the stock valution rate from stock ledger entry
+				sle = self.sle.get((parenttype, parent, row.item_row, item_code, row.warehouse))
+				if sle:
+					if sle.previous_stock_value:
+						return sle.previous_stock_value - flt(sle.stock_value)
+					else:
+						return flt(row.qty) * self.get_average_buying_rate(row, item_code)
 			else:
 				return flt(row.qty) * self.get_average_buying_rate(row, item_code)
 
 		return 0.0
 
+	def has_stock_ledger_entries(self, item_code, warehouse):
+		if (item_code, warehouse) not in self.items_with_sle:
+			self.items_with_sle[(item_code, warehouse)] = bool(frappe.db.sql("""select name
+				from `tabStock Ledger Entry`
+				where company=%s and item_code=%s and warehouse=%s limit 1""",
+				(self.filters.company, item_code, warehouse)))
+
+		return self.items_with_sle[(item_code, warehouse)]
+
 	def get_average_buying_rate(self, row, item_code):
 		args = row
 		if not item_code in self.average_buying_rate:
@@ -324,30 +352,80 @@ class GrossProfitGenerator(object):
 			.format(conditions=conditions, sales_person_cols=sales_person_cols,
 				sales_team_table=sales_team_table, match_cond = get_match_cond('Sales Invoice')), self.filters, as_dict=1)
 
-	def load_stock_ledger_entries(self):
-		res = frappe.db.sql("""select item_code, voucher_type, voucher_no,
-				voucher_detail_no, stock_value, warehouse, actual_qty as qty
-			from `tabStock Ledger Entry`
-			where company=%(company)s
-			order by
-				item_code desc, warehouse desc, posting_date desc,
-				posting_time desc, name desc""", self.filters, as_dict=True)
+	def load_stock_ledger_entries(self, rows):
+		"""
+			Stock ledger entries of the invoices and delivery notes of `rows`, with the stock
+			value of the entry just before each of them in the same item and warehouse
+		"""
 		self.sle = {}
-		for r in res:
-			if (r.item_code, r.warehouse) not in self.sle:
-				self.sle[(r.item_code, r.warehouse)] = []
 
-			self.sle[(r.item_code, r.warehouse)].append(r)
+		voucher_nos = set()
+		for row in rows:
+			if row.update_stock:
+				voucher_nos.add(row.parent)
+			elif row.dn_detail:
+				voucher_nos.add(row.delivery_note)
 
-	def load_product_bundle(self):
+		if not voucher_nos:
+			return
+
+		for sle in frappe.db.sql("""select name, item_code, voucher_type, voucher_no,
+				voucher_detail_no, stock_value, warehouse, posting_datetime
+			from `tabStock Ledger Entry`
+			where company=%s and voucher_no in ({0})
+			order by posting_datetime desc, name desc""".format(", ".join(["%s"] * len(voucher_nos))),
+			tuple([self.filters.company] + list(voucher_nos)), as_dict=True):
+				sle.previous_stock_value = 0.0
+				self.sle.setdefault((sle.voucher_type, sle.voucher_no, sle.voucher_detail_no,
+					sle.item_code, sle.warehouse), sle)
+				self.items_with_sle[(sle.item_code, sle.warehouse)] = True
+
+		# one index range scan per entry, served by (item_code, warehouse, posting_datetime, name)
+		entries = list(self.sle.values())
+		if not entries:
+			return
+
+		values = []
+		for sle in entries:
+			values += [sle.name, sle.item_code, sle.warehouse, sle.posting_datetime,
+				sle.posting_datetime, sle.name]
+
+		previous_stock_values = dict(frappe.db.sql(" union all ".join(["""(select %s, stock_value
+			from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s and posting_datetime <= %s
+				and (posting_datetime, name) < (%s, %s)
+			order by posting_datetime desc, name desc limit 1)"""] * len(entries)), tuple(values)))
+
+		for sle in entries:
+			sle.previous_stock_value = flt(previous_stock_values.get(sle.name))
+
+	def load_product_bundle(self, rows):
 		self.product_bundles = {}
 
+		parents = set()
+		for row in rows:
+			if row.update_stock:
+				parents.add(row.parent)
+			elif row.dn_detail:
+				parents.add(row.delivery_note)
+
+		if not parents:
+			return
+
 		for d in frappe.db.sql("""select parenttype, parent, parent_item,
 			item_code, warehouse, -1*qty as total_qty, parent_detail_docname
-			from `tabPacked Item` where docstatus=1""", as_dict=True):
+			from `tabPacked Item` where docstatus=1 and parent in ({0})""".format(
+				", ".join(["%s"] * len(parents))), tuple(parents), as_dict=True):
 			self.product_bundles.setdefault(d.parenttype, frappe._dict()).setdefault(d.parent,
 				frappe._dict()).setdefault(d.parent_item, []).append(d)
 
-	def load_non_stock_items(self):
-		self.non_stock_items = frappe.db.sql_list("""select name from tabItem
-			where is_stock_item=0""")
+	def load_non_stock_items(self, rows):
+		item_codes = set(row.item_code for row in rows)
+		for bundles in self.product_bundles.values():
+			for parent_items in bundles.values():
+				for packed_items in parent_items.values():
+					item_codes.update(d.item_code for d in packed_items)
+
+		self.non_stock_items.update(frappe.db.sql_list("""select name from tabItem
+			where is_stock_item=0 and name in ({0})""".format(", ".join(["%s"] * len(item_codes))),
+			tuple(item_codes)))
@@ -0,0 +1,142 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import re
+import time
+import unittest
+from frappe.utils import flt
+from erpnext.accounts.general_ledger import merge_similar_entries, make_gl_entries, \
+	BULK_GL_ENTRY_THRESHOLD
+
+class TestGeneralLedger(unittest.TestCase):
+	def test_merge_similar_entries(self):
+		gl_map = [
+			frappe._dict(account="Sales", cost_center="Main", debit=0, credit=100),
+			frappe._dict(account="Sales", cost_center="Main", debit=0, credit=50),
+			frappe._dict(account="Sales", cost_center="Other", debit=0, credit=10),
+			frappe._dict(account="Debtors", party_type="Customer", party="A", debit=160, credit=0),
+			frappe._dict(account="Debtors", party_type="Customer", party="B", debit=10, credit=0),
+			frappe._dict(account="Debtors", party_type="Customer", party="B", debit=0, credit=10)
+		]
+
+		merged = merge_similar_entries(gl_map)
+
+		self.assertEqual([(d.account, d.get("cost_center"), d.get("party"), d.debit, d.credit) for d in merged], [
+			("Sales", "Main", None, 0, 150),
+			("Sales", "Other", None, 0, 10),
+			("Debtors", None, "A", 160, 0),
+			("Debtors", None, "B", 10, 10)
+		])
+
+	def test_merge_similar_entries_of_many_rows(self):
+		def make_gl_map(rows):
+			gl_map = []
+			for i in range(rows):
+				# half the rows merge into an existing head
+				gl_map.append(frappe._dict(account="Sales", cost_center="CC {0}".format(i % (rows // 2)),
+					project="Project {0}".format(i % 10), debit=0, credit=1))
+			return gl_map
+
+		for rows in (1000, 10000):
+			merged = merge_similar_entries(make_gl_map(rows))
+
+			self.assertEqual(len(merged), rows // 2)
+			self.assertEqual(sum(d.credit for d in merged), rows)
+
+	def test_merge_similar_entries_scaling(self):
+		from erpnext.accounts import general_ledger
+
+		get_merge_key = general_ledger.get_merge_key
+		key_lookups = []
+		def count_key_lookups(gle):
+			key_lookups.append(1)
+			return get_merge_key(gle)
+
+		general_ledger.get_merge_key = count_key_lookups
+		try:
+			for rows in (1000, 10000):
+				gl_map = [frappe._dict(account="Sales", cost_center="CC {0}".format(i % (rows // 2)),
+					debit=0, credit=1) for i in range(rows)]
+
+				del key_lookups[:]
+				start = time.time()
+				merge_similar_entries(gl_map)
+				time_taken = time.time() - start
+
+				# one key per row, not one comparison per merged row
+				self.assertEqual(len(key_lookups), rows)
+				print("merge_similar_entries: {0} rows in {1:.4f}s".format(rows, time_taken))
+		finally:
+			general_ledger.get_merge_key = get_merge_key
+
+	def test_bulk_gl_entries(self):
+		from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+
+		si = create_sales_invoice(posting_date="2013-02-14", qty=1, rate=5000)
+		voucher_no = "_Test Bulk GL Entries"
+
+		# one row per unit received against the invoice, none of them merged
+		rows = BULK_GL_ENTRY_THRESHOLD + 10
+		gl_map = []
+		for i in range(rows):
+			gl_map.append(make_gl_dict(voucher_no, "Debtors - _TC", credit=1, party_type="Customer",
+				party="_Test Customer", against_voucher_type="Sales Invoice", against_voucher=si.name))
+			gl_map.append(make_gl_dict(voucher_no, "_Test Bank - _TC", debit=1))
+
+		make_gl_entries(gl_map, merge_entries=False)
+
+		names = frappe.db.sql_list("""select name from `tabGL Entry`
+			where voucher_type='Journal Entry' and voucher_no=%s""", voucher_no)
+		self.assertEqual(len(names), rows * 2)
+
+		# named from the same series as GL Entries inserted one by one
+		for name in names:
+			self.assertTrue(re.match(r"^GL\d{7}$", name), name)
+
+		self.assertEqual(flt(frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount")),
+			flt(si.grand_total) - rows)
+
+		make_gl_entries(gl_map, cancel=True)
+		self.assertEqual(flt(frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount")),
+			flt(si.grand_total))
+
+	def test_bulk_gl_entries_against_budget(self):
+		from erpnext.accounts.doctype.budget.budget import BudgetError
+		from erpnext.accounts.doctype.budget.test_budget import set_total_expense_zero, make_budget
+
+		set_total_expense_zero("2013-02-28", "Cost Center")
+		budget = make_budget("Cost Center")
+		voucher_no = "_Test Bulk GL Entries Over Budget"
+
+		# the annual budget of 100000 is crossed only by the total of the rows
+		gl_map = []
+		for i in range(BULK_GL_ENTRY_THRESHOLD + 50):
+			gl_map.append(make_gl_dict(voucher_no, "_Test Account Cost for Goods Sold - _TC", debit=1000,
+				cost_center="_Test Cost Center - _TC"))
+			gl_map.append(make_gl_dict(voucher_no, "_Test Bank - _TC", credit=1000))
+
+		self.assertRaises(BudgetError, make_gl_entries, gl_map, merge_entries=False)
+
+		frappe.db.sql("""delete from `tabGL Entry`
+			where voucher_type='Journal Entry' and voucher_no=%s""", voucher_no)
+		budget.load_from_db()
+		budget.cancel()
+
+def make_gl_dict(voucher_no, account, debit=0, credit=0, **args):
+	gle = frappe._dict({
+		"company": "_Test Company",
+		"posting_date": "2013-02-14",
+		"fiscal_year": "_Test Fiscal Year 2013",
+		"voucher_type": "Journal Entry",
+		"voucher_no": voucher_no,
+		"account": account,
+		"debit": debit,
+		"credit": credit,
+		"debit_in_account_currency": debit,
+		"credit_in_account_currency": credit,
+		"account_currency": "INR"
+	})
+	gle.update(args)
+	return gle
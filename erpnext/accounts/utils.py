@@ -5,75 +5,142 @@ from __future__ import unicode_literals
 
 import frappe
 import frappe.defaults
+from bisect import bisect_right
 from frappe.utils import nowdate, cstr, flt, cint, now, getdate
 from frappe import throw, _
 from frappe.utils import formatdate, get_number_format_info
 
 # imported to enable erpnext.accounts.utils.get_account_currency
 from erpnext.accounts.doctype.account.account import get_account_currency
+from erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot import snapshots_enabled, \
+	get_balance_from_snapshots
 
 class FiscalYearError(frappe.ValidationError): pass
 
+# per site: fiscal years and their index per company, with the version they were built at
+_fiscal_year_index = {}
+
 @frappe.whitelist()
 def get_fiscal_year(date=None, fiscal_year=None, label="Date", verbose=1, company=None, as_dict=False):
 	return get_fiscal_years(date, fiscal_year, label, verbose, company, as_dict=as_dict)[0]
 
 def get_fiscal_years(transaction_date=None, fiscal_year=None, label="Date", verbose=1, company=None, as_dict=False):
-	fiscal_years = frappe.cache().hget("fiscal_years", company) or []
-
-	if not fiscal_years:
-		# if year start date is 2012-04-01, year end date should be 2013-03-31 (hence subdate)
-		cond = ""
-		if fiscal_year:
-			cond += " and fy.name = {0}".format(frappe.db.escape(fiscal_year))
-		if company:
-			cond += """
-				and (not exists (select name
-					from `tabFiscal Year Company` fyc
-					where fyc.parent = fy.name)
-				or exists(select company
-					from `tabFiscal Year Company` fyc
-					where fyc.parent = fy.name
-					and fyc.company=%(company)s)
-				)
-			"""
-
-		fiscal_years = frappe.db.sql("""
-			select
-				fy.name, fy.year_start_date, fy.year_end_date
-			from
-				`tabFiscal Year` fy
-			where
-				disabled = 0 {0}
-			order by
-				fy.year_start_date desc""".format(cond), {
-				"company": company
-			}, as_dict=True)
-
-		frappe.cache().hset("fiscal_years", company, fiscal_years)
+	index = get_fiscal_year_index(company)
 
 	if transaction_date:
 		transaction_date = getdate(transaction_date)
 
-	for fy in fiscal_years:
-		matched = False
-		if fiscal_year and fy.name == fiscal_year:
-			matched = True
-
-		if (transaction_date and getdate(fy.year_start_date) <= transaction_date
-			and getdate(fy.year_end_date) >= transaction_date):
-			matched = True
+	# of the matching years, the one starting last
+	matches = [fy for fy in (index.get_by_name(fiscal_year) if fiscal_year else None,
+		index.get_by_date(transaction_date) if transaction_date else None) if fy]
 
-		if matched:
-			if as_dict:
-				return (fy,)
-			else:
-				return ((fy.name, fy.year_start_date, fy.year_end_date),)
+	if matches:
+		return (get_fiscal_year_details(max(matches, key=lambda fy: fy.year_start_date), as_dict),)
 
 	error_msg = _("""{0} {1} not in any active Fiscal Year.""").format(label, formatdate(transaction_date))
 	if verbose==1: frappe.msgprint(error_msg)
 	raise FiscalYearError(error_msg)
 
+def get_fiscal_years_for_dates(dates, company=None, as_dict=False, raise_exception=True):
+	"""
+		Fiscal year of each of the `dates`, as a dict by date, resolved against one index.
+		Dates in no active fiscal year raise FiscalYearError, or map to None without `raise_exception`.
+	"""
+	index = get_fiscal_year_index(company)
+
+	fiscal_years = {}
+	for date in set(getdate(d) for d in dates if d):
+		fy = index.get_by_date(date)
+		if not fy:
+			if raise_exception:
+				frappe.throw(_("""{0} {1} not in any active Fiscal Year.""").format(_("Date"), formatdate(date)),
+					FiscalYearError)
+			fiscal_years[date] = None
+		else:
+			fiscal_years[date] = get_fiscal_year_details(fy, as_dict)
+
+	return fiscal_years
+
+def get_fiscal_year_details(fy, as_dict=False):
+	if as_dict:
+		return frappe._dict(name=fy.name, year_start_date=fy.year_start_date, year_end_date=fy.year_end_date)
+	else:
+		return (fy.name, fy.year_start_date, fy.year_end_date)
+
+class FiscalYearIndex(object):
+	"""active fiscal years of a company sorted by start date, looked up by bisection"""
+	def __init__(self, fiscal_years):
+		self.fiscal_years = sorted(fiscal_years, key=lambda fy: (fy.year_start_date, fy.name))
+		self.start_dates = [fy.year_start_date for fy in self.fiscal_years]
+		self.by_name = dict((fy.name, fy) for fy in self.fiscal_years)
+
+		# latest end date up to each position, to stop searching overlapping years early
+		self.max_end_dates, max_end_date = [], None
+		for fy in self.fiscal_years:
+			max_end_date = max(max_end_date, fy.year_end_date) if max_end_date else fy.year_end_date
+			self.max_end_dates.append(max_end_date)
+
+	def get_by_name(self, fiscal_year):
+		return self.by_name.get(fiscal_year)
+
+	def get_by_date(self, date):
+		i = bisect_right(self.start_dates, date) - 1
+		while i >= 0 and self.max_end_dates[i] >= date:
+			if self.fiscal_years[i].year_end_date >= date:
+				return self.fiscal_years[i]
+			i -= 1
+
+def get_fiscal_year_index(company=None):
+	"""
+		Index of the fiscal years of the company, or of all fiscal years. Built once per process
+		and kept until a Fiscal Year is changed, see `clear_fiscal_year_cache`.
+	"""
+	version = get_fiscal_years_version()
+
+	cached = _fiscal_year_index.get(frappe.local.site)
+	if not cached or cached["version"] != version:
+		cached = _fiscal_year_index[frappe.local.site] = {"version": version,
+			"fiscal_years": get_active_fiscal_years(), "index": {}}
+
+	if company not in cached["index"]:
+		# years without companies apply to all companies
+		cached["index"][company] = FiscalYearIndex([fy for fy in cached["fiscal_years"]
+			if not company or not fy.companies or company in fy.companies])
+
+	return cached["index"][company]
+
+def get_active_fiscal_years():
+	fiscal_years = {}
+	for d in frappe.db.sql("""
+		select
+			fy.name, fy.year_start_date, fy.year_end_date, fyc.company
+		from
+			`tabFiscal Year` fy left join `tabFiscal Year Company` fyc on fyc.parent = fy.name
+		where
+			fy.disabled = 0""", as_dict=True):
+			fy = fiscal_years.setdefault(d.name, frappe._dict(name=d.name, year_start_date=getdate(d.year_start_date),
+				year_end_date=getdate(d.year_end_date), companies=set()))
+			if d.company:
+				fy.companies.add(d.company)
+
+	return list(fiscal_years.values())
+
+def get_fiscal_years_version():
+	"""shared by all processes through the cache, read once per request"""
+	if not getattr(frappe.local, "fiscal_years_version", None):
+		version = frappe.cache().get_value("fiscal_years_version")
+		if not version:
+			version = frappe.generate_hash(length=10)
+			frappe.cache().set_value("fiscal_years_version", version)
+
+		frappe.local.fiscal_years_version = version
+
+	return frappe.local.fiscal_years_version
+
+def clear_fiscal_year_cache():
+	frappe.cache().delete_value("fiscal_years_version")
+	frappe.local.fiscal_years_version = None
+
 def validate_fiscal_year(date, fiscal_year, company, label="Date", doc=None):
 	years = [f[0] for f in get_fiscal_years(date, label=_(label), company=company)]
 	if fiscal_year not in years:
@@ -94,6 +161,7 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 		party = frappe.form_dict.get("party")
 
 	cond = []
+	balance_date = date
 	if date:
 		cond.append("posting_date <= '%s'" % frappe.db.escape(cstr(date)))
 	else:
@@ -112,6 +180,9 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			# hence, assuming balance as 0.0
 			return 0.0
 
+	# conditions on account, party and company, without the date range
+	key_cond = []
+	from_date = None
 	if account:
 		acc = frappe.get_doc("Account", account)
 
@@ -122,10 +193,11 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 		if acc.report_type == 'Profit and Loss':
 			cond.append("posting_date >= '%s' and voucher_type != 'Period Closing Voucher'" \
 				% year_start_date)
+			from_date = year_start_date
 
 		# different filter for group and ledger - improved performance
 		if acc.is_group:
-			cond.append("""exists (
+			key_cond.append("""exists (
 				select name from `tabAccount` ac where ac.name = gle.account
 				and ac.lft >= %s and ac.rgt <= %s
 			)""" % (acc.lft, acc.rgt))
@@ -135,16 +207,22 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			if acc.account_currency == frappe.db.get_value("Company", acc.company, "default_currency"):
 				in_account_currency = False
 		else:
-			cond.append("""gle.account = "%s" """ % (frappe.db.escape(account, percent=False), ))
+			key_cond.append("""gle.account = "%s" """ % (frappe.db.escape(account, percent=False), ))
 
 	if party_type and party:
-		cond.append("""gle.party_type = "%s" and gle.party = "%s" """ %
+		key_cond.append("""gle.party_type = "%s" and gle.party = "%s" """ %
 			(frappe.db.escape(party_type), frappe.db.escape(party, percent=False)))
 
 	if company:
-		cond.append("""gle.company = "%s" """ % (frappe.db.escape(company, percent=False)))
+		key_cond.append("""gle.company = "%s" """ % (frappe.db.escape(company, percent=False)))
+
+	cond += key_cond
 
 	if account or (party_type and party):
+		if snapshots_enabled():
+			return flt(get_balance_from_snapshots(key_cond, balance_date, from_date, in_account_currency,
+				exclude_period_closing_voucher=bool(from_date)))
+
 		if in_account_currency:
 			select_field = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
 		else:
@@ -575,35 +653,33 @@ def get_stock_rbnb_difference(posting_date, company):
 	return flt(stock_rbnb) + flt(sys_bal)
 
 
-def get_outstanding_invoices(party_type, party, account, condition=None):
+def get_outstanding_invoices(party_type, party, account, condition=None, limit=None, start=0):
+	"""
+		Invoices of the party with an outstanding amount, ordered by due date. With `limit`,
+		only that many invoices from position `start`, the oldest first.
+	"""
 	outstanding_invoices = []
 	precision = frappe.get_precision("Sales Invoice", "outstanding_amount")
 
 	if party_type in ("Customer", "Student"):
 		dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
-		payment_dr_or_cr = "payment_gl_entry.credit_in_account_currency - payment_gl_entry.debit_in_account_currency"
+		payment_dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
 	else:
 		dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-		payment_dr_or_cr = "payment_gl_entry.debit_in_account_currency - payment_gl_entry.credit_in_account_currency"
+		payment_dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
+
+	args = {
+		"party_type": party_type,
+		"party": party,
+		"account": account,
+	}
 
-	invoice = 'Sales Invoice' if party_type == 'Customer' else 'Purchase Invoice'
 	invoice_list = frappe.db.sql("""
 		select
-			voucher_no, voucher_type, posting_date, ifnull(sum({dr_or_cr}), 0) as invoice_amount,
-			(
-				select ifnull(sum({payment_dr_or_cr}), 0)
-				from `tabGL Entry` payment_gl_entry
-				where payment_gl_entry.against_voucher_type = invoice_gl_entry.voucher_type
-					and if(invoice_gl_entry.voucher_type='Journal Entry',
-						payment_gl_entry.against_voucher = invoice_gl_entry.voucher_no,
-						payment_gl_entry.against_voucher = invoice_gl_entry.against_voucher)
-					and payment_gl_entry.party_type = invoice_gl_entry.party_type
-					and payment_gl_entry.party = invoice_gl_entry.party
-					and payment_gl_entry.account = invoice_gl_entry.account
-					and {payment_dr_or_cr} > 0
-			) as payment_amount
+			voucher_no, voucher_type, posting_date, against_voucher,
+			ifnull(sum({dr_or_cr}), 0) as invoice_amount
 		from
-			`tabGL Entry` invoice_gl_entry
+			`tabGL Entry`
 		where
 			party_type = %(party_type)s and party = %(party)s
 			and account = %(account)s and {dr_or_cr} > 0
@@ -612,38 +688,67 @@ def get_outstanding_invoices(party_type, party, account, condition=None):
 					and (against_voucher = '' or against_voucher is null))
 				or (voucher_type not in ('Journal Entry', 'Payment Entry')))
 		group by voucher_type, voucher_no
-		having (invoice_amount - payment_amount) > 0.005
-		order by posting_date, name""".format(
-			dr_or_cr=dr_or_cr,
-			invoice = invoice,
-			payment_dr_or_cr=payment_dr_or_cr,
-			condition=condition or ""
-		), {
-			"party_type": party_type,
-			"party": party,
-			"account": account,
-		}, as_dict=True)
+		order by posting_date, name""".format(dr_or_cr=dr_or_cr, condition=condition or ""),
+		args, as_dict=True)
+
+	if not invoice_list:
+		return outstanding_invoices
+
+	# payments and adjustments against each voucher of the party, in one pass
+	payment_amounts = dict(((d[0], d[1]), flt(d[2])) for d in frappe.db.sql("""
+		select against_voucher_type, against_voucher, sum({payment_dr_or_cr})
+		from `tabGL Entry`
+		where party_type = %(party_type)s and party = %(party)s and account = %(account)s
+			and {payment_dr_or_cr} > 0 and against_voucher is not null and against_voucher != ''
+		group by against_voucher_type, against_voucher""".format(payment_dr_or_cr=payment_dr_or_cr), args))
 
 	for d in invoice_list:
-		due_date = frappe.db.get_value(d.voucher_type, d.voucher_no,
-			"posting_date" if party_type == "Employee" else "due_date")
-
-		outstanding_invoices.append(
-			frappe._dict({
-				'voucher_no': d.voucher_no,
-				'voucher_type': d.voucher_type,
-				'posting_date': d.posting_date,
-				'invoice_amount': flt(d.invoice_amount),
-				'payment_amount': flt(d.payment_amount),
-				'outstanding_amount': flt(d.invoice_amount - d.payment_amount, precision),
-				'due_date': due_date
-			})
-		)
+		against_voucher = d.voucher_no if d.voucher_type == "Journal Entry" else d.against_voucher
+		payment_amount = payment_amounts.get((d.voucher_type, against_voucher), 0.0)
+
+		if flt(d.invoice_amount) - payment_amount > 0.005:
+			outstanding_invoices.append(
+				frappe._dict({
+					'voucher_no': d.voucher_no,
+					'voucher_type': d.voucher_type,
+					'posting_date': d.posting_date,
+					'invoice_amount': flt(d.invoice_amount),
+					'payment_amount': payment_amount,
+					'outstanding_amount': flt(flt(d.invoice_amount) - payment_amount, precision)
+				})
+			)
+
+	due_date_field = "posting_date" if party_type == "Employee" else "due_date"
+	voucher_values = get_voucher_values([(d.voucher_type, d.voucher_no) for d in outstanding_invoices],
+		[due_date_field])
+
+	for d in outstanding_invoices:
+		d.due_date = voucher_values.get((d.voucher_type, d.voucher_no), {}).get(due_date_field)
 
 	outstanding_invoices = sorted(outstanding_invoices, key=lambda k: k['due_date'] or getdate(nowdate()))
 
+	if limit:
+		outstanding_invoices = outstanding_invoices[cint(start):cint(start) + cint(limit)]
+
 	return outstanding_invoices
 
+def get_voucher_values(vouchers, fields, chunk_size=1000):
+	"""values of `fields` by (voucher_type, voucher_no), fetched per voucher type in chunks"""
+	voucher_nos = {}
+	for voucher_type, voucher_no in vouchers:
+		voucher_nos.setdefault(voucher_type, set()).add(voucher_no)
+
+	voucher_values = {}
+	for voucher_type, names in voucher_nos.items():
+		names = list(names)
+		for i in range(0, len(names), chunk_size):
+			chunk = names[i:i + chunk_size]
+			for d in frappe.db.sql("""select name, {0} from `tab{1}` where name in ({2})""".format(
+				", ".join(fields), voucher_type, ", ".join(["%s"] * len(chunk))), tuple(chunk), as_dict=True):
+					voucher_values[(voucher_type, d.name)] = d
+
+	return voucher_values
+
 
 def get_account_name(account_type=None, root_type=None, is_group=None, account_currency=None, company=None):
 	"""return account based on matching conditions"""
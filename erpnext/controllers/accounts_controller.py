@@ -177,7 +177,7 @@ class AccountsController(TransactionBase):
 
 	def set_missing_item_details(self, for_validate=False):
 		"""set missing item values"""
-		from erpnext.stock.get_item_details import get_item_details
+		from erpnext.stock.get_item_details import get_item_details_in_bulk
 		from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
 
 		if hasattr(self, "items"):
@@ -189,44 +189,46 @@ class AccountsController(TransactionBase):
 				document_type = "{} Item".format(self.doctype)
 				parent_dict.update({"document_type": document_type})
 
-			for item in self.get("items"):
-				if item.get("item_code"):
-					args = parent_dict.copy()
-					args.update(item.as_dict())
+			items = [item for item in self.get("items") if item.get("item_code")]
+			item_args = []
+			for item in items:
+				args = parent_dict.copy()
+				args.update(item.as_dict())
 
-					args["doctype"] = self.doctype
-					args["name"] = self.name
+				args["doctype"] = self.doctype
+				args["name"] = self.name
 
-					if not args.get("transaction_date"):
-						args["transaction_date"] = args.get("posting_date")
+				if not args.get("transaction_date"):
+					args["transaction_date"] = args.get("posting_date")
 
-					if self.get("is_subcontracted"):
-						args["is_subcontracted"] = self.is_subcontracted
+				if self.get("is_subcontracted"):
+					args["is_subcontracted"] = self.is_subcontracted
 
-					ret = get_item_details(args)
+				item_args.append(args)
 
-					for fieldname, value in ret.items():
-						if item.meta.get_field(fieldname) and value is not None:
-							if (item.get(fieldname) is None or fieldname in force_item_fields):
-								item.set(fieldname, value)
+			for item, ret in zip(items, get_item_details_in_bulk(item_args)):
+				for fieldname, value in ret.items():
+					if item.meta.get_field(fieldname) and value is not None:
+						if (item.get(fieldname) is None or fieldname in force_item_fields):
+							item.set(fieldname, value)
 
-							elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
-								item.set(fieldname, value)
+						elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
+							item.set(fieldname, value)
 
-							elif fieldname == "serial_no":
-								stock_qty = item.get("stock_qty") * -1 if item.get("stock_qty") < 0 else item.get("stock_qty")
-								if stock_qty != len(get_serial_nos(item.get('serial_no'))):
-									item.set(fieldname, value)
+						elif fieldname == "serial_no":
+							stock_qty = item.get("stock_qty") * -1 if item.get("stock_qty") < 0 else item.get("stock_qty")
+							if stock_qty != len(get_serial_nos(item.get('serial_no'))):
+								item.set(fieldname, value)
 
-					if ret.get("pricing_rule"):
-						# if user changed the discount percentage then set user's discount percentage ?
-						item.set("discount_percentage", ret.get("discount_percentage"))
-						if ret.get("pricing_rule_for") == "Price":
-							item.set("pricing_list_rate", ret.get("pricing_list_rate"))
+				if ret.get("pricing_rule"):
+					# if user changed the discount percentage then set user's discount percentage ?
+					item.set("discount_percentage", ret.get("discount_percentage"))
+					if ret.get("pricing_rule_for") == "Price":
+						item.set("pricing_list_rate", ret.get("pricing_list_rate"))
 
-						if item.price_list_rate:
-							item.rate = flt(item.price_list_rate *
-								(1.0 - (flt(item.discount_percentage) / 100.0)), item.precision("rate"))
+					if item.price_list_rate:
+						item.rate = flt(item.price_list_rate *
+							(1.0 - (flt(item.discount_percentage) / 100.0)), item.precision("rate"))
 
 			if self.doctype == "Purchase Invoice":
 				self.set_expense_account(for_validate)
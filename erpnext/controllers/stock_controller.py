@@ -9,7 +9,7 @@ import frappe.defaults
 from erpnext.accounts.utils import get_fiscal_year
 from erpnext.accounts.general_ledger import make_gl_entries, delete_gl_entries, process_gl_map
 from erpnext.controllers.accounts_controller import AccountsController
-from erpnext.stock.stock_ledger import get_valuation_rate
+from erpnext.stock.stock_ledger import get_valuation_rate, ValuationRateCache
 from erpnext.stock import get_warehouse_account_map
 
 class StockController(AccountsController):
@@ -46,6 +46,11 @@ class StockController(AccountsController):
 		gl_list = []
 		warehouse_with_no_account = []
 
+		# entries without value get the last known rate, looked up for all of them at once
+		valuation_rate_cache = ValuationRateCache([(sle.item_code, sle.warehouse)
+			for sle_list in sle_map.values() for sle in sle_list if not sle.stock_value_difference],
+			currency=self.company_currency)
+
 		for item_row in voucher_details:
 			sle_list = sle_map.get(item_row.name)
 			if sle_list:
@@ -64,7 +69,7 @@ class StockController(AccountsController):
 						if not sle.stock_value_difference and self.doctype != "Stock Reconciliation" \
 							and not item_row.get("allow_zero_valuation_rate"):
 
-							sle = self.update_stock_ledger_entries(sle)
+							sle = self.update_stock_ledger_entries(sle, valuation_rate_cache)
 
 						gl_list.append(self.get_gl_dict({
 							"account": warehouse_account[sle.warehouse]["account"],
@@ -93,9 +98,10 @@ class StockController(AccountsController):
 
 		return process_gl_map(gl_list)
 
-	def update_stock_ledger_entries(self, sle):
+	def update_stock_ledger_entries(self, sle, valuation_rate_cache=None):
 		sle.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-			self.doctype, self.name, currency=self.company_currency, company=self.company)
+			self.doctype, self.name, currency=self.company_currency, company=self.company,
+			valuation_rate_cache=valuation_rate_cache)
 
 		sle.stock_value = flt(sle.qty_after_transaction) * flt(sle.valuation_rate)
 		sle.stock_value_difference = flt(sle.actual_qty) * flt(sle.valuation_rate)
@@ -387,8 +393,8 @@ def get_future_stock_vouchers(posting_date, posting_time, for_warehouses=None, f
 
 	for d in frappe.db.sql("""select distinct sle.voucher_type, sle.voucher_no
 		from `tabStock Ledger Entry` sle
-		where timestamp(sle.posting_date, sle.posting_time) >= timestamp(%s, %s) {condition}
-		order by timestamp(sle.posting_date, sle.posting_time) asc, name asc""".format(condition=condition),
+		where sle.posting_datetime >= timestamp(%s, %s) {condition}
+		order by sle.posting_datetime asc, name asc""".format(condition=condition),
 		tuple([posting_date, posting_time] + values), as_dict=True):
 			future_stock_vouchers.append([d.voucher_type, d.voucher_no])
 
@@ -231,7 +231,10 @@ scheduler_events = {
 		"erpnext.buying.doctype.supplier_scorecard.supplier_scorecard.refresh_scorecards",
 		"erpnext.setup.doctype.company.company.cache_companies_monthly_sales_history",
 		"erpnext.manufacturing.doctype.bom_update_tool.bom_update_tool.update_latest_price_in_all_boms",
-		"erpnext.assets.doctype.asset.asset.update_maintenance_status"
+		"erpnext.assets.doctype.asset.asset.update_maintenance_status",
+		"erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot.verify_account_balance_snapshots",
+		"erpnext.stock.doctype.stock_ageing_snapshot.stock_ageing_snapshot.make_stock_ageing_snapshots",
+		"erpnext.stock.stock_balance.reconcile_bin_qty"
 	]
 }
 
@@ -0,0 +1,415 @@
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+from __future__ import unicode_literals
+
+import frappe, erpnext
+from frappe import _
+from frappe.utils import flt, now
+from operator import itemgetter
+
+BOM_COST_FIELDS = ("raw_material_cost", "base_raw_material_cost", "total_cost", "base_total_cost")
+BOM_ITEM_COST_FIELDS = ("rate", "base_rate", "amount", "base_amount", "qty_consumed_per_unit")
+
+class BOMCostRollup(object):
+	"""
+		Recompute the cost of submitted BOMs as `BOM.update_cost` does, for many BOMs at once.
+
+		BOMs are processed in chunks, in the given bottom-up order, so that the cost of a
+		sub-assembly BOM is known before the BOMs using it. Raw material rates of a chunk are
+		fetched with a few grouped queries, costs are computed in memory and only the BOMs
+		whose cost or exploded items changed are written back, with multi-row updates.
+
+		Without `refresh_rates`, the rates of raw materials are kept and only the rate of
+		sub-assemblies recosted in the same run is updated, as per `BOM.update_parent_cost`.
+		With `commit`, each chunk is committed, and a chunk that fails is rolled back and logged
+		while the next ones are processed. `progress` is called with the number of processed and
+		total BOMs after each chunk.
+	"""
+	def __init__(self, bom_nos, chunk_size=500, refresh_rates=True, rebuild_exploded_items=False,
+		include_drafts=False, commit=False, progress=None):
+		self.bom_nos = bom_nos
+		self.chunk_size = chunk_size
+		self.refresh_rates = refresh_rates
+		self.rebuild_exploded_items = rebuild_exploded_items
+		self.docstatus = (0, 1) if include_drafts else (1,)
+		self.commit = commit
+		self.progress = progress
+
+		# unit cost of every processed BOM, for the rate of sub-assemblies in later BOMs
+		self.unit_cost = {}
+		# BOMs whose exploded items were rewritten, their parents need to be rewritten too
+		self.exploded_items_changed = set()
+		# total cost per unit of the BOMs recosted without refreshing rates
+		self.parent_cost = {}
+
+		self.valuation_rates = {}
+		self.precision = frappe._dict({
+			"rate": frappe.get_precision("BOM Item", "rate"),
+			"qty": frappe.get_precision("BOM Item", "qty"),
+			"stock_qty": frappe.get_precision("BOM Item", "stock_qty"),
+			"quantity": frappe.get_precision("BOM", "quantity")
+		})
+		self.stats = frappe._dict(boms=0, updated=0, failed=0)
+
+	def run(self):
+		total = len(self.bom_nos)
+		for i in range(0, total, self.chunk_size):
+			chunk = self.bom_nos[i:i + self.chunk_size]
+			if self.commit:
+				self.process_chunk_and_commit(chunk)
+			else:
+				self.process_chunk(chunk)
+
+			if self.progress:
+				self.progress(min(i + self.chunk_size, total), total)
+
+		return self.stats
+
+	def process_chunk_and_commit(self, bom_nos):
+		try:
+			self.process_chunk(bom_nos)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(frappe.get_traceback(), title=_("BOM cost update failed"))
+			self.stats.failed += len(bom_nos)
+
+			# BOMs using these get their cost as saved
+			for bom_no in bom_nos:
+				self.unit_cost.pop(bom_no, None)
+				self.parent_cost.pop(bom_no, None)
+				self.exploded_items_changed.discard(bom_no)
+
+	def process_chunk(self, bom_nos):
+		boms = load_boms(bom_nos)
+		self.load_rates(boms)
+
+		updated_boms, exploded_items = [], {}
+		for bom_no in bom_nos:
+			bom = boms.get(bom_no)
+			if not bom or bom.docstatus not in self.docstatus:
+				continue
+
+			self.stats.boms += 1
+			if self.refresh_rates:
+				rates_changed = self.update_rates(bom)
+			else:
+				rates_changed = self.update_sub_assembly_rates(bom)
+			cost_changed = self.calculate_cost(bom)
+
+			self.unit_cost[bom.name] = flt(bom.base_total_cost) / flt(bom.quantity) \
+				if bom.is_active and flt(bom.quantity) else 0
+			if not self.refresh_rates and flt(bom.total_cost) and flt(bom.quantity):
+				self.parent_cost[bom.name] = flt(bom.total_cost) / flt(bom.quantity)
+
+			if rates_changed or cost_changed:
+				updated_boms.append(bom)
+
+			if (self.rebuild_exploded_items or rates_changed
+				or any(d.bom_no in self.exploded_items_changed for d in bom.items)):
+					self.exploded_items_changed.add(bom.name)
+					exploded_items[bom.name] = self.get_exploded_items(bom, exploded_items)
+
+		self.write(updated_boms, exploded_items,
+			dict((bom_no, boms[bom_no].docstatus) for bom_no in exploded_items))
+		self.stats.updated += len(updated_boms)
+
+	def load_rates(self, boms):
+		"""rates of all raw materials of the chunk, by costing method"""
+		items_by_method = {}
+		for bom in boms.values():
+			for d in bom.items:
+				items_by_method.setdefault(bom.rm_cost_as_per, set()).add(d.item_code)
+
+		valuation_items = [d for d in items_by_method.get("Valuation Rate", []) if d not in self.valuation_rates]
+		self.valuation_rates.update(get_valuation_rates(valuation_items))
+
+		self.last_purchase_rates = get_item_values(list(items_by_method.get("Last Purchase Rate", [])),
+			"last_purchase_rate")
+
+		price_lists = list(set(bom.buying_price_list for bom in boms.values()
+			if bom.rm_cost_as_per == "Price List" and bom.buying_price_list))
+		self.item_prices = get_item_prices(price_lists, list(items_by_method.get("Price List", [])))
+		self.price_list_currency = dict(frappe.db.sql("""select name, currency from `tabPrice List`
+			where name in ({0})""".format(", ".join(["%s"] * len(price_lists))), tuple(price_lists))) if price_lists else {}
+
+		# unit cost of sub-assembly BOMs not processed in this run
+		sub_assembly_boms = list(set(d.bom_no for bom in boms.values() for d in bom.items
+			if d.bom_no and d.bom_no not in self.unit_cost and d.bom_no not in boms))
+		if sub_assembly_boms:
+			self.unit_cost.update(frappe.db.sql("""select name, base_total_cost/quantity from `tabBOM`
+				where is_active = 1 and name in ({0})""".format(", ".join(["%s"] * len(sub_assembly_boms))),
+				tuple(sub_assembly_boms)))
+
+	def get_rm_rate(self, bom, d):
+		"""rate of a raw material as per `BOM.get_rm_rate`, from the prefetched rates"""
+		if d.bom_no and bom.set_rate_of_sub_assembly_item_based_on_bom:
+			return flt(self.unit_cost.get(d.bom_no))
+
+		if bom.rm_cost_as_per == "Valuation Rate":
+			return flt(self.valuation_rates.get(d.item_code))
+		elif bom.rm_cost_as_per == "Last Purchase Rate":
+			return flt(self.last_purchase_rates.get(d.item_code))
+		elif bom.rm_cost_as_per == "Price List":
+			rate = flt(self.item_prices.get((bom.buying_price_list, d.item_code)))
+			if self.price_list_currency.get(bom.buying_price_list) != erpnext.get_company_currency(bom.company):
+				rate = flt(rate * bom.conversion_rate)
+			return rate
+
+		return 0
+
+	def update_rates(self, bom):
+		"""set the latest rates of the raw materials, returns True if any changed"""
+		if bom.rm_cost_as_per == "Price List" and not bom.buying_price_list:
+			# BOM.update_cost would stop with "Please select Price List", leave the BOM as it is
+			return False
+
+		changed = False
+		for d in bom.items:
+			rate = self.get_rm_rate(bom, d)
+			if rate and flt(bom.conversion_rate):
+				rate = rate * flt(d.conversion_factor) / flt(bom.conversion_rate)
+				if flt(rate, self.precision.rate) != flt(d.rate, self.precision.rate):
+					d.rate = rate
+					changed = True
+
+		return changed
+
+	def update_sub_assembly_rates(self, bom):
+		"""set the cost of sub-assemblies recosted in this run, returns True if any changed"""
+		changed = False
+		for d in bom.items:
+			cost = self.parent_cost.get(d.bom_no)
+			if cost and flt(cost, self.precision.rate) != flt(d.rate, self.precision.rate):
+				d.rate = cost
+				changed = True
+
+		return changed
+
+	def calculate_cost(self, bom):
+		"""raw material and total cost as per `BOM.calculate_cost`, returns True if changed"""
+		existing = [flt(bom.get(f), 6) for f in BOM_COST_FIELDS]
+		conversion_rate = flt(bom.conversion_rate)
+
+		raw_material_cost = base_raw_material_cost = 0.0
+		for d in bom.items:
+			d.base_rate = flt(d.rate) * conversion_rate
+			d.amount = flt(d.rate, self.precision.rate) * flt(d.qty, self.precision.qty)
+			d.base_amount = d.amount * conversion_rate
+			d.qty_consumed_per_unit = flt(d.stock_qty, self.precision.stock_qty) \
+				/ flt(bom.quantity, self.precision.quantity)
+
+			raw_material_cost += d.amount
+			base_raw_material_cost += d.base_amount
+
+		bom.raw_material_cost = raw_material_cost
+		bom.base_raw_material_cost = base_raw_material_cost
+		bom.total_cost = flt(bom.operating_cost) + raw_material_cost - flt(bom.scrap_material_cost)
+		bom.base_total_cost = flt(bom.base_operating_cost) + base_raw_material_cost \
+			- flt(bom.base_scrap_material_cost)
+
+		return existing != [flt(bom.get(f), 6) for f in BOM_COST_FIELDS]
+
+	def get_exploded_items(self, bom, exploded_items_of_chunk):
+		"""exploded items as per `BOM.get_exploded_items`, rows of sub-assemblies rewritten in this
+			chunk are taken from memory, the others from the database"""
+		child_boms = [d.bom_no for d in bom.items if d.bom_no and d.bom_no not in exploded_items_of_chunk]
+		child_exploded_items = get_exploded_items_per_unit(child_boms)
+		for d in bom.items:
+			if d.bom_no in exploded_items_of_chunk:
+				child_exploded_items[d.bom_no] = exploded_items_of_chunk[d.bom_no]
+
+		exploded_items = {}
+		def add(row):
+			if row.item_code in exploded_items:
+				exploded_items[row.item_code].stock_qty += row.stock_qty
+			else:
+				exploded_items[row.item_code] = row
+
+		for d in bom.items:
+			if d.bom_no:
+				for child in child_exploded_items.get(d.bom_no, []):
+					add(frappe._dict({
+						"item_code": child.item_code,
+						"item_name": child.item_name,
+						"source_warehouse": child.source_warehouse,
+						"description": child.description,
+						"stock_uom": child.stock_uom,
+						"stock_qty": flt(child.qty_consumed_per_unit) * flt(d.stock_qty),
+						"rate": flt(child.rate)
+					}))
+			else:
+				add(frappe._dict({
+					"item_code": d.item_code,
+					"item_name": d.item_name,
+					"source_warehouse": d.source_warehouse,
+					"description": d.description,
+					"image": d.image,
+					"stock_uom": d.stock_uom,
+					"stock_qty": flt(d.stock_qty),
+					"rate": d.base_rate
+				}))
+
+		rows = []
+		for item_code in sorted(exploded_items, key=itemgetter(0)):
+			row = exploded_items[item_code]
+			row.amount = flt(row.stock_qty) * flt(row.rate)
+			row.qty_consumed_per_unit = flt(row.stock_qty) / flt(bom.quantity)
+			rows.append(row)
+
+		return rows
+
+	def write(self, boms, exploded_items, docstatus=None):
+		timestamp = now()
+		for bom in boms:
+			bom.modified = timestamp
+
+		bulk_update("BOM", boms, BOM_COST_FIELDS + ("modified",))
+		bulk_update("BOM Item", [d for bom in boms for d in bom.items], BOM_ITEM_COST_FIELDS)
+
+		if exploded_items:
+			frappe.db.sql("""delete from `tabBOM Explosion Item` where parent in ({0})""".format(
+				", ".join(["%s"] * len(exploded_items))), tuple(exploded_items))
+			insert_exploded_items(exploded_items, docstatus)
+
+def load_boms(bom_nos):
+	"""{name: BOM with its items}, with the fields needed for costing"""
+	if not bom_nos:
+		return {}
+
+	boms = dict((d.name, d) for d in frappe.db.sql("""select name, docstatus, is_active, company,
+			conversion_rate, quantity, rm_cost_as_per, buying_price_list,
+			set_rate_of_sub_assembly_item_based_on_bom, operating_cost, base_operating_cost,
+			scrap_material_cost, base_scrap_material_cost, {0}
+		from `tabBOM` where name in ({1})""".format(", ".join(BOM_COST_FIELDS),
+			", ".join(["%s"] * len(bom_nos))), tuple(bom_nos), as_dict=1))
+
+	for bom in boms.values():
+		bom["items"] = []
+
+	for d in frappe.db.sql("""select name, parent, idx, item_code, item_name, bom_no, source_warehouse,
+			description, image, stock_uom, qty, stock_qty, conversion_factor, {0}
+		from `tabBOM Item` where parenttype='BOM' and parent in ({1})
+		order by parent, idx""".format(", ".join(BOM_ITEM_COST_FIELDS), ", ".join(["%s"] * len(bom_nos))),
+		tuple(bom_nos), as_dict=1):
+			boms[d.parent]["items"].append(d)
+
+	return boms
+
+def get_valuation_rates(item_codes, chunk_size=1000):
+	"""{item_code: rate} as per `BOM.get_valuation_rate`: weighted average of all Bins, else the
+		last positive rate in the Stock Ledger, else the rate of the Item"""
+	rates = {}
+	for i in range(0, len(item_codes), chunk_size):
+		chunk = item_codes[i:i + chunk_size]
+		placeholders = ", ".join(["%s"] * len(chunk))
+
+		for item_code, qty, value in frappe.db.sql("""select item_code, sum(actual_qty), sum(stock_value)
+			from `tabBin` where item_code in ({0}) group by item_code""".format(placeholders), tuple(chunk)):
+				if flt(qty):
+					rates[item_code] = flt(value) / flt(qty)
+
+		missing = [d for d in chunk if flt(rates.get(d)) <= 0]
+		for item_code in missing:
+			rates[item_code] = 0
+
+		if missing:
+			# of entries at the same time, the one with the highest name wins
+			for item_code, valuation_rate in frappe.db.sql("""select sle.item_code, sle.valuation_rate
+				from `tabStock Ledger Entry` sle,
+					(select item_code, max(posting_datetime) as posting_datetime
+					from `tabStock Ledger Entry`
+					where item_code in ({0}) and valuation_rate > 0
+					group by item_code) latest
+				where sle.item_code = latest.item_code and sle.posting_datetime = latest.posting_datetime
+					and sle.valuation_rate > 0
+				order by sle.name""".format(", ".join(["%s"] * len(missing))), tuple(missing)):
+					rates[item_code] = flt(valuation_rate)
+
+		missing = [d for d in chunk if not rates.get(d)]
+		rates.update(get_item_values(missing, "valuation_rate"))
+
+	return rates
+
+def get_item_values(item_codes, fieldname, chunk_size=1000):
+	values = {}
+	for i in range(0, len(item_codes), chunk_size):
+		chunk = item_codes[i:i + chunk_size]
+		values.update(frappe.db.sql("""select name, {0} from tabItem where name in ({1})""".format(
+			fieldname, ", ".join(["%s"] * len(chunk))), tuple(chunk)))
+
+	return values
+
+def get_item_prices(price_lists, item_codes, chunk_size=1000):
+	"""{(price_list, item_code): price_list_rate}"""
+	item_prices = {}
+	if not price_lists:
+		return item_prices
+
+	for i in range(0, len(item_codes), chunk_size):
+		chunk = item_codes[i:i + chunk_size]
+		for price_list, item_code, rate in frappe.db.sql("""select price_list, item_code, price_list_rate
+			from `tabItem Price` where price_list in ({0}) and item_code in ({1})""".format(
+				", ".join(["%s"] * len(price_lists)), ", ".join(["%s"] * len(chunk))),
+			tuple(price_lists + chunk)):
+				item_prices.setdefault((price_list, item_code), rate)
+
+	return item_prices
+
+def get_exploded_items_per_unit(bom_nos):
+	"""{bom_no: exploded items with qty_consumed_per_unit} of the given submitted BOMs"""
+	exploded_items = {}
+	if not bom_nos:
+		return exploded_items
+
+	# Did not use qty_consumed_per_unit in the query, as it leads to rounding loss
+	for d in frappe.db.sql("""select bom.name as bom_no, bom_item.item_code, bom_item.item_name,
+			bom_item.description, bom_item.source_warehouse, bom_item.stock_uom, bom_item.rate,
+			bom_item.stock_qty / ifnull(bom.quantity, 1) as qty_consumed_per_unit
+		from `tabBOM Explosion Item` bom_item, tabBOM bom
+		where bom_item.parent = bom.name and bom.docstatus = 1 and bom.name in ({0})""".format(
+			", ".join(["%s"] * len(bom_nos))), tuple(bom_nos), as_dict=1):
+			exploded_items.setdefault(d.pop("bom_no"), []).append(d)
+
+	return exploded_items
+
+def insert_exploded_items(exploded_items, docstatus=None, chunk_size=500):
+	"""insert the exploded items {bom_no: rows}, of submitted BOMs unless `docstatus`
+		{bom_no: docstatus} says otherwise"""
+	timestamp, user = now(), frappe.session.user
+	fields = ("item_code", "item_name", "source_warehouse", "description", "image", "stock_uom",
+		"stock_qty", "rate", "amount", "qty_consumed_per_unit")
+	columns = ("name", "creation", "modified", "owner", "modified_by", "docstatus",
+		"parent", "parenttype", "parentfield", "idx") + fields
+
+	rows = []
+	for bom_no, items in exploded_items.items():
+		for idx, d in enumerate(items, 1):
+			rows.append([frappe.generate_hash("BOM Explosion Item", 10), timestamp, timestamp, user, user,
+				(docstatus or {}).get(bom_no, 1),
+				bom_no, "BOM", "exploded_items", idx] + [d.get(f) for f in fields])
+
+	for i in range(0, len(rows), chunk_size):
+		chunk = rows[i:i + chunk_size]
+		frappe.db.sql("""insert into `tabBOM Explosion Item` ({0}) values {1}""".format(
+			", ".join(columns), ", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(chunk))),
+			tuple(v for row in chunk for v in row))
+
+def bulk_update(doctype, docs, fields, chunk_size=500):
+	"""write the given fields of the docs with one multi-row update per chunk"""
+	for i in range(0, len(docs), chunk_size):
+		chunk = docs[i:i + chunk_size]
+		values = []
+		set_clauses = []
+		for fieldname in fields:
+			cases = []
+			for d in chunk:
+				cases.append("when %s then %s")
+				values.extend([d.name, d.get(fieldname)])
+
+			set_clauses.append("`{0}` = case name {1} end".format(fieldname, " ".join(cases)))
+
+		values.extend([d.name for d in chunk])
+
+		frappe.db.sql("""update `tab{0}` set {1} where name in ({2})""".format(doctype,
+			", ".join(set_clauses), ", ".join(["%s"] * len(chunk))), tuple(values))
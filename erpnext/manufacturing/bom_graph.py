@@ -0,0 +1,100 @@
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+from __future__ import unicode_literals
+
+import frappe
+from frappe.utils import flt
+
+class BOMGraph(object):
+	"""
+		Raw materials of BOMs with their stock qty per unit of the BOM, and the planning
+		flags of those items, for the BOMs of a planning run and the default BOMs of their
+		sub-assemblies.
+
+		Each level is loaded with one query for the BOMs and one for the items, so a
+		sub-assembly shared by many BOMs is loaded once per run. Raw materials of
+		submitted BOMs are also kept in the cache across runs, see `get_bom_children`.
+	"""
+	def __init__(self, bom_nos=None):
+		self.children = {}
+		self.items = {}
+		if bom_nos:
+			self.load(bom_nos)
+
+	def load(self, bom_nos):
+		to_load = list(set(d for d in bom_nos if d and d not in self.children))
+		while to_load:
+			children = get_bom_children(to_load)
+			for bom_no in to_load:
+				self.children[bom_no] = children.get(bom_no, [])
+
+			item_codes = set(d.item_code for bom_no in to_load for d in self.children[bom_no])
+			self.load_items([d for d in item_codes if d not in self.items])
+
+			# next level, the default BOMs of the sub-assemblies
+			to_load = list(set(self.items[d].default_bom for d in item_codes
+				if d in self.items and self.items[d].default_bom
+				and self.items[d].default_bom not in self.children))
+
+	def load_items(self, item_codes, chunk_size=1000):
+		for i in range(0, len(item_codes), chunk_size):
+			chunk = item_codes[i:i + chunk_size]
+			for d in frappe.db.sql("""select name, default_material_request_type, is_sub_contracted_item,
+					default_bom, min_order_qty, is_stock_item
+				from tabItem where name in ({0})""".format(", ".join(["%s"] * len(chunk))),
+				tuple(chunk), as_dict=1):
+					self.items[d.name] = d
+
+	def get_children(self, bom_no):
+		if bom_no not in self.children:
+			self.load([bom_no])
+
+		return self.children.get(bom_no, [])
+
+	def get_item(self, item_code):
+		return self.items.get(item_code)
+
+	def get_sub_assembly_items(self):
+		"""items in the graph that have a default BOM"""
+		return [d.name for d in self.items.values() if d.default_bom]
+
+def get_bom_children(bom_nos, chunk_size=1000):
+	"""
+		{bom_no: [raw materials]}, each with item_code, qty (stock qty per unit of the BOM),
+		description and stock_uom. Submitted BOMs cannot change, so their raw materials are
+		cached until the BOM is cancelled.
+	"""
+	cache = frappe.cache()
+	children, missing = {}, []
+	for bom_no in bom_nos:
+		value = cache.hget("bom_children", bom_no)
+		if value is None:
+			missing.append(bom_no)
+		else:
+			children[bom_no] = value
+
+	for i in range(0, len(missing), chunk_size):
+		chunk = missing[i:i + chunk_size]
+		submitted = set()
+		for d in frappe.db.sql("""select bom.name as bom_no, bom.docstatus as bom_docstatus,
+				bom_item.item_code, sum(bom_item.stock_qty/ifnull(bom.quantity, 1)) as qty,
+				bom_item.description, bom_item.stock_uom
+			from `tabBOM Item` bom_item, `tabBOM` bom
+			where bom.name = bom_item.parent and bom_item.docstatus < 2
+				and bom.name in ({0})
+			group by bom.name, bom_item.item_code
+			order by bom.name, bom_item.item_code""".format(", ".join(["%s"] * len(chunk))),
+			tuple(chunk), as_dict=1):
+				if d.pop("bom_docstatus") == 1:
+					submitted.add(d.bom_no)
+
+				d.qty = flt(d.qty)
+				children.setdefault(d.pop("bom_no"), []).append(d)
+
+		for bom_no in submitted:
+			cache.hset("bom_children", bom_no, children[bom_no])
+
+	return children
+
+def clear_bom_children_cache(bom_no):
+	frappe.cache().hdel("bom_children", bom_no)
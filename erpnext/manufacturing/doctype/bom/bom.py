@@ -8,6 +8,7 @@ from frappe import _
 from erpnext.setup.utils import get_exchange_rate
 from frappe.website.website_generator import WebsiteGenerator
 from erpnext.stock.get_item_details import get_conversion_factor
+from erpnext.manufacturing.bom_graph import clear_bom_children_cache
 
 from operator import itemgetter
 
@@ -62,10 +63,12 @@ class BOM(WebsiteGenerator):
 
 	def on_submit(self):
 		self.manage_default_bom()
+		clear_bom_children_cache(self.name)
 
 	def on_cancel(self):
 		frappe.db.set(self, "is_active", 0)
 		frappe.db.set(self, "is_default", 0)
+		clear_bom_children_cache(self.name)
 
 		# check if used in any other bom
 		self.validate_bom_links()
@@ -633,24 +636,65 @@ def get_children(doctype, parent=None, is_root=False, **filters):
 			""", frappe.form_dict.parent, as_dict=True)
 
 def get_boms_in_bottom_up_order(bom_no=None):
-	def _get_parent(bom_no):
-		return frappe.db.sql_list("""select distinct parent from `tabBOM Item`
-			where bom_no = %s and docstatus=1 and parenttype='BOM'""", bom_no)
+	"""
+		Submitted BOMs, each after all the BOMs used in it. With `bom_no`, only that BOM and
+		the BOMs it is used in, at any level. Built from one load of all BOM links.
+	"""
+	parents, children = get_bom_links()
 
-	count = 0
-	bom_list = []
 	if bom_no:
-		bom_list.append(bom_no)
+		bom_list = get_where_used(bom_no, parents)
+		bom_list.add(bom_no)
 	else:
-		# get all leaf BOMs
-		bom_list = frappe.db.sql_list("""select name from `tabBOM` bom where docstatus=1
-			and not exists(select bom_no from `tabBOM Item`
-				where parent=bom.name and ifnull(bom_no, '')!='')""")
-
-	while(count < len(bom_list)):
-		for child_bom in _get_parent(bom_list[count]):
-			if child_bom not in bom_list:
-				bom_list.append(child_bom)
-		count += 1
-
-	return bom_list
+		bom_list = set(frappe.db.sql_list("select name from `tabBOM` where docstatus=1"))
+
+	return sort_boms_bottom_up(bom_list, parents, children)
+
+def get_bom_links(include_drafts=False):
+	"""({bom_no: BOMs using it}, {bom_no: BOMs used in it}) of all BOMs, from one query"""
+	parents, children = {}, {}
+	for parent, child in frappe.db.sql("""select distinct parent, bom_no from `tabBOM Item`
+		where ifnull(bom_no, '') != '' and docstatus {0} and parenttype='BOM'""".format(
+			"< 2" if include_drafts else "= 1")):
+			parents.setdefault(child, []).append(parent)
+			children.setdefault(parent, []).append(child)
+
+	return parents, children
+
+def get_where_used(bom_no, parents):
+	"""BOMs using `bom_no` at any level, each visited once so that a recursion cannot loop"""
+	from collections import deque
+
+	where_used = set()
+	queue = deque([bom_no])
+	while queue:
+		for parent in parents.get(queue.popleft(), []):
+			if parent not in where_used:
+				where_used.add(parent)
+				queue.append(parent)
+
+	return where_used
+
+def sort_boms_bottom_up(bom_list, parents, children):
+	"""`bom_list` ordered so that each BOM comes after the BOMs of the list used in it"""
+	from collections import deque
+
+	# number of BOMs used in each BOM that are yet to be placed
+	pending = dict((bom, len([d for d in children.get(bom, []) if d in bom_list])) for bom in bom_list)
+	queue = deque(sorted(bom for bom in bom_list if not pending[bom]))
+
+	ordered = []
+	while queue:
+		bom = queue.popleft()
+		ordered.append(bom)
+		for parent in parents.get(bom, []):
+			if parent in pending:
+				pending[parent] -= 1
+				if not pending[parent]:
+					queue.append(parent)
+
+	# BOMs in a recursion are never freed, add them at the end instead of leaving them out
+	ordered_set = set(ordered)
+	ordered.extend(sorted(bom for bom in bom_list if bom not in ordered_set))
+
+	return ordered
@@ -5,7 +5,7 @@
 from __future__ import unicode_literals
 import unittest
 import frappe
-from frappe.utils import cstr
+from frappe.utils import cstr, flt
 from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import create_stock_reconciliation
 from erpnext.manufacturing.doctype.bom_update_tool.bom_update_tool import update_cost
 
@@ -77,6 +77,28 @@ class TestBOM(unittest.TestCase):
 			where item_code='_Test Item 2' and docstatus=1 and parenttype='BOM'""", as_dict=1):
 				self.assertEqual(d.rate, rm_rate + 10)
 
+	def test_bom_cost_rollup_matches_update_cost(self):
+		from erpnext.manufacturing.doctype.bom.bom import get_boms_in_bottom_up_order
+
+		sub_assembly_bom = "BOM-_Test Item Home Desktop Manufactured-001"
+		rm_rate = flt(frappe.db.get_value("BOM Item", {"parent": sub_assembly_bom,
+			"item_code": "_Test Item 2", "parenttype": "BOM"}, "rate"))
+		create_stock_reconciliation(item_code="_Test Item 2", warehouse="_Test Warehouse - _TC",
+			qty=200, rate=rm_rate + 7)
+
+		# the sub-assembly and the BOMs using it
+		bom_list = get_boms_in_bottom_up_order(sub_assembly_bom)
+		self.assertTrue(len(bom_list) > 1)
+
+		update_cost()
+		rolled_up = get_bom_costs(bom_list)
+
+		# cost each BOM again with BOM.update_cost, children first
+		for bom_no in bom_list:
+			frappe.get_doc("BOM", bom_no).update_cost(update_parent=False, from_child_bom=True)
+
+		self.assertEqual(rolled_up, get_bom_costs(bom_list))
+
 	def test_bom_cost(self):
 		bom = frappe.copy_doc(test_records[2])
 		bom.insert()
@@ -125,5 +147,61 @@ class TestBOM(unittest.TestCase):
 		self.assertEqual(bom.base_raw_material_cost, 27000)
 		self.assertEqual(bom.base_total_cost, 33000)
 
+	def test_boms_in_bottom_up_order(self):
+		from erpnext.manufacturing.doctype.bom.bom import get_boms_in_bottom_up_order
+
+		bom_list = get_boms_in_bottom_up_order()
+		position = dict((bom, i) for i, bom in enumerate(bom_list))
+		self.assertEqual(len(position), len(bom_list))
+
+		for parent, child in frappe.db.sql("""select parent, bom_no from `tabBOM Item`
+			where ifnull(bom_no, '') != '' and docstatus=1 and parenttype='BOM'"""):
+				if parent in position and child in position:
+					self.assertTrue(position[child] < position[parent])
+
+		# a BOM and the BOMs it is used in
+		sub_assembly_bom = "BOM-_Test Item Home Desktop Manufactured-001"
+		bom_list = get_boms_in_bottom_up_order(sub_assembly_bom)
+		self.assertEqual(bom_list[0], sub_assembly_bom)
+		self.assertTrue(get_default_bom() in bom_list)
+
+	def test_bom_graph(self):
+		from erpnext.manufacturing.bom_graph import BOMGraph, get_bom_children
+
+		bom = frappe.get_doc("BOM", get_default_bom())
+		graph = BOMGraph([bom.name])
+
+		children = dict((d.item_code, d.qty) for d in graph.get_children(bom.name))
+		for d in bom.items:
+			self.assertEqual(children.get(d.item_code), d.stock_qty / bom.quantity)
+
+		# sub-assemblies are loaded with their default BOM
+		for d in bom.items:
+			default_bom = frappe.db.get_value("Item", d.item_code, "default_bom")
+			if default_bom:
+				self.assertTrue(default_bom in graph.children)
+
+		# submitted BOMs are served from the cache
+		self.assertEqual(frappe.cache().hget("bom_children", bom.name), get_bom_children([bom.name])[bom.name])
+
 def get_default_bom(item_code="_Test FG Item 2"):
 	return frappe.db.get_value("BOM", {"item": item_code, "is_active": 1, "is_default": 1})
+
+def get_bom_costs(bom_list):
+	"""costs, item rates and exploded items of the BOMs, as saved"""
+	from erpnext.manufacturing.bom_cost import BOM_COST_FIELDS
+
+	def rounded(rows):
+		return [[d[0]] + [flt(value, 4) for value in d[1:]] for d in rows]
+
+	costs = {}
+	for bom_no in bom_list:
+		costs[bom_no] = (
+			[flt(d, 4) for d in frappe.db.get_value("BOM", bom_no, BOM_COST_FIELDS)],
+			rounded(frappe.db.sql("""select item_code, rate, base_rate, amount, base_amount, qty_consumed_per_unit
+				from `tabBOM Item` where parent=%s and parenttype='BOM' order by idx""", bom_no)),
+			rounded(frappe.db.sql("""select item_code, stock_qty, rate, amount, qty_consumed_per_unit
+				from `tabBOM Explosion Item` where parent=%s order by item_code""", bom_no))
+		)
+
+	return costs
@@ -18,6 +18,12 @@ frappe.ui.form.on('BOM Update Tool', {
 		});
 	},
 
+	onload: function(frm) {
+		frappe.realtime.on("bom_update_tool_progress", function(data) {
+			frappe.show_progress(__("Replacing BOM"), data.progress[0], data.progress[1]);
+		});
+	},
+
 	refresh: function(frm) {
 		frm.disable_save();
 	},
@@ -7,32 +7,40 @@ import frappe, json
 from frappe.utils import cstr, flt
 from frappe import _
 from six import string_types
-from erpnext.manufacturing.doctype.bom.bom import get_boms_in_bottom_up_order
+from erpnext.manufacturing.doctype.bom.bom import (get_boms_in_bottom_up_order, get_bom_links,
+	get_where_used, sort_boms_bottom_up)
 from frappe.model.document import Document
 
 class BOMUpdateTool(Document):
 	def replace_bom(self):
+		from erpnext.manufacturing.bom_cost import BOMCostRollup
+
 		self.validate_bom()
+		parents, children = self.get_bom_links_after_replace()
+		bom_list = get_where_used(self.new_bom, parents)
+		if self.new_bom in bom_list:
+			frappe.throw(_("BOM recursion: {0} cannot be used in {1}").format(self.new_bom, self.current_bom))
+
 		self.update_new_bom()
-		bom_list = self.get_parent_boms(self.new_bom)
-		updated_bom = []
-
-		for bom in bom_list:
-			try:
-				bom_obj = frappe.get_doc("BOM", bom)
-				bom_obj.get_doc_before_save()
-				updated_bom = bom_obj.update_cost_and_exploded_items(updated_bom)
-				bom_obj.calculate_cost()
-				bom_obj.update_parent_cost()
-				bom_obj.db_update()
-				if (getattr(bom_obj.meta, 'track_changes', False)
-					and bom_obj._doc_before_save and not bom_obj.flags.ignore_version):
-					bom_obj.save_version()
-
-				frappe.db.commit()
-			except Exception:
-				frappe.db.rollback()
-				frappe.log_error(frappe.get_traceback())
+		frappe.db.commit()
+
+		# each BOM is recosted once, after the BOMs used in it, and committed per chunk
+		BOMCostRollup(sort_boms_bottom_up(bom_list, parents, children), refresh_rates=False,
+			rebuild_exploded_items=True, include_drafts=True, commit=True,
+			progress=self.publish_progress).run()
+
+	def get_bom_links_after_replace(self):
+		"""links of all draft and submitted BOMs, as they will be after replacing the current BOM"""
+		parents, children = get_bom_links(include_drafts=True)
+		for parent in parents.pop(self.current_bom, []):
+			children[parent] = list(set(self.new_bom if d == self.current_bom else d for d in children[parent]))
+			if parent not in parents.setdefault(self.new_bom, []):
+				parents[self.new_bom].append(parent)
+
+		return parents, children
+
+	def publish_progress(self, done, total):
+		frappe.publish_realtime("bom_update_tool_progress", dict(progress=[done, total]), user=frappe.session.user)
 
 	def validate_bom(self):
 		if cstr(self.current_bom) == cstr(self.new_bom):
@@ -51,19 +59,6 @@ class BOMUpdateTool(Document):
 			rate=%s, amount=stock_qty*%s where bom_no = %s and docstatus < 2 and parenttype='BOM'""",
 			(self.new_bom, new_bom_unitcost, new_bom_unitcost, self.current_bom))
 
-	def get_parent_boms(self, bom, bom_list=None):
-		if not bom_list:
-			bom_list = []
-
-		data = frappe.db.sql(""" select distinct parent from `tabBOM Item`
-			where ifnull(bom_no, '') = %s and docstatus < 2 and parenttype='BOM'""", bom)
-
-		for d in data:
-			bom_list.append(d[0])
-			self.get_parent_boms(d[0], bom_list)
-
-		return list(set(bom_list))
-
 @frappe.whitelist()
 def enqueue_replace_bom(args):
 	if isinstance(args, string_types):
@@ -90,6 +85,6 @@ def replace_bom(args):
 	doc.replace_bom()
 
 def update_cost():
-	bom_list = get_boms_in_bottom_up_order()
-	for bom in bom_list:
-		frappe.get_doc("BOM", bom).update_cost(update_parent=False, from_child_bom=True)
\ No newline at end of file
+	from erpnext.manufacturing.bom_cost import BOMCostRollup
+
+	BOMCostRollup(get_boms_in_bottom_up_order()).run()
\ No newline at end of file
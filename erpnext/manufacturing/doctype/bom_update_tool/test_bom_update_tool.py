@@ -27,4 +27,22 @@ class TestBOMUpdateTool(unittest.TestCase):
 		# reverse, as it affects other testcases
 		update_tool.current_bom = bom_doc.name
 		update_tool.new_bom = current_bom
-		update_tool.replace_bom()
\ No newline at end of file
+		update_tool.replace_bom()
+
+	def test_replace_bom_recursion(self):
+		current_bom = "BOM-_Test Item Home Desktop Manufactured-001"
+		parent_bom = frappe.db.get_value("BOM", {"item": "_Test FG Item 2", "docstatus": 1})
+
+		# new BOM using a BOM that uses the current BOM
+		bom_doc = frappe.copy_doc(test_records[0])
+		bom_doc.items[1].item_code = "_Test FG Item 2"
+		bom_doc.items[1].bom_no = parent_bom
+		bom_doc.insert()
+
+		update_tool = frappe.get_doc("BOM Update Tool")
+		update_tool.current_bom = current_bom
+		update_tool.new_bom = bom_doc.name
+		self.assertRaises(frappe.ValidationError, update_tool.replace_bom)
+
+		self.assertTrue(frappe.db.sql("select name from `tabBOM Item` where bom_no=%s and parent=%s",
+			(current_bom, parent_bom)))
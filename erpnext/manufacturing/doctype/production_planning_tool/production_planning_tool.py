@@ -10,6 +10,7 @@ from frappe import msgprint, _
 from frappe.model.document import Document
 from erpnext.manufacturing.doctype.bom.bom import validate_bom_no
 from erpnext.manufacturing.doctype.production_order.production_order import get_item_details
+from erpnext.manufacturing.bom_graph import BOMGraph
 
 class ProductionPlanningTool(Document):
 	def clear_table(self, table_name):
@@ -311,6 +312,7 @@ class ProductionPlanningTool(Document):
 		"""
 		item_list = []
 		precision = frappe.get_precision("BOM Item", "stock_qty")
+		bom_graph = None
 
 		for bom, so_wise_qty in bom_dict.items():
 			bom_wise_item_details = {}
@@ -330,8 +332,13 @@ class ProductionPlanningTool(Document):
 			else:
 				# Get all raw materials considering SA items as raw materials,
 				# so no childs of SA items
+				if not bom_graph:
+					# all BOMs of the run, with their sub-assemblies, in a few queries
+					bom_graph = self.get_bom_graph(bom_dict.keys())
+
 				bom_wise_item_details = self.get_subitems(bom_wise_item_details, bom,1, \
-					self.use_multi_level_bom,self.only_raw_materials, self.include_subcontracted,non_stock_item)
+					self.use_multi_level_bom,self.only_raw_materials, self.include_subcontracted,non_stock_item,
+					bom_graph=bom_graph)
 
 			for item, item_details in bom_wise_item_details.items():
 				for so_qty in so_wise_qty:
@@ -341,28 +348,32 @@ class ProductionPlanningTool(Document):
 
 		self.make_items_dict(item_list)
 
-	def get_subitems(self,bom_wise_item_details, bom, parent_qty, include_sublevel, only_raw, supply_subs,non_stock_item=0):
-		items = frappe.db.sql("""
-			SELECT
-				bom_item.item_code,
-				default_material_request_type,
-				ifnull(%(parent_qty)s * sum(bom_item.stock_qty/ifnull(bom.quantity, 1)), 0) as qty,
-				item.is_sub_contracted_item as is_sub_contracted,
-				item.default_bom as default_bom,
-				bom_item.description as description,
-				bom_item.stock_uom as stock_uom,
-				item.min_order_qty as min_order_qty
-			FROM
-				`tabBOM Item` bom_item,
-				`tabBOM` bom,
-				tabItem item
-			where
-				bom.name = bom_item.parent
-				and bom.name = %(bom)s
-				and bom_item.docstatus < 2
-				and bom_item.item_code = item.name
-			""" + ("and item.is_stock_item = 1", "")[non_stock_item] + """
-			group by bom_item.item_code""", {"bom": bom, "parent_qty": parent_qty}, as_dict=1)
+	def get_bom_graph(self, bom_nos):
+		bom_graph = BOMGraph(bom_nos)
+		self.sub_assembly_projected_qty = self.get_items_projected_qty(bom_graph.get_sub_assembly_items())
+		return bom_graph
+
+	def get_subitems(self,bom_wise_item_details, bom, parent_qty, include_sublevel, only_raw, supply_subs,non_stock_item=0,
+		bom_graph=None):
+		if not bom_graph:
+			bom_graph = self.get_bom_graph([bom])
+
+		items = []
+		for child in bom_graph.get_children(bom):
+			item = bom_graph.get_item(child.item_code)
+			if not item or not (non_stock_item or item.is_stock_item):
+				continue
+
+			items.append(frappe._dict({
+				"item_code": child.item_code,
+				"default_material_request_type": item.default_material_request_type,
+				"qty": flt(parent_qty) * child.qty,
+				"is_sub_contracted": item.is_sub_contracted_item,
+				"default_bom": item.default_bom,
+				"description": child.description,
+				"stock_uom": child.stock_uom,
+				"min_order_qty": item.min_order_qty
+			}))
 
 		for d in items:
 			if ((d.default_material_request_type == "Purchase"
@@ -379,7 +390,9 @@ class ProductionPlanningTool(Document):
 					or (d.default_material_request_type == "Manufacture")):
 
 					my_qty = 0
-					projected_qty = self.get_item_projected_qty(d.item_code)
+					if d.item_code not in self.sub_assembly_projected_qty:
+						self.sub_assembly_projected_qty[d.item_code] = self.get_item_projected_qty(d.item_code)
+					projected_qty = self.sub_assembly_projected_qty[d.item_code]
 					if self.create_material_requests_for_all_required_qty:
 						my_qty = d.qty
 					else:
@@ -391,7 +404,7 @@ class ProductionPlanningTool(Document):
 
 					if my_qty > 0:
 						self.get_subitems(bom_wise_item_details,
-							d.default_bom, my_qty, include_sublevel, only_raw, supply_subs)
+							d.default_bom, my_qty, include_sublevel, only_raw, supply_subs, bom_graph=bom_graph)
 
 		return bom_wise_item_details
 
@@ -497,6 +510,21 @@ class ProductionPlanningTool(Document):
 
 		return item_projected_qty[0].qty
 
+	def get_items_projected_qty(self, items, chunk_size=1000):
+		"""projected qty of the given items, as per `get_item_projected_qty`, in one query per chunk"""
+		conditions, values = "", []
+		if self.purchase_request_for_warehouse:
+			conditions, values = " and warehouse=%s", [self.purchase_request_for_warehouse]
+
+		item_projected_qty = dict((item, 0) for item in items)
+		for i in range(0, len(items), chunk_size):
+			chunk = items[i:i + chunk_size]
+			item_projected_qty.update(frappe.db.sql("""select item_code, ifnull(sum(projected_qty),0)
+				from `tabBin` where item_code in ({0}) {1} group by item_code""".format(
+					", ".join(["%s"] * len(chunk)), conditions), tuple(chunk + values)))
+
+		return item_projected_qty
+
 	def get_projected_qty(self):
 		items = self.item_dict.keys()
 		item_projected_qty = frappe.db.sql("""select item_code, sum(projected_qty)
@@ -0,0 +1,11 @@
+# Copyright (c) 2018, Frappe and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+	rebuild_warehouse_group_projected_qty
+
+def execute():
+	frappe.reload_doc("stock", "doctype", "warehouse_group_projected_qty")
+	rebuild_warehouse_group_projected_qty()
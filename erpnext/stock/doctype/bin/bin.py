@@ -3,18 +3,26 @@
 
 from __future__ import unicode_literals
 import frappe
-from frappe.utils import flt, nowdate
+from frappe.utils import flt, nowdate, now
 import frappe.defaults
 from frappe.model.document import Document
+from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+	update_warehouse_group_projected_qty
 
 class Bin(Document):
 	def validate(self):
 		if self.get("__islocal") or not self.stock_uom:
 			self.stock_uom = frappe.db.get_value('Item', self.item_code, 'stock_uom')
 
+		# projected qty as saved, the warehouse groups get the change on update
+		self.flags.previous_projected_qty = 0 if self.get("__islocal") else flt(self.projected_qty)
+
 		self.validate_mandatory()
 		self.set_projected_qty()
 
+	def on_update(self):
+		self.update_warehouse_groups(self.flags.previous_projected_qty)
+
 	def validate_mandatory(self):
 		qf = ['actual_qty', 'reserved_qty', 'ordered_qty', 'indented_qty']
 		for f in qf:
@@ -55,8 +63,16 @@ class Bin(Document):
 		self.indented_qty = flt(self.indented_qty) + flt(args.get("indented_qty"))
 		self.planned_qty = flt(self.planned_qty) + flt(args.get("planned_qty"))
 
+		projected_qty = self.projected_qty
 		self.set_projected_qty()
+		# db_update keeps modified as it was, offline POS syncs the stock of Bins modified since its last sync
+		self.modified = now()
 		self.db_update()
+		self.update_warehouse_groups(projected_qty)
+
+	def update_warehouse_groups(self, previous_projected_qty):
+		update_warehouse_group_projected_qty(self.item_code, self.warehouse,
+			flt(self.projected_qty) - flt(previous_projected_qty))
 
 	def set_projected_qty(self):
 		self.projected_qty = (flt(self.actual_qty) + flt(self.ordered_qty)
@@ -68,7 +84,7 @@ class Bin(Document):
 			select * from `tabStock Ledger Entry`
 			where item_code = %s
 			and warehouse = %s
-			order by timestamp(posting_date, posting_time) asc, name asc
+			order by posting_datetime asc, name asc
 			limit 1
 		""", (self.item_code, self.warehouse), as_dict=1)
 		return sle and sle[0] or None
@@ -87,10 +103,12 @@ class Bin(Document):
 				and pro.status not in ("Stopped", "Completed")
 				and item.required_qty > item.transferred_qty''', (self.item_code, self.warehouse))[0][0]
 
+		projected_qty = self.projected_qty
 		self.set_projected_qty()
 
 		self.db_set('reserved_qty_for_production', flt(self.reserved_qty_for_production))
 		self.db_set('projected_qty', self.projected_qty)
+		self.update_warehouse_groups(projected_qty)
 
 	def update_reserved_qty_for_sub_contracting(self):
 		#reserved qty
@@ -130,9 +148,11 @@ class Bin(Document):
 		else:
 			reserved_qty_for_sub_contract = 0
 
+		projected_qty = self.projected_qty
 		self.db_set('reserved_qty_for_sub_contract', reserved_qty_for_sub_contract)
 		self.set_projected_qty()
 		self.db_set('projected_qty', self.projected_qty)
+		self.update_warehouse_groups(projected_qty)
 
 def on_doctype_update():
 	frappe.db.add_index("Bin", ["item_code", "warehouse"])
@@ -5,8 +5,29 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from frappe.utils import flt
+from erpnext.stock.stock_balance import recompute_bin_qty, get_reserved_qty, get_ordered_qty
 
 # test_records = frappe.get_test_records('Bin')
 
 class TestBin(unittest.TestCase):
-	pass
+	def test_recompute_bin_qty(self):
+		from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
+
+		item_code, warehouse = "_Test Item", "_Test Warehouse - _TC"
+		make_sales_order(item_code=item_code, warehouse=warehouse, qty=5)
+
+		bin = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
+			["name", "reserved_qty"], as_dict=1)
+		frappe.db.set_value("Bin", bin.name, "reserved_qty", flt(bin.reserved_qty) + 7)
+
+		drift = recompute_bin_qty(item_code, update=False)
+		drifted_bin = [d for d in drift if d.warehouse == warehouse][0]
+		self.assertEqual(drifted_bin.actual["reserved_qty"], flt(bin.reserved_qty) + 7)
+		self.assertEqual(drifted_bin.expected["reserved_qty"], get_reserved_qty(item_code, warehouse))
+		self.assertEqual(drifted_bin.expected["ordered_qty"], get_ordered_qty(item_code, warehouse))
+
+		recompute_bin_qty(item_code)
+		self.assertEqual(flt(frappe.db.get_value("Bin", bin.name, "reserved_qty")),
+			get_reserved_qty(item_code, warehouse))
+		self.assertFalse([d for d in recompute_bin_qty(item_code) if d.warehouse == warehouse])
@@ -12,6 +12,8 @@ from frappe.utils import (cstr, flt, cint, getdate, now_datetime, formatdate,
 from frappe.utils.html_utils import clean_html
 from frappe.website.website_generator import WebsiteGenerator
 from erpnext.setup.doctype.item_group.item_group import invalidate_cache_for, get_parent_item_groups
+from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+	merge_warehouse_group_projected_qty
 from frappe.website.render import clear_cache
 from frappe.website.doctype.website_slideshow.website_slideshow import get_slideshow
 from erpnext.controllers.item_variant import (get_variant, copy_attributes_to_variant,
@@ -402,8 +404,9 @@ class Item(WebsiteGenerator):
 
 		[self.remove(d) for d in to_remove]
 
-	def update_template_tables(self):
-		template = frappe.get_doc("Item", self.variant_of)
+	def update_template_tables(self, template=None):
+		if not template:
+			template = frappe.get_doc("Item", self.variant_of)
 
 		# add item taxes from template
 		for d in template.get("taxes"):
@@ -526,6 +529,9 @@ class Item(WebsiteGenerator):
 				frappe.throw(_("To merge, following properties must be same for both items")
 					+ ": \n" + ", ".join([self.meta.get_label(fld) for fld in field_list]))
 
+			# the totals of both items would share the unique (item, warehouse) key once renamed
+			merge_warehouse_group_projected_qty(old_name, new_name)
+
 	def after_rename(self, old_name, new_name, merge):
 		if self.route:
 			invalidate_cache_for_item(self)
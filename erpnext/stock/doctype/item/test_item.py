@@ -100,6 +100,70 @@ class TestItem(unittest.TestCase):
 		for key, value in to_check.iteritems():
 			self.assertEquals(value, details.get(key))
 
+	def test_get_item_details_for_items(self):
+		from erpnext.stock.get_item_details import get_item_details_for_items
+
+		make_test_objects("Item Price")
+
+		args = {
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"currency": "_Test Currency",
+			"doctype": "Sales Order",
+			"conversion_rate": 1,
+			"price_list_currency": "_Test Currency",
+			"plc_conversion_rate": 1,
+			"order_type": "Sales",
+			"customer": "_Test Customer",
+			"price_list_uom_dependant": 1,
+			"ignore_pricing_rule": 1
+		}
+		items = [{"item_code": "_Test Item", "qty": 2}, {"item_code": "_Test Item 2"},
+			{"item_code": "_Test Item", "qty": 5}]
+
+		details = get_item_details_for_items(args, items)
+
+		self.assertEquals([d.item_code for d in details], ["_Test Item", "_Test Item 2", "_Test Item"])
+		for item, item_details in zip(items, details):
+			row_args = dict(args)
+			row_args.update(item)
+			self.assertEquals(item_details, get_item_details(row_args))
+
+	def test_auto_insert_price_for_items(self):
+		from erpnext.stock.get_item_details import get_item_details_for_items
+
+		make_item("_Test Item for Auto Price List", {"is_stock_item": 0})
+		auto_insert_price = frappe.db.get_single_value("Stock Settings",
+			"auto_insert_price_list_rate_if_missing")
+		frappe.db.set_value("Stock Settings", None, "auto_insert_price_list_rate_if_missing", 1)
+		frappe.db.sql("""delete from `tabItem Price` where price_list='_Test Price List'
+			and item_code='_Test Item for Auto Price List'""")
+
+		args = {
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"currency": "INR",
+			"doctype": "Sales Order",
+			"conversion_rate": 1,
+			"price_list_currency": "INR",
+			"plc_conversion_rate": 1,
+			"order_type": "Sales",
+			"customer": "_Test Customer",
+			"ignore_pricing_rule": 1
+		}
+
+		try:
+			# the price inserted for the first row is used by the second
+			details = get_item_details_for_items(args, [{"item_code": "_Test Item for Auto Price List", "rate": 100},
+				{"item_code": "_Test Item for Auto Price List", "rate": 150}])
+
+			self.assertEquals(frappe.db.get_value("Item Price", {"price_list": "_Test Price List",
+				"item_code": "_Test Item for Auto Price List"}, "price_list_rate"), 100)
+			self.assertEquals(details[1].price_list_rate, 100)
+		finally:
+			frappe.db.set_value("Stock Settings", None, "auto_insert_price_list_rate_if_missing",
+				auto_insert_price)
+
 	def test_item_attribute_change_after_variant(self):
 		frappe.delete_doc_if_exists("Item", "_Test Variant Item-L", force=1)
 
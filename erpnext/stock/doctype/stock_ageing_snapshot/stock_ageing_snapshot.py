@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe, json
+from collections import deque
+from six import string_types
+from frappe.utils import flt, cstr, getdate, get_last_day, add_months, nowdate
+from frappe.model.document import Document
+
+class StockAgeingSnapshot(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index("Stock Ageing Snapshot", ["item_code", "warehouse", "period_end_date"])
+
+class StockAgeingQueue(object):
+	"""
+		FIFO queue of [qty, posting_date] batches of an item in a warehouse, oldest batch first,
+		with the balance qty after the last stock ledger entry added to it.
+	"""
+	def __init__(self, fifo_queue=None, qty_after_transaction=0):
+		if isinstance(fifo_queue, string_types):
+			fifo_queue = json.loads(fifo_queue)
+
+		self.queue = deque([flt(batch[0]), getdate(batch[1])] for batch in fifo_queue or [])
+		self.qty_after_transaction = flt(qty_after_transaction)
+
+	def add_entry(self, sle):
+		actual_qty = flt(sle.actual_qty)
+		if sle.voucher_type == "Stock Reconciliation":
+			actual_qty = flt(sle.qty_after_transaction) - self.qty_after_transaction
+
+		if actual_qty > 0:
+			self.queue.append([actual_qty, getdate(sle.posting_date)])
+		else:
+			qty_to_pop = abs(actual_qty)
+			while qty_to_pop:
+				batch = self.queue[0] if self.queue else [0, None]
+				if 0 < batch[0] <= qty_to_pop:
+					# if batch qty > 0
+					# not enough or exactly same qty in current batch, clear batch
+					qty_to_pop -= batch[0]
+					self.queue.popleft()
+				else:
+					# all from current batch
+					batch[0] -= qty_to_pop
+					qty_to_pop = 0
+
+		self.qty_after_transaction = flt(sle.qty_after_transaction)
+
+	def serialize(self):
+		return json.dumps([[qty, cstr(posting_date)] for qty, posting_date in self.queue],
+			separators=(',', ':'))
+
+def get_latest_snapshots(company, to_date, conditions="", values=None):
+	"""
+		latest snapshot on or before `to_date` per (item_code, warehouse) of the company,
+		`conditions` are on the item_code and warehouse columns
+	"""
+	values = dict(values or {}, company=company, to_date=to_date)
+
+	snapshots = {}
+	for d in frappe.db.sql("""select s.item_code, s.warehouse, s.period_end_date, s.fifo_queue,
+			s.qty_after_transaction
+		from `tabStock Ageing Snapshot` s
+		where s.company=%(company)s
+			and s.period_end_date = (select max(period_end_date) from `tabStock Ageing Snapshot`
+				where item_code=s.item_code and warehouse=s.warehouse and period_end_date <= %(to_date)s)
+			{0}""".format(conditions), values, as_dict=True):
+		snapshots[(d.item_code, d.warehouse)] = d
+
+	return snapshots
+
+def delete_stock_ageing_snapshots(item_code, warehouse, posting_date):
+	"""snapshots from the period of a backdated entry onwards no longer match the ledger"""
+	frappe.db.sql("""delete from `tabStock Ageing Snapshot`
+		where item_code=%s and warehouse=%s and period_end_date >= %s""",
+		(item_code, warehouse, getdate(posting_date)))
+
+def make_stock_ageing_snapshots(period_end_date=None):
+	"""
+		daily: snapshot the age queue of every item and warehouse as on the end of the last
+		closed month, replaying only the entries posted after its previous snapshot
+	"""
+	period_end_date = getdate(period_end_date or get_last_day(add_months(nowdate(), -1)))
+
+	pairs = frappe.db.sql("""select bin.item_code, bin.warehouse, wh.company
+		from `tabBin` bin, `tabWarehouse` wh
+		where wh.name = bin.warehouse
+			and not exists(select name from `tabStock Ageing Snapshot`
+				where item_code=bin.item_code and warehouse=bin.warehouse and period_end_date=%s)""",
+		period_end_date, as_dict=True)
+
+	for i, d in enumerate(pairs):
+		make_stock_ageing_snapshot(d.item_code, d.warehouse, d.company, period_end_date)
+
+		if i % 100 == 99:
+			frappe.db.commit()
+
+	frappe.db.commit()
+
+def make_stock_ageing_snapshot(item_code, warehouse, company, period_end_date):
+	previous_snapshot = frappe.db.sql("""select period_end_date, fifo_queue, qty_after_transaction
+		from `tabStock Ageing Snapshot`
+		where item_code=%s and warehouse=%s and period_end_date < %s
+		order by period_end_date desc limit 1""", (item_code, warehouse, period_end_date), as_dict=True)
+	previous_snapshot = previous_snapshot[0] if previous_snapshot else frappe._dict()
+
+	sle_list = frappe.db.sql("""select actual_qty, posting_date, voucher_type, qty_after_transaction
+		from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s and posting_date > %s and posting_date <= %s
+		order by posting_datetime, name""",
+		(item_code, warehouse, previous_snapshot.period_end_date or "1900-01-01", period_end_date),
+		as_dict=True)
+
+	# no stock movement yet
+	if not (previous_snapshot or sle_list):
+		return
+
+	ageing_queue = StockAgeingQueue(previous_snapshot.fifo_queue, previous_snapshot.qty_after_transaction)
+	for sle in sle_list:
+		ageing_queue.add_entry(sle)
+
+	frappe.get_doc({
+		"doctype": "Stock Ageing Snapshot",
+		"item_code": item_code,
+		"warehouse": warehouse,
+		"company": company,
+		"period_end_date": period_end_date,
+		"qty_after_transaction": ageing_queue.qty_after_transaction,
+		"fifo_queue": ageing_queue.serialize()
+	}).insert(ignore_permissions=True)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_ageing_snapshot.stock_ageing_snapshot import make_stock_ageing_snapshots
+from erpnext.stock.report.stock_ageing.stock_ageing import execute
+
+class TestStockAgeingSnapshot(unittest.TestCase):
+	def setUp(self):
+		frappe.db.sql("delete from `tabStock Ageing Snapshot`")
+
+	def get_report(self, **filters):
+		filters.update({"company": "_Test Company", "to_date": "2013-03-31",
+			"item_code": "_Test Item"})
+		return execute(filters)[1]
+
+	def test_ageing_from_snapshots(self):
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10,
+			basic_rate=100, posting_date="2013-01-10")
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=5,
+			basic_rate=100, posting_date="2013-02-10")
+		make_stock_entry(item_code="_Test Item", source="_Test Warehouse - _TC", qty=12,
+			posting_date="2013-03-05")
+
+		without_snapshots = self.get_report()
+		make_stock_ageing_snapshots("2013-02-28")
+		self.assertTrue(frappe.db.get_value("Stock Ageing Snapshot", {"item_code": "_Test Item",
+			"warehouse": "_Test Warehouse - _TC", "period_end_date": "2013-02-28"}))
+
+		self.assertEqual(self.get_report(), without_snapshots)
+
+		rows = self.get_report(show_warehouse_wise_stock=1)
+		self.assertTrue([d for d in rows if d[5] == "_Test Warehouse - _TC"])
+
+	def test_backdated_entry_removes_snapshots(self):
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10,
+			basic_rate=100, posting_date="2013-01-10")
+		make_stock_ageing_snapshots("2013-02-28")
+
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=5,
+			basic_rate=100, posting_date="2013-01-20")
+
+		self.assertFalse(frappe.db.get_value("Stock Ageing Snapshot", {"item_code": "_Test Item",
+			"warehouse": "_Test Warehouse - _TC", "period_end_date": "2013-02-28"}))
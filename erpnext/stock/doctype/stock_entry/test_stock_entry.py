@@ -75,6 +75,14 @@ class TestStockEntry(unittest.TestCase):
 
 		frappe.db.set_default("allow_negative_stock", 0)
 
+	def test_stock_ledger_entries_are_submitted(self):
+		se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=5, basic_rate=100)
+
+		docstatus = frappe.db.sql_list("""select docstatus from `tabStock Ledger Entry`
+			where voucher_type='Stock Entry' and voucher_no=%s""", se.name)
+		self.assertTrue(docstatus)
+		self.assertEqual(set(docstatus), set([1]))
+
 	def test_auto_material_request(self):
 		make_item_variant()
 		self._test_auto_material_request("_Test Item")
@@ -122,6 +130,14 @@ class TestStockEntry(unittest.TestCase):
 			variant.save()
 
 		from erpnext.stock.reorder_item import reorder_item
+
+		# dry run returns the plan without creating Material Requests
+		mr_count = frappe.db.count("Material Request")
+		plan = reorder_item(dry_run=True)
+		self.assertEqual(frappe.db.count("Material Request"), mr_count)
+		self.assertTrue(item_code in [d["item_code"] for request_type in plan
+			for company in plan[request_type] for d in plan[request_type][company]])
+
 		mr_list = reorder_item()
 
 		frappe.db.set_value("Stock Settings", None, "auto_indent", 0)
@@ -24,9 +24,14 @@ class StockLedgerEntry(Document):
 		self.validate_batch()
 		validate_warehouse_company(self.warehouse, self.company)
 		self.scrub_posting_time()
+		self.set_posting_datetime()
 		self.validate_and_set_fiscal_year()
 		self.block_transactions_against_group_warehouse()
 
+	def before_insert(self):
+		# also runs for entries inserted without validation
+		self.set_posting_datetime()
+
 	def on_submit(self):
 		self.check_stock_frozen_date()
 		self.actual_amt_check()
@@ -104,6 +109,10 @@ class StockLedgerEntry(Document):
 		if not self.posting_time or self.posting_time == '00:0':
 			self.posting_time = '00:00'
 
+	def set_posting_datetime(self):
+		from erpnext.stock.utils import get_posting_datetime
+		self.posting_datetime = get_posting_datetime(self.posting_date, self.posting_time)
+
 	def validate_batch(self):
 		if self.batch_no and self.voucher_type != "Stock Entry":
 			expiry_date = frappe.db.get_value("Batch", self.batch_no, "expiry_date")
@@ -131,3 +140,5 @@ def on_doctype_update():
 			add index posting_sort_index(posting_date, posting_time, name)""")
 
 	frappe.db.add_index("Stock Ledger Entry", ["voucher_no", "voucher_type"])
+	frappe.db.add_index("Stock Ledger Entry", ["item_code", "warehouse", "posting_datetime", "name"],
+		"item_warehouse_posting_datetime_index")
@@ -1,12 +1,307 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
-from __future__ import unicode_literals
+from __future__ import unicode_literals, print_function
 
 import frappe
+import json
+import time
 import unittest
+from frappe.utils import get_datetime, nowdate, add_days, flt
+from erpnext.stock.valuation import FIFOValuation
+from erpnext.stock.stock_ledger import (make_sl_entries, update_entries_after,
+	REPOST_CHUNK_SIZE, REPOST_FIELDS)
 
 # test_records = frappe.get_test_records('Stock Ledger Entry')
 
 class TestStockLedgerEntry(unittest.TestCase):
-	pass
+	def test_posting_datetime_of_entry_inserted_without_validation(self):
+		# as inserted by set_stock_balance_as_per_serial_no
+		sle = frappe.get_doc({
+			"doctype": "Stock Ledger Entry",
+			"item_code": "_Test Item",
+			"warehouse": "_Test Warehouse - _TC",
+			"posting_date": "2013-01-05",
+			"posting_time": "10:30:00",
+			"voucher_type": "Stock Reconciliation (Manual)",
+			"voucher_no": "",
+			"actual_qty": 1,
+			"company": "_Test Company",
+			"is_cancelled": "No"
+		})
+		sle.flags.ignore_validate = True
+		sle.flags.ignore_links = True
+		sle.insert()
+
+		try:
+			self.assertEqual(get_datetime(frappe.db.get_value("Stock Ledger Entry", sle.name, "posting_datetime")),
+				get_datetime("2013-01-05 10:30:00"))
+			self.assertFalse(frappe.db.sql("""select name from `tabStock Ledger Entry`
+				where posting_datetime is null limit 1"""))
+		finally:
+			frappe.db.sql("delete from `tabStock Ledger Entry` where name=%s", sle.name)
+
+	def test_chunked_repost(self):
+		item_code, warehouse = make_repost_test_item("_Test Item Chunked Repost"), "_Test Warehouse - _TC"
+
+		# more entries than are fetched and written back in one chunk
+		actual_qtys = [2 if i % 2 == 0 else -1 for i in range(REPOST_CHUNK_SIZE + 51)]
+		make_test_ledger(item_code, warehouse, actual_qtys)
+
+		clear_reposted_values(item_code, warehouse)
+		expected = repost_row_by_row(item_code, warehouse)
+
+		clear_reposted_values(item_code, warehouse)
+		reposted = update_entries_after({"item_code": item_code, "warehouse": warehouse})
+
+		self.assertEqual(reposted.rows_processed, len(actual_qtys))
+		self.assertEqual(get_ledger_state(item_code, warehouse), expected)
+
+		entries, bin = expected
+		self.assertEqual(flt(entries[-1][0]), sum(actual_qtys))
+		self.assertEqual(flt(bin[0]), sum(actual_qtys))
+
+	def test_partitioned_repost_resumed_from_checkpoint(self):
+		from erpnext.stock import stock_balance
+
+		item_code = make_repost_test_item("_Test Item Partitioned Repost")
+		warehouses = ["_Test Warehouse - _TC", "_Test Warehouse 1 - _TC"]
+
+		expected = {}
+		for warehouse in warehouses:
+			make_test_ledger(item_code, warehouse, [5, -2, 3, -4, 6, -1, 2])
+			clear_reposted_values(item_code, warehouse)
+			expected[warehouse] = repost_row_by_row(item_code, warehouse)
+
+		partitions = 2
+		partition = stock_balance.get_repost_partition(item_code, partitions)
+
+		# only the pairs of this item, and a checkpoint after every pair
+		get_item_warehouse_pairs = stock_balance.get_item_warehouse_pairs
+		stock_balance.get_item_warehouse_pairs = lambda after=None: [d
+			for d in get_item_warehouse_pairs(after) if d[0] == item_code]
+		checkpoint_interval = stock_balance.REPOST_CHECKPOINT_INTERVAL
+		stock_balance.REPOST_CHECKPOINT_INTERVAL = 1
+
+		try:
+			for warehouse in warehouses:
+				clear_reposted_values(item_code, warehouse)
+			cleared = get_ledger_state(item_code, warehouses[0])
+
+			# interrupted after reposting the first pair
+			stock_balance.set_repost_checkpoint(partition, partitions, item_code, warehouses[0])
+			stats = stock_balance.repost_partition(partition, partitions, only_actual=True)
+
+			self.assertEqual(stats.pairs, 1)
+			self.assertEqual(get_ledger_state(item_code, warehouses[0]), cleared)
+			self.assertEqual(get_ledger_state(item_code, warehouses[1]), expected[warehouses[1]])
+			self.assertEqual(stock_balance.get_repost_checkpoint(partition, partitions),
+				(item_code, warehouses[1]))
+
+			stock_balance.clear_repost_checkpoints(partitions)
+			stats = stock_balance.repost_partition(partition, partitions, only_actual=True)
+
+			self.assertEqual(stats.pairs, 2)
+			for warehouse in warehouses:
+				self.assertEqual(get_ledger_state(item_code, warehouse), expected[warehouse])
+		finally:
+			stock_balance.get_item_warehouse_pairs = get_item_warehouse_pairs
+			stock_balance.REPOST_CHECKPOINT_INTERVAL = checkpoint_interval
+			stock_balance.clear_repost_checkpoints(partitions)
+
+	def test_repost_with_shared_valuation_rate_cache(self):
+		from erpnext.stock import stock_ledger
+
+		item_code = make_repost_test_item("_Test Item Valuation Rate Cache")
+		warehouses = ["_Test Warehouse - _TC", "_Test Warehouse 1 - _TC"]
+		for warehouse in warehouses:
+			# issued before it is received, so the first entry is valued at the fallback rate
+			make_test_ledger(item_code, warehouse, [-5, 10, -3, 8, -4], allow_negative_stock=True)
+
+		lookups = []
+		get_valuation_rates = stock_ledger.get_valuation_rates
+		def counted_get_valuation_rates(item_warehouse_pairs, currency=None):
+			lookups.append(list(item_warehouse_pairs))
+			return get_valuation_rates(item_warehouse_pairs, currency)
+
+		stock_ledger.get_valuation_rates = counted_get_valuation_rates
+		try:
+			# rate left by an earlier posting, returned by the fallback
+			for warehouse in warehouses:
+				clear_reposted_values(item_code, warehouse, valuation_rate=120)
+
+			expected = {}
+			for warehouse in warehouses:
+				expected[warehouse] = repost_row_by_row(item_code, warehouse, allow_negative_stock=True)
+			self.assertEqual(len(lookups), 2)
+
+			for warehouse in warehouses:
+				clear_reposted_values(item_code, warehouse, valuation_rate=120)
+
+			del lookups[:]
+			valuation_rate_cache = stock_ledger.ValuationRateCache([(item_code, d) for d in warehouses])
+			for warehouse in warehouses:
+				update_entries_after({"item_code": item_code, "warehouse": warehouse},
+					allow_negative_stock=True, valuation_rate_cache=valuation_rate_cache)
+
+			# the rates of both warehouses are looked up together
+			self.assertEqual(len(lookups), 1)
+			for warehouse in warehouses:
+				self.assertEqual(get_ledger_state(item_code, warehouse), expected[warehouse])
+
+				entries, bin = expected[warehouse]
+				self.assertEqual(flt(entries[0][REPOST_FIELDS.index("stock_value_difference")]), -600)
+		finally:
+			stock_ledger.get_valuation_rates = get_valuation_rates
+
+class TestFIFOValuation(unittest.TestCase):
+	def assertTotals(self, queue):
+		self.assertAlmostEqual(queue.qty, sum(q for q, r in queue.get_state()))
+		self.assertAlmostEqual(queue.value, sum(q * r for q, r in queue.get_state()), places=4)
+
+	def test_add_and_remove_stock(self):
+		queue = FIFOValuation()
+		queue.add_stock(10, 100)
+		queue.add_stock(10, 100)
+		queue.add_stock(5, 200)
+		self.assertEqual(queue.get_state(), [[20, 100], [5, 200]])
+		self.assertTotals(queue)
+
+		queue.remove_stock(22)
+		self.assertEqual(queue.get_state(), [[3, 200]])
+		self.assertTotals(queue)
+
+		# outgoing rate not in queue collapses the queue
+		queue.remove_stock(1, outgoing_rate=50)
+		self.assertEqual(queue.get_state(), [[2, 275]])
+
+	def test_negative_stock(self):
+		queue = FIFOValuation([[1, 10]])
+		queue.remove_stock(3)
+		self.assertEqual(queue.get_state(), [[-2, 10]])
+
+		queue.add_stock(3, 20)
+		self.assertEqual(queue.get_state(), [[1, 20]])
+		self.assertTotals(queue)
+
+	def test_zero_batch_rate_on_empty_queue(self):
+		queue = FIFOValuation()
+		queue.remove_stock(2, rate_generator=lambda: 15)
+		self.assertEqual(queue.get_state(), [[-2, 15]])
+
+	def test_serialize(self):
+		queue = FIFOValuation("[[1, 20], [1, 30]]")
+		self.assertEqual(queue.serialize(), "[[1,20],[1,30]]")
+		self.assertEqual(json.loads(queue.serialize()), [[1, 20], [1, 30]])
+
+	def test_long_queue(self):
+		layers = 20000
+		queue = FIFOValuation()
+		for i in range(layers):
+			queue.add_stock(1, 100 + i)
+
+		# the oldest half is consumed, running totals follow the remaining batches
+		for i in range(layers // 2):
+			queue.remove_stock(1)
+
+		self.assertEqual(queue.get_state(), [[1, 100 + i] for i in range(layers // 2, layers)])
+		self.assertEqual(queue.qty, layers // 2)
+		self.assertEqual(queue.value, sum(100 + i for i in range(layers // 2, layers)))
+		self.assertEqual(queue.get_valuation_rate(), 100 + (layers // 2 + layers - 1) / 2.0)
+
+		for i in range(layers // 2):
+			queue.remove_stock(1)
+
+		self.assertEqual(queue.get_state(), [])
+		self.assertEqual(queue.qty, 0)
+		self.assertEqual(queue.value, 0)
+
+	def test_serialize_after_each_change(self):
+		queue = FIFOValuation()
+		for change in (lambda: queue.add_stock(10, 100), lambda: queue.add_stock(5, 100),
+			lambda: queue.add_stock(5, 200), lambda: queue.add_stock(5, 300),
+			lambda: queue.remove_stock(12), lambda: queue.remove_stock(2, outgoing_rate=300),
+			lambda: queue.remove_stock(1, outgoing_rate=50), lambda: queue.remove_stock(30),
+			lambda: queue.add_stock(40, 20), lambda: queue.remove_stock(50, rate_generator=lambda: 15)):
+				change()
+				self.assertEqual(queue.serialize(), json.dumps(queue.get_state(), separators=(',', ':')))
+
+	def test_serialize_cost_of_long_queue(self):
+		# per entry cost of serializing a long queue, compared with encoding the whole queue
+		for layers in (10000, 20000):
+			queue = FIFOValuation()
+			for i in range(layers):
+				queue.add_stock(1, 100 + i)
+
+			entries = 500
+			start = time.time()
+			for i in range(entries):
+				queue.add_stock(1, 100 + layers + i)
+				queue.remove_stock(1)
+				serialized = queue.serialize()
+			incremental = (time.time() - start) / entries
+
+			start = time.time()
+			for i in range(entries):
+				encoded = json.dumps(queue.get_state(), separators=(',', ':'))
+			full = (time.time() - start) / entries
+
+			self.assertEqual(serialized, encoded)
+			print("FIFO queue of {0} layers: {1:.6f}s per entry, {2:.6f}s to encode the whole queue"
+				.format(layers, incremental, full))
+
+def make_repost_test_item(item_code, properties=None):
+	from erpnext.stock.doctype.item.test_item import make_item
+
+	item_properties = {"is_stock_item": 1, "valuation_method": "FIFO"}
+	item_properties.update(properties or {})
+	return make_item(item_code, item_properties).name
+
+def make_test_ledger(item_code, warehouse, actual_qtys, allow_negative_stock=False):
+	"""post one Stock Ledger Entry per qty, a second apart, with varying incoming rates"""
+	frappe.db.sql("""delete from `tabStock Ledger Entry` where item_code=%s and warehouse=%s""",
+		(item_code, warehouse))
+
+	posting_date = add_days(nowdate(), -1)
+	stock_uom = frappe.db.get_value("Item", item_code, "stock_uom")
+	voucher_no = "_Test Repost {0}".format(item_code)
+
+	make_sl_entries([frappe._dict({
+		"item_code": item_code,
+		"warehouse": warehouse,
+		"posting_date": posting_date,
+		"posting_time": "{0:02d}:{1:02d}:{2:02d}".format(i // 3600, i // 60 % 60, i % 60),
+		"voucher_type": "Stock Entry",
+		"voucher_no": voucher_no,
+		"voucher_detail_no": "{0}-{1}".format(voucher_no, i),
+		"actual_qty": qty,
+		"incoming_rate": 100 + i % 7 if qty > 0 else 0,
+		"stock_uom": stock_uom,
+		"company": "_Test Company",
+		"is_cancelled": "No"
+	}) for i, qty in enumerate(actual_qtys)], allow_negative_stock=allow_negative_stock)
+
+def clear_reposted_values(item_code, warehouse, valuation_rate=0):
+	"""reset the values rebuilt by a repost, as if they had drifted"""
+	frappe.db.sql("""update `tabStock Ledger Entry`
+		set qty_after_transaction=0, valuation_rate=%s, stock_value=0,
+			stock_queue='[]', stock_value_difference=0
+		where item_code=%s and warehouse=%s""", (valuation_rate, item_code, warehouse))
+	frappe.db.sql("""update tabBin set actual_qty=0, valuation_rate=0, stock_value=0
+		where item_code=%s and warehouse=%s""", (item_code, warehouse))
+
+def repost_row_by_row(item_code, warehouse, **kwargs):
+	"""repost fetching and writing back one entry at a time, returns the reposted state"""
+	update_entries_after({"item_code": item_code, "warehouse": warehouse}, chunk_size=1, **kwargs)
+	return get_ledger_state(item_code, warehouse)
+
+def get_ledger_state(item_code, warehouse):
+	"""reposted values of all entries of the item in the warehouse, and its Bin"""
+	entries = frappe.db.sql("""select {0} from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s
+		order by posting_datetime, name""".format(", ".join(REPOST_FIELDS)), (item_code, warehouse))
+
+	bin = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
+		["actual_qty", "valuation_rate", "stock_value"])
+
+	return [list(d) for d in entries], list(bin or [])
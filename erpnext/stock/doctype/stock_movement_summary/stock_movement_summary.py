@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import cint, flt, getdate, now
+from frappe.model.document import Document
+
+MOVEMENT_FIELDS = ("in_qty", "in_value", "out_qty", "out_value", "closing_qty", "closing_value",
+	"valuation_rate")
+
+class StockMovementSummary(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index("Stock Movement Summary", ["item_code", "warehouse", "posting_date"])
+
+def stock_movement_summary_enabled():
+	return cint(frappe.db.get_single_value("Stock Settings", "use_stock_movement_summary"))
+
+def update_stock_movement_summary(item_code, warehouse, posting_date):
+	"""
+		Recompute the daily movements and closing balances of an item in a warehouse from
+		`posting_date` onwards, after its entries from that date were posted, reposted or cancelled.
+	"""
+	if not stock_movement_summary_enabled():
+		return
+
+	posting_date = getdate(posting_date)
+
+	previous = frappe.db.sql("""select closing_qty, closing_value
+		from `tabStock Movement Summary`
+		where item_code=%s and warehouse=%s and posting_date < %s
+		order by posting_date desc limit 1""", (item_code, warehouse, posting_date))
+	closing_qty, closing_value = (flt(previous[0][0]), flt(previous[0][1])) if previous else (0.0, 0.0)
+
+	frappe.db.sql("""delete from `tabStock Movement Summary`
+		where item_code=%s and warehouse=%s and posting_date >= %s""", (item_code, warehouse, posting_date))
+
+	rows = []
+	for sle in frappe.db.sql("""select company, posting_date, actual_qty, voucher_type,
+			qty_after_transaction, stock_value_difference, valuation_rate
+		from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s and posting_date >= %s and docstatus < 2
+		order by posting_datetime, name""", (item_code, warehouse, posting_date), as_dict=True):
+			if not rows or rows[-1].posting_date != sle.posting_date:
+				rows.append(frappe._dict(company=sle.company, posting_date=sle.posting_date,
+					in_qty=0.0, in_value=0.0, out_qty=0.0, out_value=0.0))
+			day = rows[-1]
+
+			if sle.voucher_type == "Stock Reconciliation":
+				qty_diff = flt(sle.qty_after_transaction) - closing_qty
+			else:
+				qty_diff = flt(sle.actual_qty)
+
+			value_diff = flt(sle.stock_value_difference)
+
+			if qty_diff > 0:
+				day.in_qty += qty_diff
+				day.in_value += value_diff
+			else:
+				day.out_qty += abs(qty_diff)
+				day.out_value += abs(value_diff)
+
+			closing_qty += qty_diff
+			closing_value += value_diff
+			day.update({
+				"closing_qty": closing_qty,
+				"closing_value": closing_value,
+				"valuation_rate": flt(sle.valuation_rate)
+			})
+
+	insert_summary_rows(item_code, warehouse, rows)
+
+def insert_summary_rows(item_code, warehouse, rows, chunk_size=500):
+	timestamp, user = now(), frappe.session.user
+	columns = ("name", "creation", "modified", "owner", "modified_by", "docstatus",
+		"item_code", "warehouse", "company", "posting_date") + MOVEMENT_FIELDS
+
+	for i in range(0, len(rows), chunk_size):
+		chunk = rows[i:i + chunk_size]
+		values = []
+		for row in chunk:
+			values.extend([frappe.generate_hash("Stock Movement Summary", 10), timestamp, timestamp,
+				user, user, 0, item_code, warehouse, row.company, row.posting_date]
+				+ [row.get(fieldname) for fieldname in MOVEMENT_FIELDS])
+
+		frappe.db.sql("""insert into `tabStock Movement Summary` ({0}) values {1}""".format(
+			", ".join(columns), ", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(chunk))),
+			tuple(values))
+
+def rebuild_stock_movement_summary(item_code=None):
+	"""rebuild the summary of all items, or of the given item, from the Stock Ledger"""
+	condition = " where item_code=%(item_code)s" if item_code else ""
+
+	frappe.db.sql("delete from `tabStock Movement Summary` {0}".format(condition), {"item_code": item_code})
+
+	for i, (item, warehouse) in enumerate(frappe.db.sql("""select distinct item_code, warehouse
+		from `tabStock Ledger Entry` {0}""".format(condition), {"item_code": item_code})):
+			update_stock_movement_summary(item, warehouse, "1900-01-01")
+
+			if i % 100 == 99:
+				frappe.db.commit()
+
+	frappe.db.commit()
+
+def get_stock_balances(date, conditions="", values=None):
+	"""
+		closing qty, value and valuation rate per (company, item_code, warehouse) on `date`,
+		`conditions` are on the item_code and warehouse columns
+	"""
+	values = dict(values or {}, date=date)
+
+	return frappe.db.sql("""select s.company, s.item_code, s.warehouse, s.closing_qty, s.closing_value,
+			s.valuation_rate
+		from `tabStock Movement Summary` s,
+			(select item_code, warehouse, max(posting_date) as posting_date
+				from `tabStock Movement Summary`
+				where posting_date <= %(date)s {0}
+				group by item_code, warehouse) last_movement
+		where s.item_code = last_movement.item_code and s.warehouse = last_movement.warehouse
+			and s.posting_date = last_movement.posting_date""".format(conditions), values, as_dict=True)
+
+def get_stock_movements(from_date, to_date, conditions="", values=None):
+	"""in and out qty and value per (company, item_code, warehouse) between the dates"""
+	values = dict(values or {}, from_date=from_date, to_date=to_date)
+
+	return frappe.db.sql("""select company, item_code, warehouse, sum(in_qty) as in_qty,
+			sum(in_value) as in_value, sum(out_qty) as out_qty, sum(out_value) as out_value
+		from `tabStock Movement Summary`
+		where posting_date between %(from_date)s and %(to_date)s {0}
+		group by company, item_code, warehouse""".format(conditions), values, as_dict=True)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_movement_summary.stock_movement_summary import rebuild_stock_movement_summary
+from erpnext.stock.report.stock_balance.stock_balance import execute
+
+class TestStockMovementSummary(unittest.TestCase):
+	def setUp(self):
+		frappe.db.set_value("Stock Settings", None, "use_stock_movement_summary", 1)
+		rebuild_stock_movement_summary("_Test Item")
+
+	def tearDown(self):
+		frappe.db.set_value("Stock Settings", None, "use_stock_movement_summary", 0)
+
+	def get_balances(self, from_date, to_date):
+		filters = {"from_date": from_date, "to_date": to_date, "item_code": "_Test Item"}
+
+		frappe.db.set_value("Stock Settings", None, "use_stock_movement_summary", 0)
+		from_ledger = execute(filters)[1]
+		frappe.db.set_value("Stock Settings", None, "use_stock_movement_summary", 1)
+		return from_ledger, execute(filters)[1]
+
+	def test_stock_balance_after_posting_and_cancelling(self):
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10,
+			basic_rate=100, posting_date="2013-01-10")
+		se = make_stock_entry(item_code="_Test Item", source="_Test Warehouse - _TC", qty=4,
+			posting_date="2013-01-20")
+
+		for from_date, to_date in (("2013-01-01", "2013-01-15"), ("2013-01-15", "2013-01-31"),
+			("2013-02-01", "2013-02-28")):
+				from_ledger, from_summary = self.get_balances(from_date, to_date)
+				self.assertEqual(from_ledger, from_summary)
+
+		se.cancel()
+		from_ledger, from_summary = self.get_balances("2013-01-15", "2013-01-31")
+		self.assertEqual(from_ledger, from_summary)
@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.utils import cint
 from frappe.utils.html_utils import clean_html
 
 class StockSettings(Document):
@@ -31,6 +32,18 @@ class StockSettings(Document):
 
 		self.cant_change_valuation_method()
 		self.validate_clean_description_html()
+		self.check_stock_movement_summary_enabled()
+
+	def on_update(self):
+		if self.flags.rebuild_stock_movement_summary:
+			frappe.enqueue("erpnext.stock.doctype.stock_movement_summary.stock_movement_summary.rebuild_stock_movement_summary",
+				queue="long", timeout=3000)
+			frappe.msgprint(_("Stock Movement Summary will be rebuilt in the background"))
+
+	def check_stock_movement_summary_enabled(self):
+		# the summary is not maintained while disabled, rebuild it when enabled
+		self.flags.rebuild_stock_movement_summary = cint(self.use_stock_movement_summary) \
+			and not cint(frappe.db.get_single_value("Stock Settings", "use_stock_movement_summary"))
 
 	def cant_change_valuation_method(self):
 		db_valuation_method = frappe.db.get_single_value("Stock Settings", "valuation_method")
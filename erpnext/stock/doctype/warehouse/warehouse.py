@@ -28,9 +28,19 @@ class Warehouse(NestedSet):
 			self.set_onload('account', account)
 		load_address_and_contact(self)
 
+	def validate(self):
+		# loaded before the save, to know in on_update if the warehouse moved
+		self.get_doc_before_save()
 
 	def on_update(self):
 		self.update_nsm_model()
+		self.rebuild_warehouse_group_totals_if_moved()
+
+	def rebuild_warehouse_group_totals_if_moved(self):
+		doc_before_save = self.get_doc_before_save()
+		if doc_before_save and doc_before_save.parent_warehouse != self.parent_warehouse:
+			frappe.enqueue("erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty.rebuild_warehouse_group_projected_qty",
+				now=frappe.flags.in_test)
 
 	def update_nsm_model(self):
 		frappe.utils.nestedset.update_nsm(self)
@@ -52,6 +62,8 @@ class Warehouse(NestedSet):
 		if self.check_if_child_exists():
 			throw(_("Child warehouse exists for this warehouse. You can not delete this warehouse."))
 
+		frappe.db.sql("delete from `tabWarehouse Group Projected Qty` where warehouse = %s", self.name)
+
 		self.update_nsm_model()
 
 	def check_if_sle_exists(self):
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import flt, add_days, nowdate
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+	get_warehouse_group_projected_qty, rebuild_warehouse_group_projected_qty
+
+class TestWarehouseGroupProjectedQty(unittest.TestCase):
+	def get_group_totals(self, item_code):
+		return get_warehouse_group_projected_qty([item_code]).get(item_code, {})
+
+	def get_group_totals_from_bin(self, item_code):
+		return dict((d[0], flt(d[1])) for d in frappe.db.sql("""select parent.name, sum(bin.projected_qty)
+			from `tabBin` bin, `tabWarehouse` wh, `tabWarehouse` parent
+			where bin.item_code = %s and wh.name = bin.warehouse
+				and parent.lft < wh.lft and parent.rgt > wh.rgt
+			group by parent.name""", item_code))
+
+	def test_group_totals_follow_bin(self):
+		rebuild_warehouse_group_projected_qty()
+
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=7, basic_rate=100)
+		make_stock_entry(item_code="_Test Item", source="_Test Warehouse - _TC",
+			target="_Test Warehouse 1 - _TC", qty=2)
+
+		self.assertEqual(self.get_group_totals("_Test Item"), self.get_group_totals_from_bin("_Test Item"))
+
+	def test_group_totals_after_back_dated_entry(self):
+		rebuild_warehouse_group_projected_qty()
+
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=5, basic_rate=100)
+		# reposts the later entries, Bins are then saved through the stock ledger
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=3, basic_rate=100,
+			posting_date=add_days(nowdate(), -10))
+
+		self.assertEqual(self.get_group_totals("_Test Item"), self.get_group_totals_from_bin("_Test Item"))
+
+	def test_group_totals_after_warehouse_is_moved(self):
+		if not frappe.db.exists("Warehouse", "_Test Warehouse Group 2 - _TC"):
+			frappe.get_doc({
+				"doctype": "Warehouse",
+				"warehouse_name": "_Test Warehouse Group 2",
+				"company": "_Test Company",
+				"is_group": 1
+			}).insert()
+
+		rebuild_warehouse_group_projected_qty()
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse Group-C1 - _TC", qty=5, basic_rate=100)
+
+		warehouse = frappe.get_doc("Warehouse", "_Test Warehouse Group-C1 - _TC")
+		warehouse.parent_warehouse = "_Test Warehouse Group 2 - _TC"
+		warehouse.save()
+
+		try:
+			group_totals = self.get_group_totals("_Test Item")
+			self.assertEqual(group_totals, self.get_group_totals_from_bin("_Test Item"))
+			self.assertIn("_Test Warehouse Group 2 - _TC", group_totals)
+		finally:
+			warehouse.reload()
+			warehouse.parent_warehouse = "_Test Warehouse Group - _TC"
+			warehouse.save()
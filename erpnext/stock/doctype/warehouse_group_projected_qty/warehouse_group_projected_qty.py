@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import flt, now
+from frappe.model.document import Document
+
+class WarehouseGroupProjectedQty(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_unique("Warehouse Group Projected Qty", ["item_code", "warehouse"],
+		constraint_name="unique_item_warehouse")
+
+def update_warehouse_group_projected_qty(item_code, warehouse, qty_change):
+	"""add a change in the projected qty of a Bin to the totals of every group above its warehouse"""
+	if not flt(qty_change):
+		return
+
+	warehouse_groups = frappe.db.sql_list("""select parent.name
+		from `tabWarehouse` parent, `tabWarehouse` wh
+		where wh.name=%s and parent.lft < wh.lft and parent.rgt > wh.rgt""", warehouse)
+
+	if not warehouse_groups:
+		return
+
+	insert_rows([(item_code, d, flt(qty_change)) for d in warehouse_groups], add_to_existing=True)
+
+def merge_warehouse_group_projected_qty(old_item_code, new_item_code):
+	"""add the totals of an item to the item it is merged into, before the item is renamed"""
+	insert_rows(frappe.db.sql("""select %s, warehouse, projected_qty
+		from `tabWarehouse Group Projected Qty` where item_code=%s""", (new_item_code, old_item_code)),
+		add_to_existing=True)
+
+	frappe.db.sql("delete from `tabWarehouse Group Projected Qty` where item_code=%s", old_item_code)
+
+def insert_rows(rows, add_to_existing=False, chunk_size=500):
+	"""rows of (item_code, warehouse group, projected_qty). With `add_to_existing`, the qty
+		of a row that already exists is added to it, in the same statement."""
+	timestamp, user = now(), frappe.session.user
+	columns = ("name", "creation", "modified", "owner", "modified_by", "docstatus",
+		"item_code", "warehouse", "projected_qty")
+
+	for i in range(0, len(rows), chunk_size):
+		chunk = rows[i:i + chunk_size]
+		values = []
+		for row in chunk:
+			values.extend([frappe.generate_hash("Warehouse Group Projected Qty", 10), timestamp, timestamp,
+				user, user, 0] + list(row))
+
+		frappe.db.sql("""insert into `tabWarehouse Group Projected Qty` ({0}) values {1} {2}""".format(
+			", ".join(columns), ", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(chunk)),
+			"on duplicate key update projected_qty = projected_qty + values(projected_qty)"
+				if add_to_existing else ""), tuple(values))
+
+def rebuild_warehouse_group_projected_qty():
+	"""rebuild the totals of all warehouse groups from Bin, e.g. after the warehouse tree changed"""
+	frappe.db.sql("delete from `tabWarehouse Group Projected Qty`")
+
+	insert_rows(frappe.db.sql("""select bin.item_code, parent.name, sum(bin.projected_qty)
+		from `tabBin` bin, `tabWarehouse` wh, `tabWarehouse` parent
+		where wh.name = bin.warehouse and parent.lft < wh.lft and parent.rgt > wh.rgt
+		group by bin.item_code, parent.name"""))
+
+def get_warehouse_group_projected_qty(item_codes=None):
+	"""{item_code: {warehouse group: projected qty}}, of the given items if any"""
+	condition, values = "", ()
+	if item_codes:
+		condition = "where item_code in ({0})".format(", ".join(["%s"] * len(item_codes)))
+		values = tuple(item_codes)
+
+	projected_qty = {}
+	for item_code, warehouse, qty in frappe.db.sql("""select item_code, warehouse, projected_qty
+		from `tabWarehouse Group Projected Qty` {0}""".format(condition), values):
+			projected_qty.setdefault(item_code, {})[warehouse] = flt(qty)
+
+	return projected_qty
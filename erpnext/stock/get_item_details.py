@@ -6,7 +6,8 @@ import frappe
 from frappe import _, throw
 from frappe.utils import flt, cint, add_days, cstr
 import json
-from erpnext.accounts.doctype.pricing_rule.pricing_rule import get_pricing_rule_for_item, set_transaction_type
+from erpnext.accounts.doctype.pricing_rule.pricing_rule import (get_pricing_rule_for_item, set_transaction_type,
+	set_items_for_pricing_rule)
 from erpnext.setup.utils import get_exchange_rate
 from frappe.model.meta import get_field_precision
 from erpnext.stock.doctype.batch.batch import get_batch_no
@@ -35,23 +36,59 @@ def get_item_details(args):
 			"project": ""
 		}
 	"""
-	args = process_args(args)
-	item_doc = frappe.get_doc("Item", args.item_code)
+	return _get_item_details(process_args(args))
+
+@frappe.whitelist()
+def get_item_details_for_items(args, items):
+	"""
+		Item details of several rows of one transaction, same as `get_item_details` for each row,
+		in the order of `items`. Items, prices, bins, UOM conversions and pricing rules of all
+		the rows are fetched together.
+
+		:param args: transaction details shared by the rows (party, price list, currency,
+			company etc.), see `get_item_details`
+		:param items: list of row details, e.g. [{"item_code": "", "qty": 1, "uom": "", "warehouse": ""}, ...]
+	"""
+	if isinstance(args, basestring):
+		args = json.loads(args)
+	if isinstance(items, basestring):
+		items = json.loads(items)
+
+	rows = []
+	for item in items:
+		row_args = dict(args)
+		row_args.update(item)
+		rows.append(row_args)
+
+	return get_item_details_in_bulk(rows)
+
+def get_item_details_in_bulk(rows):
+	"""`get_item_details` for each of `rows`, looking up the records of all of them together"""
+	rows = [process_args(row_args) for row_args in rows]
+	cache = ItemDetailsCache(rows)
+
+	return [_get_item_details(row_args, cache) for row_args in rows]
+
+def _get_item_details(args, cache=None):
+	if cache is None:
+		cache = ItemDetailsCache()
+
+	item_doc = cache.get_item_doc(args.item_code)
 	item = item_doc
 
 	validate_item_details(args, item)
 
-	out = get_basic_details(args, item)
+	out = get_basic_details(args, item, cache)
 
-	get_party_item_code(args, item_doc, out)
+	get_party_item_code(args, item_doc, out, cache)
 
-	if frappe.db.exists("Product Bundle", args.item_code):
+	if cache.is_product_bundle(args.item_code):
 		valuation_rate = 0.0
 		bundled_items = frappe.get_doc("Product Bundle", args.item_code)
 
 		for bundle_item in bundled_items.items:
 			valuation_rate += \
-				flt(get_valuation_rate(bundle_item.item_code, out.get("warehouse")).get("valuation_rate") \
+				flt(get_valuation_rate(bundle_item.item_code, out.get("warehouse"), cache).get("valuation_rate") \
 					* bundle_item.qty)
 
 		out.update({
@@ -59,22 +96,22 @@ def get_item_details(args):
 		})
 
 	else:
-		out.update(get_valuation_rate(args.item_code, out.get("warehouse")))
+		out.update(get_valuation_rate(args.item_code, out.get("warehouse"), cache))
 
-	get_price_list_rate(args, item_doc, out)
+	get_price_list_rate(args, item_doc, out, cache)
 
 	if args.customer and cint(args.is_pos):
 		out.update(get_pos_profile_item_details(args.company, args))
 
 	if out.get("warehouse"):
-		out.update(get_bin_details(args.item_code, out.warehouse))
+		out.update(cache.get_bin_details(args.item_code, out.warehouse))
 
 	# update args with out, if key or value not exists
 	for key, value in out.iteritems():
 		if args.get(key) is None:
 			args[key] = value
 
-	out.update(get_pricing_rule_for_item(args))
+	out.update(get_pricing_rule_for_item(args, cache.pricing_rule_lookup_cache))
 
 	if (args.get("doctype") == "Delivery Note" or
 		(args.get("doctype") == "Sales Invoice" and args.get('update_stock'))) \
@@ -100,6 +137,156 @@ def get_item_details(args):
 
 	return out
 
+class ItemDetailsCache(object):
+	"""
+		Records used to get item details. With `rows` (args of the rows of one transaction),
+		the Items, Item Prices, Bins and UOM conversions of all the rows are fetched with one
+		query per table. Anything else is fetched when first needed and kept.
+	"""
+	def __init__(self, rows=None):
+		self.item_docs = {}
+		self.product_bundles = {}
+		self.item_prices = {}
+		self.conversion_factors = {}
+		self.items_with_conversion_factors = set()
+		self.bins = {}
+		self.values = {}
+		self.validated_price_lists = set()
+		self.pricing_rule_lookup_cache = {}
+
+		if rows:
+			self.prefetch(rows)
+
+	def prefetch(self, rows):
+		item_codes = list(set(d.item_code for d in rows if d.item_code))
+		if not item_codes:
+			return
+
+		self.item_docs.update(get_item_docs(item_codes))
+		templates = list(set(d.variant_of for d in self.item_docs.values()
+			if d.variant_of and d.variant_of not in self.item_docs))
+		self.item_docs.update(get_item_docs(templates))
+		all_items = item_codes + templates
+		item_condition = ", ".join(["%s"] * len(all_items))
+
+		bundles = frappe.db.sql_list("""select name from `tabProduct Bundle`
+			where name in ({0})""".format(item_condition), tuple(all_items))
+		for item_code in all_items:
+			self.product_bundles[item_code] = item_code in bundles
+
+		for price_list in set(d.price_list for d in rows if d.price_list):
+			for item_code in all_items:
+				self.item_prices[(price_list, item_code)] = None
+
+			for item_code, price_list_rate in frappe.db.sql("""select item_code, price_list_rate
+				from `tabItem Price` where price_list=%s and item_code in ({0})""".format(item_condition),
+				tuple([price_list] + all_items)):
+					if self.item_prices.get((price_list, item_code)) is None:
+						self.item_prices[(price_list, item_code)] = price_list_rate
+
+		for parent, uom, conversion_factor in frappe.db.sql("""select parent, uom, conversion_factor
+			from `tabUOM Conversion Detail` where parenttype='Item' and parent in ({0})""".format(item_condition),
+			tuple(all_items)):
+				self.conversion_factors.setdefault((parent, uom), conversion_factor)
+		self.items_with_conversion_factors.update(all_items)
+
+		# bins in any warehouse a row may end up using
+		from frappe.defaults import get_user_default_as_list
+		warehouses = set(get_user_default_as_list('Warehouse'))
+		warehouses.update(d.warehouse for d in rows if d.warehouse)
+		warehouses.update(d.default_warehouse for d in self.item_docs.values() if d.default_warehouse)
+		if warehouses:
+			for item_code in all_items:
+				for warehouse in warehouses:
+					self.bins[(item_code, warehouse)] = None
+
+			for d in frappe.db.sql("""select item_code, warehouse, projected_qty, actual_qty,
+				reserved_qty, valuation_rate from tabBin
+				where item_code in ({0}) and warehouse in ({1})""".format(item_condition,
+				", ".join(["%s"] * len(warehouses))), tuple(all_items + list(warehouses)), as_dict=1):
+					self.bins[(d.item_code, d.warehouse)] = d
+
+		set_items_for_pricing_rule(item_codes, self.pricing_rule_lookup_cache)
+
+	def get_item_doc(self, item_code):
+		if item_code not in self.item_docs:
+			self.item_docs[item_code] = frappe.get_doc("Item", item_code)
+
+		item = self.item_docs[item_code]
+		if item.variant_of:
+			# template tables are added to the variant, keep the cached one as it is
+			item = frappe.get_doc(item.as_dict())
+
+		return item
+
+	def get_value(self, doctype, name, fieldname):
+		if (doctype, name, fieldname) not in self.values:
+			self.values[(doctype, name, fieldname)] = frappe.db.get_value(doctype, name, fieldname)
+
+		return self.values[(doctype, name, fieldname)]
+
+	def is_product_bundle(self, item_code):
+		if item_code not in self.product_bundles:
+			self.product_bundles[item_code] = bool(frappe.db.exists("Product Bundle", item_code))
+
+		return self.product_bundles[item_code]
+
+	def get_price_list_rate(self, price_list, item_code):
+		if (price_list, item_code) not in self.item_prices:
+			self.item_prices[(price_list, item_code)] = get_price_list_rate_for(price_list, item_code)
+
+		return self.item_prices[(price_list, item_code)]
+
+	def set_price_list_rate(self, price_list, item_code, price_list_rate):
+		self.item_prices[(price_list, item_code)] = price_list_rate
+
+	def get_conversion_factor(self, item_code, uom):
+		variant_of = (self.item_docs.get(item_code) or self.get_item_doc(item_code)).variant_of
+		if item_code not in self.items_with_conversion_factors \
+			and (item_code, uom) not in self.conversion_factors:
+				self.conversion_factors[(item_code, uom)] = \
+					get_conversion_factor(item_code, uom).get("conversion_factor")
+
+		return self.conversion_factors.get((item_code, uom)) or self.conversion_factors.get((variant_of, uom))
+
+	def get_bin(self, item_code, warehouse):
+		if (item_code, warehouse) not in self.bins:
+			self.bins[(item_code, warehouse)] = frappe.db.get_value("Bin",
+				{"item_code": item_code, "warehouse": warehouse},
+				["projected_qty", "actual_qty", "reserved_qty", "valuation_rate"], as_dict=True)
+
+		return self.bins[(item_code, warehouse)]
+
+	def get_bin_details(self, item_code, warehouse):
+		bin = self.get_bin(item_code, warehouse)
+		if not bin:
+			return {"projected_qty": 0, "actual_qty": 0, "reserved_qty": 0}
+
+		return frappe._dict(projected_qty=bin.projected_qty, actual_qty=bin.actual_qty,
+			reserved_qty=bin.reserved_qty)
+
+def get_item_docs(item_codes):
+	"""Item documents with their child tables, loaded with one query per table"""
+	if not item_codes:
+		return {}
+
+	condition = ", ".join(["%s"] * len(item_codes))
+	items = dict((d.name, d) for d in frappe.db.sql("""select * from tabItem
+		where name in ({0})""".format(condition), tuple(item_codes), as_dict=1))
+
+	if items:
+		for df in frappe.get_meta("Item").get_table_fields():
+			for d in items.values():
+				d[df.fieldname] = []
+
+			for child in frappe.db.sql("""select * from `tab{0}`
+				where parenttype='Item' and parentfield=%s and parent in ({1})
+				order by idx""".format(df.options, condition), tuple([df.fieldname] + item_codes), as_dict=1):
+					if child.parent in items:
+						items[child.parent][df.fieldname].append(child)
+
+	return dict((name, frappe.get_doc(dict(d, doctype="Item"))) for name, d in items.items())
+
 def process_args(args):
 	if isinstance(args, basestring):
 		args = json.loads(args)
@@ -147,7 +334,7 @@ def validate_item_details(args, item):
 			throw(_("Item {0} must be a Sub-contracted Item").format(item.name))
 
 
-def get_basic_details(args, item):
+def get_basic_details(args, item, cache=None):
 	"""
 	:param args: {
 			"item_code": "",
@@ -183,14 +370,17 @@ def get_basic_details(args, item):
 			conversion_factor: ""
 		}
 	:param item: `item_code` of Item object
+	:param cache: `ItemDetailsCache` shared by the rows of a transaction
 	:return: frappe._dict
 	"""
+	if cache is None:
+		cache = ItemDetailsCache()
 
 	if not item:
-		item = frappe.get_doc("Item", args.get("item_code"))
+		item = cache.get_item_doc(args.get("item_code"))
 
 	if item.variant_of:
-		item.update_template_tables()
+		item.update_template_tables(cache.get_item_doc(item.variant_of))
 
 	from frappe.defaults import get_user_default_as_list
 	user_default_warehouse_list = get_user_default_as_list('Warehouse')
@@ -201,7 +391,7 @@ def get_basic_details(args, item):
 
 	material_request_type = ''
 	if args.get('doctype') == "Material Request":
-		material_request_type = frappe.db.get_value('Material Request',
+		material_request_type = cache.get_value('Material Request',
 			args.get('name'), 'material_request_type')
 
 	#Set the UOM to the Default Sales UOM or Default Purchase UOM if configured in the Item Master
@@ -220,9 +410,9 @@ def get_basic_details(args, item):
 		"description": cstr(item.description).strip(),
 		"image": cstr(item.image).strip(),
 		"warehouse": warehouse,
-		"income_account": get_default_income_account(args, item),
-		"expense_account": get_default_expense_account(args, item),
-		"cost_center": get_default_cost_center(args, item),
+		"income_account": get_default_income_account(args, item, cache),
+		"expense_account": get_default_expense_account(args, item, cache),
+		"cost_center": get_default_cost_center(args, item, cache),
 		'has_serial_no': item.has_serial_no,
 		'has_batch_no': item.has_batch_no,
 		"batch_no": None,
@@ -255,7 +445,7 @@ def get_basic_details(args, item):
 		out.conversion_factor = 1.0
 	else:
 		out.conversion_factor = args.conversion_factor or \
-			get_conversion_factor(item.item_code, args.uom).get("conversion_factor") or 1.0
+			cache.get_conversion_factor(item.item_code, args.uom) or 1.0
 
 	args.conversion_factor = out.conversion_factor
 	out.stock_qty = out.qty * out.conversion_factor
@@ -270,9 +460,9 @@ def get_basic_details(args, item):
 		["Account", "expense_account", "default_expense_account"],
 		["Cost Center", "cost_center", "cost_center"],
 		["Warehouse", "warehouse", ""]]:
-			company = frappe.db.get_value(d[0], out.get(d[1]), "company")
+			company = cache.get_value(d[0], out.get(d[1]), "company")
 			if not out[d[1]] or (company and args.company != company):
-				out[d[1]] = frappe.db.get_value("Company", args.company, d[2]) if d[2] else None
+				out[d[1]] = cache.get_value("Company", args.company, d[2]) if d[2] else None
 
 	for fieldname in ("item_name", "item_group", "barcode", "brand", "stock_uom"):
 		out[fieldname] = item.get(fieldname)
@@ -280,40 +470,47 @@ def get_basic_details(args, item):
 	return out
 
 
-def get_default_income_account(args, item):
+def get_default_income_account(args, item, cache=None):
 	return (item.income_account
 		or args.income_account
-		or frappe.db.get_value("Item Group", item.item_group, "default_income_account"))
+		or (cache or ItemDetailsCache()).get_value("Item Group", item.item_group, "default_income_account"))
 
-def get_default_expense_account(args, item):
+def get_default_expense_account(args, item, cache=None):
 	return (item.expense_account
 		or args.expense_account
-		or frappe.db.get_value("Item Group", item.item_group, "default_expense_account"))
+		or (cache or ItemDetailsCache()).get_value("Item Group", item.item_group, "default_expense_account"))
 
-def get_default_cost_center(args, item):
-	return (frappe.db.get_value("Project", args.get("project"), "cost_center")
+def get_default_cost_center(args, item, cache=None):
+	cache = cache or ItemDetailsCache()
+	return (cache.get_value("Project", args.get("project"), "cost_center")
 		or (item.selling_cost_center if args.get("customer") else item.buying_cost_center)
-		or frappe.db.get_value("Item Group", item.item_group, "default_cost_center")
+		or cache.get_value("Item Group", item.item_group, "default_cost_center")
 		or args.get("cost_center"))
 
-def get_price_list_rate(args, item_doc, out):
+def get_price_list_rate(args, item_doc, out, cache=None):
+	if cache is None:
+		cache = ItemDetailsCache()
+
 	meta = frappe.get_meta(args.parenttype or args.doctype)
 
 	if meta.get_field("currency"):
-		validate_price_list(args)
+		validate_price_list(args, cache)
 		if args.price_list:
 			validate_conversion_rate(args, meta)
 
-		price_list_rate = get_price_list_rate_for(args.price_list, item_doc.name)
+		price_list_rate = cache.get_price_list_rate(args.price_list, item_doc.name)
 
 		# variant
 		if not price_list_rate and item_doc.variant_of:
-			price_list_rate = get_price_list_rate_for(args.price_list, item_doc.variant_of)
+			price_list_rate = cache.get_price_list_rate(args.price_list, item_doc.variant_of)
 
 		# insert in database
 		if not price_list_rate:
 			if args.price_list and args.rate:
-				insert_item_price(args)
+				price_list_rate = insert_item_price(args)
+				if price_list_rate:
+					# later rows of the item get the new price, as they would from the database
+					cache.set_price_list_rate(args.price_list, args.item_code, price_list_rate)
 			return {}
 
 		out.price_list_rate = flt(price_list_rate) * flt(args.plc_conversion_rate) \
@@ -327,7 +524,8 @@ def get_price_list_rate(args, item_doc, out):
 				args.name, args.conversion_rate))
 
 def insert_item_price(args):
-	"""Insert Item Price if Price List and Price List Rate are specified and currency is the same"""
+	"""Insert Item Price if Price List and Price List Rate are specified and currency is the same,
+		returns the price list rate inserted or updated"""
 	if frappe.db.get_value("Price List", args.price_list, "currency") == args.currency \
 		and cint(frappe.db.get_single_value("Stock Settings", "auto_insert_price_list_rate_if_missing")):
 		if frappe.has_permission("Item Price", "write"):
@@ -355,15 +553,23 @@ def insert_item_price(args):
 				frappe.msgprint(_("Item Price added for {0} in Price List {1}").format(args.item_code,
 					args.price_list))
 
+			return price_list_rate
+
 def get_price_list_rate_for(price_list, item_code):
 	return frappe.db.get_value("Item Price",
 			{"price_list": price_list, "item_code": item_code}, "price_list_rate")
 
-def validate_price_list(args):
+def validate_price_list(args, cache=None):
 	if args.get("price_list"):
+		if cache and (args.price_list, args.transaction_type) in cache.validated_price_lists:
+			return
+
 		if not frappe.db.get_value("Price List",
 			{"name": args.price_list, args.transaction_type: 1, "enabled": 1}):
 			throw(_("Price List {0} is disabled or does not exist").format(args.price_list))
+
+		if cache:
+			cache.validated_price_lists.add((args.price_list, args.transaction_type))
 	elif not args.get("supplier"):
 		throw(_("Price List not selected"))
 
@@ -393,7 +599,7 @@ def validate_conversion_rate(args, meta):
 			get_field_precision(meta.get_field("plc_conversion_rate"),
 			frappe._dict({"fields": args})))
 
-def get_party_item_code(args, item_doc, out):
+def get_party_item_code(args, item_doc, out, cache=None):
 	if args.transaction_type=="selling" and args.customer:
 		out.customer_item_code = None
 		customer_item_code = item_doc.get("customer_items", {"customer_name": args.customer})
@@ -401,7 +607,7 @@ def get_party_item_code(args, item_doc, out):
 		if customer_item_code:
 			out.customer_item_code = customer_item_code[0].ref_code
 		else:
-			customer_group = frappe.db.get_value("Customer", args.customer, "customer_group")
+			customer_group = (cache or ItemDetailsCache()).get_value("Customer", args.customer, "customer_group")
 			customer_group_item_code = item_doc.get("customer_items", {"customer_group": customer_group})
 			if customer_group_item_code and not customer_group_item_code[0].customer_name:
 				out.customer_item_code = customer_group_item_code[0].ref_code
@@ -620,14 +826,17 @@ def get_default_bom(item_code=None):
 		if bom:
 			return bom
 
-def get_valuation_rate(item_code, warehouse=None):
-	item = frappe.get_doc("Item", item_code)
+def get_valuation_rate(item_code, warehouse=None, cache=None):
+	if cache is None:
+		cache = ItemDetailsCache()
+
+	item = cache.get_item_doc(item_code)
 	if item.is_stock_item:
 		if not warehouse:
 			warehouse = item.default_warehouse
 
-		return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
-			["valuation_rate"], as_dict=True) or {"valuation_rate": 0}
+		bin = cache.get_bin(item_code, warehouse)
+		return {"valuation_rate": bin.valuation_rate} if bin else {"valuation_rate": 0}
 
 	elif not item.is_stock_item:
 		valuation_rate =frappe.db.sql("""select sum(base_net_amount) / sum(qty*conversion_factor)
@@ -5,24 +5,40 @@ import frappe
 import erpnext
 from frappe.utils import flt, nowdate, add_days, cint
 from frappe import _
+from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+	get_warehouse_group_projected_qty
 
-def reorder_item():
-	""" Reorder item if stock reaches reorder level"""
+def reorder_item(dry_run=False):
+	""" Reorder item if stock reaches reorder level
+
+		:param dry_run: return the planned Material Request rows per request type and company
+			instead of creating Material Requests"""
 	# if initial setup not completed, return
 	if not (frappe.db.a_row_exists("Company") and frappe.db.a_row_exists("Fiscal Year")):
 		return
 
 	if cint(frappe.db.get_value('Stock Settings', None, 'auto_indent')):
-		return _reorder_item()
+		return _reorder_item(dry_run)
+
+def _reorder_item(dry_run=False):
+	material_requests = get_reorder_plan()
+
+	if dry_run:
+		return material_requests
 
-def _reorder_item():
+	if material_requests:
+		return create_material_request(material_requests)
+
+def get_reorder_plan():
+	"""Material Request rows per request type and company for all items below their reorder level,
+		computed from a few bulk queries"""
 	material_requests = {"Purchase": {}, "Transfer": {}, "Material Issue": {}, "Manufacture": {}}
 	warehouse_company = frappe._dict(frappe.db.sql("""select name, company from `tabWarehouse`
 		where disabled=0"""))
 	default_company = (erpnext.get_default_company() or
 		frappe.db.sql("""select name from tabCompany limit 1""")[0][0])
 
-	items_to_consider = frappe.db.sql_list("""select name from `tabItem` item
+	items_to_consider = frappe.db.sql("""select name, variant_of from `tabItem` item
 		where is_stock_item=1 and has_variants=0
 			and disabled=0
 			and (end_of_life is null or end_of_life='0000-00-00' or end_of_life > %(today)s)
@@ -33,73 +49,64 @@ def _reorder_item():
 		{"today": nowdate()})
 
 	if not items_to_consider:
-		return
+		return material_requests
 
-	item_warehouse_projected_qty = get_item_warehouse_projected_qty(items_to_consider)
+	reorder_levels = get_reorder_levels()
+	item_warehouse_projected_qty = get_item_warehouse_projected_qty([d[0] for d in items_to_consider])
 
-	def add_to_material_request(item_code, warehouse, reorder_level, reorder_qty, material_request_type, warehouse_group=None):
-		if warehouse not in warehouse_company:
-			# a disabled warehouse
-			return
+	for item_code, variant_of in items_to_consider:
+		levels = reorder_levels.get(item_code)
+		if not levels and variant_of:
+			# variants without their own levels use the template's, as in Item.update_template_tables
+			levels = [frappe._dict(d, warehouse_group=None) for d in reorder_levels.get(variant_of, [])]
 
-		reorder_level = flt(reorder_level)
-		reorder_qty = flt(reorder_qty)
+		for d in levels or []:
+			if d.warehouse not in warehouse_company:
+				# a disabled warehouse
+				continue
 
-		# projected_qty will be 0 if Bin does not exist
-		if warehouse_group:
-			projected_qty = flt(item_warehouse_projected_qty.get(item_code, {}).get(warehouse_group))
-		else:
-			projected_qty = flt(item_warehouse_projected_qty.get(item_code, {}).get(warehouse))
+			reorder_level = flt(d.warehouse_reorder_level)
+			reorder_qty = flt(d.warehouse_reorder_qty)
 
-		if (reorder_level or reorder_qty) and projected_qty < reorder_level:
-			deficiency = reorder_level - projected_qty
-			if deficiency > reorder_qty:
-				reorder_qty = deficiency
+			# projected_qty will be 0 if Bin does not exist
+			projected_qty = flt(item_warehouse_projected_qty.get(item_code, {}).get(d.warehouse_group or d.warehouse))
 
-			company = warehouse_company.get(warehouse) or default_company
+			if (reorder_level or reorder_qty) and projected_qty < reorder_level:
+				deficiency = reorder_level - projected_qty
+				if deficiency > reorder_qty:
+					reorder_qty = deficiency
 
-			material_requests[material_request_type].setdefault(company, []).append({
-				"item_code": item_code,
-				"warehouse": warehouse,
-				"reorder_qty": reorder_qty
-			})
+				company = warehouse_company.get(d.warehouse) or default_company
 
-	for item_code in items_to_consider:
-		item = frappe.get_doc("Item", item_code)
+				material_requests[d.material_request_type].setdefault(company, []).append({
+					"item_code": item_code,
+					"warehouse": d.warehouse,
+					"reorder_qty": reorder_qty
+				})
 
-		if item.variant_of and not item.get("reorder_levels"):
-			item.update_template_tables()
+	return material_requests
 
-		if item.get("reorder_levels"):
-			for d in item.get("reorder_levels"):
-				add_to_material_request(item_code, d.warehouse, d.warehouse_reorder_level,
-					d.warehouse_reorder_qty, d.material_request_type, warehouse_group=d.warehouse_group)
+def get_reorder_levels():
+	reorder_levels = {}
+	for d in frappe.db.sql("""select parent, warehouse, warehouse_group, warehouse_reorder_level,
+		warehouse_reorder_qty, material_request_type
+		from `tabItem Reorder` where parenttype='Item' order by parent, idx""", as_dict=1):
+			reorder_levels.setdefault(d.parent, []).append(d)
 
-	if material_requests:
-		return create_material_request(material_requests)
+	return reorder_levels
 
 def get_item_warehouse_projected_qty(items_to_consider):
-	item_warehouse_projected_qty = {}
+	"""projected qty by item, of each warehouse and of each warehouse group"""
+	items_to_consider = set(items_to_consider)
+	item_warehouse_projected_qty = get_warehouse_group_projected_qty()
 
 	for item_code, warehouse, projected_qty in frappe.db.sql("""select item_code, warehouse, projected_qty
-		from tabBin where item_code in ({0})
-			and (warehouse != "" and warehouse is not null)"""\
-		.format(", ".join(["%s"] * len(items_to_consider))), items_to_consider):
-
-		if item_code not in item_warehouse_projected_qty:
-			item_warehouse_projected_qty.setdefault(item_code, {})
+		from tabBin where (warehouse != "" and warehouse is not null)"""):
 
-		if warehouse not in item_warehouse_projected_qty.get(item_code):
-			item_warehouse_projected_qty[item_code][warehouse] = flt(projected_qty)
+		if item_code not in items_to_consider:
+			continue
 
-		warehouse_doc = frappe.get_doc("Warehouse", warehouse)
-
-		while warehouse_doc.parent_warehouse:
-			if not item_warehouse_projected_qty.get(item_code, {}).get(warehouse_doc.parent_warehouse):
-				item_warehouse_projected_qty.setdefault(item_code, {})[warehouse_doc.parent_warehouse] = flt(projected_qty)
-			else:
-				item_warehouse_projected_qty[item_code][warehouse_doc.parent_warehouse] += flt(projected_qty)
-			warehouse_doc = frappe.get_doc("Warehouse", warehouse_doc.parent_warehouse)
+		item_warehouse_projected_qty.setdefault(item_code, {})[warehouse] = flt(projected_qty)
 
 	return item_warehouse_projected_qty
 
@@ -115,6 +122,10 @@ def create_material_request(material_requests):
 		else:
 			exceptions_list.append(frappe.get_traceback())
 
+	item_details = get_item_details_for_material_request(list(set(d["item_code"]
+		for request_type in material_requests for company in material_requests[request_type]
+		for d in material_requests[request_type][company])))
+
 	for request_type in material_requests:
 		for company in material_requests[request_type]:
 			try:
@@ -131,15 +142,14 @@ def create_material_request(material_requests):
 
 				for d in items:
 					d = frappe._dict(d)
-					item = frappe.get_doc("Item", d.item_code)
+					item = item_details[d.item_code]
 					uom = item.stock_uom
 					conversion_factor = 1.0
 
 					if request_type == 'Purchase':
 						uom = item.purchase_uom or item.stock_uom
 						if uom != item.stock_uom:
-							conversion_factor = frappe.db.get_value("UOM Conversion Detail", 
-								{'parent': item.name, 'uom': uom}, 'conversion_factor') or 1.0
+							conversion_factor = item.conversion_factors.get(uom) or 1.0
 
 					mr.append("items", {
 						"doctype": "Material Request Item",
@@ -177,6 +187,24 @@ def create_material_request(material_requests):
 
 	return mr_list
 
+def get_item_details_for_material_request(items):
+	item_details = {}
+	if not items:
+		return item_details
+
+	for d in frappe.db.sql("""select name, stock_uom, purchase_uom, lead_time_days, item_name,
+		description, item_group, brand
+		from tabItem where name in ({0})""".format(", ".join(["%s"] * len(items))), tuple(items), as_dict=1):
+			d.conversion_factors = {}
+			item_details[d.name] = d
+
+	for parent, uom, conversion_factor in frappe.db.sql("""select parent, uom, conversion_factor
+		from `tabUOM Conversion Detail` where parenttype='Item' and parent in ({0})"""
+		.format(", ".join(["%s"] * len(items))), tuple(items)):
+			item_details[parent].conversion_factors.setdefault(uom, conversion_factor)
+
+	return item_details
+
 def send_email_notification(mr_list):
 	""" Notify user about auto creation of indent"""
 
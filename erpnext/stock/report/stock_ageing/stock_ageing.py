@@ -4,25 +4,47 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import date_diff, flt
+from frappe.utils import date_diff
+from erpnext.stock.doctype.stock_ageing_snapshot.stock_ageing_snapshot import StockAgeingQueue, \
+	get_latest_snapshots
 
 def execute(filters=None):
+	filters = frappe._dict(filters or {})
 
-	columns = get_columns()
-	item_details = get_fifo_queue(filters)
+	columns = get_columns(filters)
+	fifo_queues = get_fifo_queue(filters)
 	to_date = filters["to_date"]
+
+	if not filters.get("show_warehouse_wise_stock"):
+		# batches of all warehouses of the item, oldest first
+		item_queues = {}
+		for (item_code, warehouse), ageing_queue in fifo_queues.items():
+			item_queues.setdefault(item_code, []).extend(ageing_queue.queue)
+
+		fifo_queues = dict(((item_code, None), sorted(batches, key=lambda batch: batch[1]))
+			for item_code, batches in item_queues.items())
+	else:
+		fifo_queues = dict((key, list(ageing_queue.queue)) for key, ageing_queue in fifo_queues.items())
+
+	item_details = get_item_details([key[0] for key in fifo_queues])
+
 	data = []
-	for item, item_dict in item_details.items():
-		fifo_queue = item_dict["fifo_queue"]
-		details = item_dict["details"]
+	for key in sorted(fifo_queues):
+		fifo_queue = fifo_queues[key]
 		if not fifo_queue: continue
 
+		item, warehouse = key
+		details = item_details[item]
+
 		average_age = get_average_age(fifo_queue, to_date)
 		earliest_age = date_diff(to_date, fifo_queue[0][1])
 		latest_age = date_diff(to_date, fifo_queue[-1][1])
 
-		data.append([item, details.item_name, details.description, details.item_group,
-			details.brand, average_age, earliest_age, latest_age, details.stock_uom])
+		row = [item, details.item_name, details.description, details.item_group, details.brand]
+		if filters.get("show_warehouse_wise_stock"):
+			row.append(warehouse)
+
+		data.append(row + [average_age, earliest_age, latest_age, details.stock_uom])
 
 	return columns, data
 
@@ -35,54 +57,86 @@ def get_average_age(fifo_queue, to_date):
 
 	return (age_qty / total_qty) if total_qty else 0.0
 
-def get_columns():
-	return [_("Item Code") + ":Link/Item:100", _("Item Name") + "::100", _("Description") + "::200",
-		_("Item Group") + ":Link/Item Group:100", _("Brand") + ":Link/Brand:100", _("Average Age") + ":Float:100",
-		_("Earliest") + ":Int:80", _("Latest") + ":Int:80", _("UOM") + ":Link/UOM:100"]
+def get_columns(filters):
+	columns = [_("Item Code") + ":Link/Item:100", _("Item Name") + "::100", _("Description") + "::200",
+		_("Item Group") + ":Link/Item Group:100", _("Brand") + ":Link/Brand:100"]
+
+	if filters.get("show_warehouse_wise_stock"):
+		columns.append(_("Warehouse") + ":Link/Warehouse:100")
+
+	return columns + [_("Average Age") + ":Float:100", _("Earliest") + ":Int:80",
+		_("Latest") + ":Int:80", _("UOM") + ":Link/UOM:100"]
 
 def get_fifo_queue(filters):
-	item_details = {}
-	for d in get_stock_ledger_entries(filters):
-		item_details.setdefault(d.name, {"details": d, "fifo_queue": []})
-		fifo_queue = item_details[d.name]["fifo_queue"]
-
-		if d.voucher_type == "Stock Reconciliation":
-			d.actual_qty = flt(d.qty_after_transaction) - flt(item_details[d.name].get("qty_after_transaction", 0))
-
-		if d.actual_qty > 0:
-			fifo_queue.append([d.actual_qty, d.posting_date])
-		else:
-			qty_to_pop = abs(d.actual_qty)
-			while qty_to_pop:
-				batch = fifo_queue[0] if fifo_queue else [0, None]
-				if 0 < batch[0] <= qty_to_pop:
-					# if batch qty > 0
-					# not enough or exactly same qty in current batch, clear batch
-					qty_to_pop -= batch[0]
-					fifo_queue.pop(0)
-				else:
-					# all from current batch
-					batch[0] -= qty_to_pop
-					qty_to_pop = 0
-
-		item_details[d.name]["qty_after_transaction"] = d.qty_after_transaction
-
-	return item_details
-
-def get_stock_ledger_entries(filters):
+	"""
+		Age queue per (item, warehouse) as on `to_date`, from the latest snapshot on or before
+		it with the stock ledger entries posted after the snapshot replayed on top.
+	"""
+	conditions = get_conditions(filters)
+	snapshots = get_latest_snapshots(filters.get("company"), filters.get("to_date"), conditions, filters)
+
+	fifo_queues = {}
+	for key, snapshot in snapshots.items():
+		fifo_queues[key] = StockAgeingQueue(snapshot.fifo_queue, snapshot.qty_after_transaction)
+
+	# entries are replayed after the snapshot date of their item and warehouse,
+	# one ledger query per distinct snapshot date
+	pairs_by_start_date = {}
+	for item_code, warehouse in frappe.db.sql("""select item_code, warehouse from `tabBin`
+		where exists(select name from `tabWarehouse` where name=`tabBin`.warehouse and company=%(company)s)
+			{0}""".format(conditions), filters):
+		snapshot = snapshots.get((item_code, warehouse))
+		pairs_by_start_date.setdefault(snapshot.period_end_date if snapshot else None, set())\
+			.add((item_code, warehouse))
+
+	for start_date, pairs in pairs_by_start_date.items():
+		item_codes = list(set(d[0] for d in pairs)) if len(pairs_by_start_date) > 1 else None
+
+		for d in get_stock_ledger_entries(filters, start_date, item_codes):
+			key = (d.item_code, d.warehouse)
+			if key in pairs:
+				fifo_queues.setdefault(key, StockAgeingQueue()).add_entry(d)
+
+	return fifo_queues
+
+def get_stock_ledger_entries(filters, from_date=None, item_codes=None):
+	"""entries up to `to_date` posted after `from_date`, of `item_codes` if given"""
+	values = dict(filters, from_date=from_date)
+
+	conditions = get_conditions(filters)
+	if from_date:
+		conditions += " and posting_date > %(from_date)s"
+	if item_codes:
+		conditions += " and item_code in ({0})".format(", ".join("%(item_code_{0})s".format(i)
+			for i in range(len(item_codes))))
+		values.update(("item_code_{0}".format(i), d) for i, d in enumerate(item_codes))
+
 	return frappe.db.sql("""select
-			item.name, item.item_name, item_group, brand, description, item.stock_uom,
-			actual_qty, posting_date, voucher_type, qty_after_transaction
-		from `tabStock Ledger Entry` sle,
-			(select name, item_name, description, stock_uom, brand, item_group
-				from `tabItem` {item_conditions}) item
-		where item_code = item.name and
-			company = %(company)s and
+			item_code, warehouse, actual_qty, posting_date, voucher_type, qty_after_transaction
+		from `tabStock Ledger Entry`
+		where company = %(company)s and
 			posting_date <= %(to_date)s
-			{sle_conditions}
-			order by posting_date, posting_time, sle.name"""\
-		.format(item_conditions=get_item_conditions(filters),
-			sle_conditions=get_sle_conditions(filters)), filters, as_dict=True)
+			{conditions}
+			order by posting_datetime, name"""\
+		.format(conditions=conditions), values, as_dict=True)
+
+def get_item_details(item_codes):
+	if not item_codes:
+		return {}
+
+	return dict((d.name, d) for d in frappe.db.sql("""select
+			name, item_name, description, item_group, brand, stock_uom
+		from `tabItem` where name in ({0})""".format(", ".join(["%s"] * len(item_codes))),
+		tuple(set(item_codes)), as_dict=True))
+
+def get_conditions(filters):
+	"""conditions on the item_code and warehouse columns of a ledger-like table"""
+	conditions = ""
+	item_conditions = get_item_conditions(filters)
+	if item_conditions:
+		conditions += " and item_code in (select name from `tabItem` {0})".format(item_conditions)
+
+	return conditions + " " + get_sle_conditions(filters)
 
 def get_item_conditions(filters):
 	conditions = []
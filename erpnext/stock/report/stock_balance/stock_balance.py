@@ -4,24 +4,36 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import flt, cint, getdate, now
+from frappe.utils import flt, cint, getdate, now, add_days
 from erpnext.stock.report.stock_ledger.stock_ledger import get_item_group_condition
+from erpnext.stock.doctype.stock_movement_summary.stock_movement_summary import \
+	stock_movement_summary_enabled, get_stock_balances, get_stock_movements
 
 def execute(filters=None):
 	if not filters: filters = {}
 
-	validate_filters(filters)
-
 	columns = get_columns()
 	items = get_items(filters)
-	sle = get_stock_ledger_entries(filters, items)
 
-	# if no stock ledger entry found return
-	if not sle:
-		return columns, []
+	if stock_movement_summary_enabled():
+		iwb_map = get_item_warehouse_map_from_summary(filters, items)
+
+		# if no stock movement found return
+		if not iwb_map:
+			return columns, []
+
+		item_map = get_item_details(items or list(set(key[1] for key in iwb_map)), [], filters)
+	else:
+		validate_filters(filters)
+		sle = get_stock_ledger_entries(filters, items)
+
+		# if no stock ledger entry found return
+		if not sle:
+			return columns, []
+
+		iwb_map = get_item_warehouse_map(filters, sle)
+		item_map = get_item_details(items, sle, filters)
 
-	iwb_map = get_item_warehouse_map(filters, sle)
-	item_map = get_item_details(items, sle, filters)
 	item_reorder_detail_map = get_item_reorder_details(item_map.keys())
 
 	data = []
@@ -168,6 +180,54 @@ def get_item_warehouse_map(filters, sle):
 	iwb_map = filter_items_with_no_transactions(iwb_map)
 
 	return iwb_map
+
+def get_item_warehouse_map_from_summary(filters, items):
+	"""opening and closing balances and movements of the period from the daily Stock Movement Summary"""
+	if not filters.get("from_date"):
+		frappe.throw(_("'From Date' is required"))
+	if not filters.get("to_date"):
+		frappe.throw(_("'To Date' is required"))
+
+	conditions = ""
+	if items:
+		conditions += " and item_code in ({0})".format(", ".join(['"' + frappe.db.escape(i, percent=False) + '"'
+			for i in items]))
+
+	if filters.get("warehouse"):
+		warehouse_details = frappe.db.get_value("Warehouse",
+			filters.get("warehouse"), ["lft", "rgt"], as_dict=1)
+		if warehouse_details:
+			conditions += " and warehouse in (select name from `tabWarehouse` \
+				where lft >= %s and rgt <= %s)" % (warehouse_details.lft, warehouse_details.rgt)
+
+	# conditions are already escaped literals, keep their % signs out of parameter substitution
+	conditions = conditions.replace("%", "%%")
+
+	iwb_map = {}
+	for d in get_stock_balances(filters.get("to_date"), conditions):
+		iwb_map[(d.company, d.item_code, d.warehouse)] = frappe._dict({
+			"opening_qty": 0.0, "opening_val": 0.0,
+			"in_qty": 0.0, "in_val": 0.0,
+			"out_qty": 0.0, "out_val": 0.0,
+			"bal_qty": flt(d.closing_qty), "bal_val": flt(d.closing_value),
+			"val_rate": flt(d.valuation_rate)
+		})
+
+	for d in get_stock_balances(add_days(filters.get("from_date"), -1), conditions):
+		qty_dict = iwb_map.get((d.company, d.item_code, d.warehouse))
+		if qty_dict:
+			qty_dict.opening_qty = flt(d.closing_qty)
+			qty_dict.opening_val = flt(d.closing_value)
+
+	for d in get_stock_movements(filters.get("from_date"), filters.get("to_date"), conditions):
+		qty_dict = iwb_map.get((d.company, d.item_code, d.warehouse))
+		if qty_dict:
+			qty_dict.update({
+				"in_qty": flt(d.in_qty), "in_val": flt(d.in_value),
+				"out_qty": flt(d.out_qty), "out_val": flt(d.out_value)
+			})
+
+	return filter_items_with_no_transactions(iwb_map)
 	
 def filter_items_with_no_transactions(iwb_map):
 	for (company, item, warehouse) in sorted(iwb_map):
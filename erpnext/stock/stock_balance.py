@@ -2,9 +2,10 @@
 # License: GNU General Public License v3. See license.txt
 
 from __future__ import print_function, unicode_literals
-import frappe
+import frappe, json, zlib
 
-from frappe.utils import flt, cstr, nowdate, nowtime
+from frappe import _
+from frappe.utils import cint, flt, cstr, nowdate, nowtime, now
 from erpnext.stock.utils import update_bin
 from erpnext.stock.stock_ledger import update_entries_after
 
@@ -18,23 +19,153 @@ def repost(only_actual=False, allow_negative_stock=False, allow_zero_rate=False,
 		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
 
-	for d in frappe.db.sql("""select distinct item_code, warehouse from
-		(select item_code, warehouse from tabBin
-		union
-		select item_code, warehouse from `tabStock Ledger Entry`) a"""):
+	stats = frappe._dict(rows=0, time_taken=0.0)
+	if only_bin and not only_actual:
+		# all Bins in a few grouped queries instead of a set of queries per Bin
+		recompute_bin_qty(include_actual_qty=True)
+		frappe.db.commit()
+	else:
+		for d in get_item_warehouse_pairs():
 			try:
-				repost_stock(d[0], d[1], allow_zero_rate, only_actual, only_bin)
+				repost_stock(d[0], d[1], allow_zero_rate, only_actual, only_bin, stats=stats)
 				frappe.db.commit()
 			except:
 				frappe.db.rollback()
 
+	if stats.time_taken:
+		print("Reposted {0} stock ledger entries in {1:.2f}s ({2:.0f} rows/sec)".format(
+			stats.rows, stats.time_taken, stats.rows / stats.time_taken))
+
 	if allow_negative_stock:
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
 	frappe.db.auto_commit_on_many_writes = 0
 
-def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False, only_bin=False):
+def get_item_warehouse_pairs(after=None):
+	"""all (item_code, warehouse) pairs in Bin or Stock Ledger Entry, optionally only
+		those ordered after the given pair"""
+	condition = "where (item_code, warehouse) > (%s, %s)" if after else ""
+	return frappe.db.sql("""select distinct item_code, warehouse from
+		(select item_code, warehouse from tabBin
+		union
+		select item_code, warehouse from `tabStock Ledger Entry`) a
+		{0}
+		order by item_code, warehouse""".format(condition), tuple(after or ()))
+
+# number of reposted (item, warehouse) pairs after which a worker records its progress
+REPOST_CHECKPOINT_INTERVAL = 100
+
+def repost_in_parallel(workers=4, only_actual=False, allow_negative_stock=False, allow_zero_rate=False,
+	only_bin=False, resume=True):
+	"""
+	Repost everything, split across `workers` processes with their own database connections.
+
+	Pairs are assigned to a partition by a stable hash of the item code, so all warehouses of
+	an item are reposted by the same worker and a rerun assigns the same pairs to the same worker.
+	Each worker checkpoints the last reposted pair; with `resume` an interrupted run continues
+	from there instead of starting over.
+	"""
+	from multiprocessing import Pool
+
+	workers = cint(workers) or 1
+	if not resume:
+		clear_repost_checkpoints(workers)
+
+	if allow_negative_stock:
+		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
+		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
+
+	# forked workers must not share this connection
+	frappe.db.commit()
+	frappe.db.close()
+
+	options = dict(only_actual=only_actual, allow_zero_rate=allow_zero_rate, only_bin=only_bin)
+	pool = Pool(workers)
+	try:
+		results = pool.map(_repost_partition_in_worker, [(frappe.local.site, frappe.local.sites_path,
+			partition, workers, options) for partition in range(workers)])
+	finally:
+		pool.close()
+		pool.join()
+		frappe.db.connect()
+
+		if allow_negative_stock:
+			frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
+			frappe.db.commit()
+
+	stats = frappe._dict(pairs=0, rows=0, time_taken=0.0)
+	for result in results:
+		for key in stats:
+			stats[key] += result[key]
+
+	print("Reposted {0} item-warehouse pairs ({1} stock ledger entries) in {2} workers".format(
+		stats.pairs, stats.rows, workers))
+
+	clear_repost_checkpoints(workers)
+	frappe.db.commit()
+
+	return stats
+
+def _repost_partition_in_worker(args):
+	site, sites_path, partition, partitions, options = args
+
+	frappe.destroy()
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	try:
+		return repost_partition(partition, partitions, **options)
+	finally:
+		frappe.destroy()
+
+def repost_partition(partition, partitions, only_actual=False, allow_zero_rate=False, only_bin=False):
+	"""repost all pairs of the given partition, continuing after its last checkpoint"""
+	frappe.db.auto_commit_on_many_writes = 1
+
+	checkpoint = get_repost_checkpoint(partition, partitions)
+	stats = frappe._dict(pairs=0, rows=0, time_taken=0.0)
+
+	for item_code, warehouse in get_item_warehouse_pairs(after=checkpoint):
+		if get_repost_partition(item_code, partitions) != partition:
+			continue
+
+		try:
+			repost_stock(item_code, warehouse, allow_zero_rate, only_actual, only_bin, stats=stats)
+			frappe.db.commit()
+		except:
+			frappe.db.rollback()
+
+		stats.pairs += 1
+		if stats.pairs % REPOST_CHECKPOINT_INTERVAL == 0:
+			set_repost_checkpoint(partition, partitions, item_code, warehouse)
+
+	frappe.db.auto_commit_on_many_writes = 0
+	return stats
+
+def get_repost_partition(item_code, partitions):
+	# crc32 rather than hash() so that the split is the same in every process and every run
+	return (zlib.crc32(cstr(item_code).encode("utf-8")) & 0xffffffff) % partitions
+
+def get_repost_checkpoint_key(partition, partitions):
+	return "stock_repost_checkpoint_{0}_of_{1}".format(partition, partitions)
+
+def get_repost_checkpoint(partition, partitions):
+	checkpoint = frappe.db.get_global(get_repost_checkpoint_key(partition, partitions))
+	return tuple(json.loads(checkpoint)) if checkpoint else None
+
+def set_repost_checkpoint(partition, partitions, item_code, warehouse):
+	frappe.db.set_global(get_repost_checkpoint_key(partition, partitions), json.dumps([item_code, warehouse]))
+	frappe.db.commit()
+
+def clear_repost_checkpoints(partitions):
+	for partition in range(partitions):
+		frappe.defaults.clear_default(get_repost_checkpoint_key(partition, partitions), parent="__global")
+	frappe.db.commit()
+
+def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False, only_bin=False, stats=None):
 	if not only_bin:
-		repost_actual_qty(item_code, warehouse, allow_zero_rate)
+		reposted = repost_actual_qty(item_code, warehouse, allow_zero_rate)
+		if reposted and stats is not None:
+			stats.rows += reposted.rows_processed
+			stats.time_taken += reposted.time_taken
 
 	if item_code and warehouse and not only_actual:
 		qty_dict = {
@@ -52,7 +183,7 @@ def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False,
 
 def repost_actual_qty(item_code, warehouse, allow_zero_rate=False):
 	try:
-		update_entries_after({ "item_code": item_code, "warehouse": warehouse }, allow_zero_rate)
+		return update_entries_after({ "item_code": item_code, "warehouse": warehouse }, allow_zero_rate)
 	except:
 		pass
 
@@ -137,6 +268,215 @@ def get_planned_qty(item_code, warehouse):
 
 	return flt(planned_qty[0][0]) if planned_qty else 0
 
+BIN_QTY_FIELDS = ("reserved_qty", "indented_qty", "ordered_qty", "planned_qty")
+
+def recompute_bin_qty(item_code=None, include_actual_qty=False, update=True, chunk_size=500):
+	"""
+		Recompute reserved, indented, ordered and planned qty of all Bins, of the given item if any,
+		with one grouped query per quantity instead of four queries per Bin. With `include_actual_qty`,
+		actual qty is also set from the last Stock Ledger Entry.
+
+		Returns the drifted Bins with their expected and actual quantities. Unless `update` is false,
+		they are corrected with a multi-row update, and missing Bins are created.
+	"""
+	fields = BIN_QTY_FIELDS + (("actual_qty",) if include_actual_qty else ())
+	expected = {
+		"reserved_qty": get_reserved_qty_map(item_code),
+		"indented_qty": get_indented_qty_map(item_code),
+		"ordered_qty": get_ordered_qty_map(item_code),
+		"planned_qty": get_planned_qty_map(item_code)
+	}
+	if include_actual_qty:
+		expected["actual_qty"] = get_balance_qty_map(item_code)
+
+	precision = cint(frappe.db.get_default("float_precision")) or 3
+	bins = frappe.db.sql("""select name, item_code, warehouse, actual_qty, reserved_qty, indented_qty,
+			ordered_qty, planned_qty, reserved_qty_for_production, reserved_qty_for_sub_contract, projected_qty
+		from tabBin {0}""".format("where item_code=%s" if item_code else ""),
+		(item_code,) if item_code else (), as_dict=1)
+
+	drift, drifted_bins = [], []
+	for bin in bins:
+		key = (bin.item_code, bin.warehouse)
+		if all(flt(bin.get(d), precision) == flt(expected[d].get(key), precision) for d in fields):
+			continue
+
+		drift.append(frappe._dict(item_code=bin.item_code, warehouse=bin.warehouse, bin=bin.name,
+			expected=dict((d, flt(expected[d].get(key))) for d in fields),
+			actual=dict((d, flt(bin.get(d))) for d in fields)))
+
+		for d in fields:
+			bin[d] = flt(expected[d].get(key))
+		bin.previous_projected_qty = flt(bin.projected_qty)
+		bin.projected_qty = (flt(bin.actual_qty) + flt(bin.ordered_qty) + flt(bin.indented_qty)
+			+ flt(bin.planned_qty) - flt(bin.reserved_qty) - flt(bin.reserved_qty_for_production)
+			- flt(bin.reserved_qty_for_sub_contract))
+		drifted_bins.append(bin)
+
+	missing_pairs = get_pairs_without_bin(expected, set((d.item_code, d.warehouse) for d in bins))
+	for key in missing_pairs:
+		drift.append(frappe._dict(item_code=key[0], warehouse=key[1], bin=None,
+			expected=dict((d, flt(expected[d].get(key))) for d in fields), actual=None))
+
+	if update:
+		bulk_update_bins(drifted_bins, fields, chunk_size)
+		update_warehouse_groups_for_bins(drifted_bins)
+
+		for key in missing_pairs:
+			update_bin_qty(key[0], key[1], dict((d, flt(expected[d].get(key))) for d in fields))
+
+	return drift
+
+def get_reserved_qty_map(item_code=None):
+	"""reserved qty per (item_code, warehouse), as per `get_reserved_qty`"""
+	return get_qty_map("""
+		select item_code, warehouse,
+			sum(dnpi_qty * ((so_item_qty - so_item_delivered_qty) / so_item_qty))
+		from
+			(
+				(select dnpi.item_code, dnpi.warehouse, dnpi.qty as dnpi_qty, so_item.qty as so_item_qty,
+					so_item.delivered_qty as so_item_delivered_qty
+				from `tabPacked Item` dnpi, `tabSales Order Item` so_item, `tabSales Order` so
+				where dnpi.parenttype="Sales Order" and dnpi.item_code != dnpi.parent_item
+				and so_item.name = dnpi.parent_detail_docname and so_item.delivered_by_supplier = 0
+				and so.name = dnpi.parent and so.docstatus = 1 and so.status != 'Closed'
+				{0})
+			union all
+				(select so_item.item_code, so_item.warehouse, so_item.stock_qty as dnpi_qty,
+					so_item.qty as so_item_qty, so_item.delivered_qty as so_item_delivered_qty
+				from `tabSales Order Item` so_item, `tabSales Order` so
+				where so.name = so_item.parent and so.docstatus = 1 and so.status != 'Closed'
+				and (so_item.delivered_by_supplier is null or so_item.delivered_by_supplier = 0)
+				{1})
+			) tab
+		where so_item_qty >= so_item_delivered_qty
+		group by item_code, warehouse""".format(
+			"and dnpi.item_code=%(item_code)s" if item_code else "",
+			"and so_item.item_code=%(item_code)s" if item_code else ""), item_code)
+
+def get_indented_qty_map(item_code=None):
+	return get_qty_map("""select mr_item.item_code, mr_item.warehouse, sum(mr_item.qty - mr_item.ordered_qty)
+		from `tabMaterial Request Item` mr_item, `tabMaterial Request` mr
+		where mr_item.qty > mr_item.ordered_qty and mr_item.parent=mr.name
+		and mr.status!='Stopped' and mr.docstatus=1 {0}
+		group by mr_item.item_code, mr_item.warehouse""".format(
+			"and mr_item.item_code=%(item_code)s" if item_code else ""), item_code)
+
+def get_ordered_qty_map(item_code=None):
+	return get_qty_map("""
+		select po_item.item_code, po_item.warehouse,
+			sum((po_item.qty - po_item.received_qty)*po_item.conversion_factor)
+		from `tabPurchase Order Item` po_item, `tabPurchase Order` po
+		where po_item.qty > po_item.received_qty and po_item.parent=po.name
+		and po.status not in ('Closed', 'Delivered') and po.docstatus=1
+		and po_item.delivered_by_supplier = 0 {0}
+		group by po_item.item_code, po_item.warehouse""".format(
+			"and po_item.item_code=%(item_code)s" if item_code else ""), item_code)
+
+def get_planned_qty_map(item_code=None):
+	return get_qty_map("""
+		select production_item, fg_warehouse, sum(qty - produced_qty) from `tabProduction Order`
+		where status not in ("Stopped", "Completed") and docstatus=1 and qty > produced_qty {0}
+		group by production_item, fg_warehouse""".format(
+			"and production_item=%(item_code)s" if item_code else ""), item_code)
+
+def get_balance_qty_map(item_code=None):
+	"""qty after the last Stock Ledger Entry per (item_code, warehouse), as per `get_balance_qty_from_sle`"""
+	balance_qty = {}
+	for d in frappe.db.sql("""
+		select sle.item_code, sle.warehouse, sle.qty_after_transaction
+		from `tabStock Ledger Entry` sle,
+			(select item_code, warehouse, max(posting_datetime) as posting_datetime
+			from `tabStock Ledger Entry`
+			where is_cancelled='No' {0}
+			group by item_code, warehouse) latest
+		where sle.item_code = latest.item_code and sle.warehouse = latest.warehouse
+		and sle.posting_datetime = latest.posting_datetime and sle.is_cancelled='No'
+		order by sle.name""".format("and item_code=%(item_code)s" if item_code else ""),
+		{"item_code": item_code}):
+			# of entries at the same time, the one with the highest name is the last
+			balance_qty[(d[0], d[1])] = flt(d[2])
+
+	return balance_qty
+
+def get_qty_map(query, item_code=None):
+	return dict(((d[0], d[1]), flt(d[2])) for d in frappe.db.sql(query, {"item_code": item_code}))
+
+def get_pairs_without_bin(expected, existing_pairs):
+	"""pairs of stock items with a non-zero expected qty but no Bin"""
+	pairs = set()
+	for qty_map in expected.values():
+		pairs.update(key for key, qty in qty_map.items()
+			if qty and key[0] and key[1] and key not in existing_pairs)
+
+	if not pairs:
+		return []
+
+	item_codes = list(set(d[0] for d in pairs))
+	stock_items = set(frappe.db.sql_list("""select name from tabItem
+		where is_stock_item=1 and name in ({0})""".format(", ".join(["%s"] * len(item_codes))),
+		tuple(item_codes)))
+
+	return sorted(d for d in pairs if d[0] in stock_items)
+
+def bulk_update_bins(bins, fields, chunk_size=500):
+	"""write back recomputed quantities of the given Bins, with one multi-row update per chunk"""
+	fields = tuple(fields) + ("projected_qty",)
+	timestamp = now()
+
+	for i in range(0, len(bins), chunk_size):
+		chunk = bins[i:i + chunk_size]
+		values = []
+		set_clauses = []
+		for fieldname in fields:
+			cases = []
+			for bin in chunk:
+				cases.append("when %s then %s")
+				values.extend([bin.name, flt(bin.get(fieldname))])
+
+			set_clauses.append("`{0}` = case name {1} end".format(fieldname, " ".join(cases)))
+
+		values.append(timestamp)
+		values.extend([bin.name for bin in chunk])
+
+		frappe.db.sql("""update tabBin set {0}, modified=%s
+			where name in ({1})""".format(", ".join(set_clauses), ", ".join(["%s"] * len(chunk))),
+			tuple(values))
+
+def update_warehouse_groups_for_bins(bins):
+	from erpnext.stock.doctype.warehouse_group_projected_qty.warehouse_group_projected_qty import \
+		update_warehouse_group_projected_qty, rebuild_warehouse_group_projected_qty
+
+	if len(bins) > 1000:
+		# cheaper to rebuild the group totals in one grouped query
+		rebuild_warehouse_group_projected_qty()
+		return
+
+	for bin in bins:
+		update_warehouse_group_projected_qty(bin.item_code, bin.warehouse,
+			flt(bin.projected_qty) - flt(bin.previous_projected_qty))
+
+def reconcile_bin_qty():
+	"""
+		daily: correct Bins that drifted from their open transactions, e.g. after direct database fixes.
+
+		Drift found without locks is checked again per item with its Bins locked, so that a
+		transaction that changed a Bin after the first pass is not reverted.
+	"""
+	drift = []
+	items = sorted(set(d.item_code for d in recompute_bin_qty(update=False)))
+	for item_code in items:
+		# a new transaction, reading after the transactions holding these Bins commit
+		frappe.db.commit()
+		frappe.db.sql("select name from tabBin where item_code=%s for update", item_code)
+		drift.extend(recompute_bin_qty(item_code))
+
+	if drift:
+		frappe.log_error(title=_("Bin qty mismatch"),
+			message="\n".join("{0} {1}: expected {2}, found {3}".format(d.item_code, d.warehouse,
+				d.expected, d.actual) for d in drift[:100]))
+
+	frappe.db.commit()
 
 def update_bin_qty(item_code, warehouse, qty_dict=None):
 	from erpnext.stock.utils import get_bin
@@ -230,6 +570,9 @@ def reset_serial_no_status_and_warehouse(serial_nos=None):
 				pass
 
 def repost_all_stock_vouchers():
+	from erpnext.accounts.doctype.account_balance_snapshot.account_balance_snapshot import \
+		remove_voucher_from_account_balance_snapshots
+
 	warehouses_with_account = frappe.db.sql_list("""select warehouse from tabAccount
 		where ifnull(account_type, '') = 'Stock' and (warehouse is not null and warehouse != '')
 		and is_group=0""")
@@ -246,6 +589,7 @@ def repost_all_stock_vouchers():
 		i+=1
 		print(i, "/", len(vouchers), voucher_type, voucher_no)
 		try:
+			remove_voucher_from_account_balance_snapshots(voucher_type, voucher_no)
 			for dt in ["Stock Ledger Entry", "GL Entry"]:
 				frappe.db.sql("""delete from `tab%s` where voucher_type=%s and voucher_no=%s"""%
 					(dt, '%s', '%s'), (voucher_type, voucher_no))
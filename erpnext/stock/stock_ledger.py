@@ -4,9 +4,13 @@ from __future__ import unicode_literals
 
 import frappe, erpnext
 from frappe import _
-from frappe.utils import cint, flt, cstr, now
-from erpnext.stock.utils import get_valuation_method
-import json
+from frappe.utils import cint, flt, cstr, now, nowdate, getdate
+from erpnext.stock.utils import get_valuation_method, get_posting_datetime
+from erpnext.stock.valuation import FIFOValuation
+from erpnext.stock.doctype.stock_ageing_snapshot.stock_ageing_snapshot import delete_stock_ageing_snapshots
+from erpnext.stock.doctype.stock_movement_summary.stock_movement_summary import update_stock_movement_summary
+import json, time
+from six import string_types
 
 # future reposting
 class NegativeStockError(frappe.ValidationError): pass
@@ -14,31 +18,123 @@ class NegativeStockError(frappe.ValidationError): pass
 _exceptions = frappe.local('stockledger_exceptions')
 # _exceptions = []
 
+# number of future entries fetched, locked and written back per round trip while reposting
+REPOST_CHUNK_SIZE = 1000
+
+# fields recomputed by update_entries_after for every reposted entry
+REPOST_FIELDS = ("qty_after_transaction", "valuation_rate", "stock_value",
+	"stock_queue", "stock_value_difference")
+
 def make_sl_entries(sl_entries, is_amended=None, allow_negative_stock=False, via_landed_cost_voucher=False):
 	if sl_entries:
-		from erpnext.stock.utils import update_bin
-
 		cancel = True if sl_entries[0].get("is_cancelled") == "Yes" else False
 		if cancel:
 			set_as_cancel(sl_entries[0].get('voucher_no'), sl_entries[0].get('voucher_type'))
 
-		for sle in sl_entries:
-			sle_id = None
-			if sle.get('is_cancelled') == 'Yes':
-				sle['actual_qty'] = -flt(sle['actual_qty'])
+		if cancel and via_landed_cost_voucher:
+			# cancelled landed cost entries only update Bin qty, without reposting
+			make_sl_entries_row_wise(sl_entries, is_amended, allow_negative_stock, via_landed_cost_voucher)
+		else:
+			make_sl_entries_in_bulk(sl_entries, allow_negative_stock, via_landed_cost_voucher)
+
+		if cancel:
+			delete_cancelled_entry(sl_entries[0].get('voucher_type'), sl_entries[0].get('voucher_no'))
+
+			# the summary was updated with the reversing entries, which are now deleted
+			update_stock_movement_summary_for(sl_entries)
+
+def update_stock_movement_summary_for(sl_entries):
+	from_dates = {}
+	for sle in sl_entries:
+		key = (sle.get("item_code"), sle.get("warehouse"))
+		posting_date = getdate(sle.get("posting_date"))
+		from_dates[key] = min(from_dates.get(key) or posting_date, posting_date)
+
+	for (item_code, warehouse), posting_date in from_dates.items():
+		update_stock_movement_summary(item_code, warehouse, posting_date)
 
-			if sle.get("actual_qty") or sle.get("voucher_type")=="Stock Reconciliation":
-				sle_id = make_entry(sle, allow_negative_stock, via_landed_cost_voucher)
+def make_sl_entries_row_wise(sl_entries, is_amended=None, allow_negative_stock=False, via_landed_cost_voucher=False):
+	from erpnext.stock.utils import update_bin
 
-			args = sle.copy()
-			args.update({
-				"sle_id": sle_id,
-				"is_amended": is_amended
+	for sle in sl_entries:
+		sle_id = None
+		if sle.get('is_cancelled') == 'Yes':
+			sle['actual_qty'] = -flt(sle['actual_qty'])
+
+		if sle.get("actual_qty") or sle.get("voucher_type")=="Stock Reconciliation":
+			sle_id = make_entry(sle, allow_negative_stock, via_landed_cost_voucher)
+
+		args = sle.copy()
+		args.update({
+			"sle_id": sle_id,
+			"is_amended": is_amended
+		})
+		update_bin(args, allow_negative_stock, via_landed_cost_voucher)
+
+def make_sl_entries_in_bulk(sl_entries, allow_negative_stock=False, via_landed_cost_voucher=False):
+	"""
+		Insert all entries of a voucher with multi-row inserts, then repost each
+		(item, warehouse) once from its earliest entry. The repost also updates the Bin,
+		so every Bin is saved once per voucher instead of once per row.
+	"""
+	from erpnext.stock.utils import get_bin
+	from erpnext.utilities.bulk import bulk_insert
+
+	stock_items = get_stock_items(list(set(sle.get("item_code") for sle in sl_entries)))
+
+	sle_docs, repost_args, other_bins = [], {}, []
+	for sle in sl_entries:
+		if sle.get('is_cancelled') == 'Yes':
+			sle['actual_qty'] = -flt(sle['actual_qty'])
+
+		has_entry = sle.get("actual_qty") or sle.get("voucher_type")=="Stock Reconciliation"
+		if has_entry:
+			sle_docs.append(make_entry_doc(sle, allow_negative_stock, via_landed_cost_voucher))
+
+		if sle.get("item_code") not in stock_items:
+			frappe.msgprint(_("Item {0} ignored since it is not a stock item").format(sle.get("item_code")))
+			continue
+
+		key = (sle.get("item_code"), sle.get("warehouse"))
+		if not has_entry:
+			if key not in other_bins:
+				other_bins.append(key)
+			continue
+
+		posting_datetime = get_posting_datetime(sle.get("posting_date") or nowdate(), sle.get("posting_time"))
+		if key not in repost_args or posting_datetime < repost_args[key].posting_datetime:
+			repost_args[key] = frappe._dict({
+				"item_code": sle.get("item_code"),
+				"warehouse": sle.get("warehouse"),
+				"posting_date": sle.get("posting_date") or nowdate(),
+				"posting_time": sle.get("posting_time"),
+				"posting_datetime": posting_datetime
 			})
-			update_bin(args, allow_negative_stock, via_landed_cost_voucher)
 
-		if cancel:
-			delete_cancelled_entry(sl_entries[0].get('voucher_type'), sl_entries[0].get('voucher_no'))
+	bulk_insert("Stock Ledger Entry", sle_docs, "SLE/", 8, docstatus=1)
+	for sle_doc in sle_docs:
+		sle_doc.run_method("on_submit")
+
+	for key in other_bins:
+		if key not in repost_args:
+			get_bin(*key)
+
+	# rates missing for one item of the voucher are looked up together with the others
+	company = sl_entries[0].get("company") if sl_entries else None
+	valuation_rate_cache = ValuationRateCache(repost_args.keys(),
+		currency=erpnext.get_company_currency(company) if company else None)
+
+	for key, args in repost_args.items():
+		del args["posting_datetime"]
+		update_entries_after(args, allow_negative_stock=allow_negative_stock,
+			via_landed_cost_voucher=via_landed_cost_voucher, valuation_rate_cache=valuation_rate_cache)
+
+def get_stock_items(items):
+	if not items:
+		return []
+
+	return frappe.db.sql_list("""select name from tabItem
+		where is_stock_item=1 and name in ({0})""".format(", ".join(["%s"] * len(items))), tuple(items))
 
 def set_as_cancel(voucher_type, voucher_no):
 	frappe.db.sql("""update `tabStock Ledger Entry` set is_cancelled='Yes',
@@ -56,6 +152,18 @@ def make_entry(args, allow_negative_stock=False, via_landed_cost_voucher=False):
 	sle.submit()
 	return sle.name
 
+def make_entry_doc(args, allow_negative_stock=False, via_landed_cost_voucher=False):
+	"""validated Stock Ledger Entry, to be inserted in bulk"""
+	args.update({"doctype": "Stock Ledger Entry"})
+	sle = frappe.get_doc(args)
+	sle.flags.ignore_permissions = 1
+	sle.allow_negative_stock=allow_negative_stock
+	sle.via_landed_cost_voucher = via_landed_cost_voucher
+	# same defaults as Document.insert
+	sle._set_defaults()
+	sle.run_method("validate")
+	return sle
+
 def delete_cancelled_entry(voucher_type, voucher_no):
 	frappe.db.sql("""delete from `tabStock Ledger Entry`
 		where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
@@ -74,10 +182,14 @@ class update_entries_after(object):
 				"posting_time": "12:00"
 			}
 	"""
-	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False, verbose=1):
+	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False,
+		verbose=1, chunk_size=REPOST_CHUNK_SIZE, valuation_rate_cache=None):
 		from frappe.model.meta import get_field_precision
 
 		self.exceptions = []
+		self.chunk_size = chunk_size
+		self.rows_processed = 0
+		self.time_taken = 0.0
 		self.verbose = verbose
 		self.allow_zero_rate = allow_zero_rate
 		self.allow_negative_stock = allow_negative_stock
@@ -90,6 +202,10 @@ class update_entries_after(object):
 		for key, value in args.iteritems():
 			setattr(self, key, value)
 
+		# age queues snapshotted after the reposted entries are rebuilt by the daily job
+		if self.args.get("posting_date"):
+			delete_stock_ageing_snapshots(self.item_code, self.warehouse, self.args.get("posting_date"))
+
 		self.previous_sle = self.get_sle_before_datetime()
 		self.previous_sle = self.previous_sle[0] if self.previous_sle else frappe._dict()
 
@@ -97,26 +213,48 @@ class update_entries_after(object):
 			setattr(self, key, flt(self.previous_sle.get(key)))
 
 		self.company = frappe.db.get_value("Warehouse", self.warehouse, "company")
+		currency = frappe.db.get_value("Company", self.company, "default_currency", cache=True)
 		self.precision = get_field_precision(frappe.get_meta("Stock Ledger Entry").get_field("stock_value"),
-			currency=frappe.db.get_value("Company", self.company, "default_currency", cache=True))
+			currency=currency)
+
+		# last known rate of the item in the warehouse, kept up to date while walking the entries
+		self.valuation_rate_cache = valuation_rate_cache
+		if self.valuation_rate_cache is None:
+			self.valuation_rate_cache = ValuationRateCache([(self.item_code, self.warehouse)], currency)
+		if flt(self.previous_sle.get("valuation_rate")) > 0:
+			self.valuation_rate_cache[(self.item_code, self.warehouse)] = flt(self.previous_sle.valuation_rate)
+		self.allow_zero_valuation_rate = {}
 
 		self.prev_stock_value = self.previous_sle.stock_value or 0.0
-		self.stock_queue = json.loads(self.previous_sle.stock_queue or "[]")
+		self.stock_queue = FIFOValuation(self.previous_sle.stock_queue or "[]")
 		self.valuation_method = get_valuation_method(self.item_code)
 		self.stock_value_difference = 0.0
 		self.build()
 
 	def build(self):
+		start = time.time()
+
 		# includes current entry!
-		entries_to_fix = self.get_sle_after_datetime()
+		for entries_to_fix in self.get_sle_after_datetime_in_chunks():
+			for sle in entries_to_fix:
+				self.process_sle(sle)
+
+			# write back the whole chunk at once
+			bulk_update_stock_ledger_entries(entries_to_fix)
+			self.rows_processed += len(entries_to_fix)
 
-		for sle in entries_to_fix:
-			self.process_sle(sle)
+		self.time_taken = time.time() - start
 
 		if self.exceptions:
 			self.raise_exceptions()
 
 		self.update_bin()
+		update_stock_movement_summary(self.item_code, self.warehouse,
+			self.args.get("posting_date") or "1900-01-01")
+
+	@property
+	def rows_per_sec(self):
+		return flt(self.rows_processed / self.time_taken) if self.time_taken else flt(self.rows_processed)
 
 	def update_bin(self):
 		# update bin
@@ -150,6 +288,7 @@ class update_entries_after(object):
 			# or when negative stock is not allowed for moving average
 			if not self.validate_negative_stock(sle):
 				self.qty_after_transaction += flt(sle.actual_qty)
+				sle.reposted = False
 				return
 
 		if sle.serial_no:
@@ -161,7 +300,7 @@ class update_entries_after(object):
 				# assert
 				self.valuation_rate = sle.valuation_rate
 				self.qty_after_transaction = sle.qty_after_transaction
-				self.stock_queue = [[self.qty_after_transaction, self.valuation_rate]]
+				self.stock_queue.reset(self.qty_after_transaction, self.valuation_rate)
 				self.stock_value = flt(self.qty_after_transaction) * flt(self.valuation_rate)
 			else:
 				if self.valuation_method == "Moving Average":
@@ -171,7 +310,7 @@ class update_entries_after(object):
 				else:
 					self.get_fifo_values(sle)
 					self.qty_after_transaction += flt(sle.actual_qty)
-					self.stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
+					self.stock_value = self.stock_queue.value
 
 		# rounding as per precision
 		self.stock_value = flt(self.stock_value, self.precision)
@@ -187,10 +326,12 @@ class update_entries_after(object):
 		sle.qty_after_transaction = self.qty_after_transaction
 		sle.valuation_rate = self.valuation_rate
 		sle.stock_value = self.stock_value
-		sle.stock_queue = json.dumps(self.stock_queue)
+		sle.stock_queue = self.stock_queue.serialize()
 		sle.stock_value_difference = stock_value_difference
-		sle.doctype="Stock Ledger Entry"
-		frappe.get_doc(sle).db_update()
+		sle.reposted = True
+
+		if flt(self.valuation_rate) > 0:
+			self.valuation_rate_cache[(sle.item_code, sle.warehouse)] = flt(self.valuation_rate)
 
 	def validate_negative_stock(self, sle):
 		"""
@@ -238,9 +379,7 @@ class update_entries_after(object):
 		if not self.valuation_rate and sle.voucher_detail_no:
 			allow_zero_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 			if not allow_zero_rate:
-				self.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-					sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-					currency=erpnext.get_company_currency(sle.company))
+				self.valuation_rate = self.get_fallback_valuation_rate(sle)
 
 	def get_moving_average_values(self, sle):
 		actual_qty = flt(sle.actual_qty)
@@ -276,9 +415,7 @@ class update_entries_after(object):
 			if not self.valuation_rate and sle.voucher_detail_no:
 				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 				if not allow_zero_valuation_rate:
-					self.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-						sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-						currency=erpnext.get_company_currency(sle.company))
+					self.valuation_rate = self.get_fallback_valuation_rate(sle)
 
 	def get_fifo_values(self, sle):
 		incoming_rate = flt(sle.incoming_rate)
@@ -286,80 +423,37 @@ class update_entries_after(object):
 		outgoing_rate = flt(sle.outgoing_rate)
 
 		if actual_qty > 0:
-			if not self.stock_queue:
-				self.stock_queue.append([0, 0])
-
-			# last row has the same rate, just updated the qty
-			if self.stock_queue[-1][1]==incoming_rate:
-				self.stock_queue[-1][0] += actual_qty
-			else:
-				if self.stock_queue[-1][0] > 0:
-					self.stock_queue.append([actual_qty, incoming_rate])
-				else:
-					qty = self.stock_queue[-1][0] + actual_qty
-					self.stock_queue[-1] = [qty, incoming_rate]
+			self.stock_queue.add_stock(actual_qty, incoming_rate)
 		else:
-			qty_to_pop = abs(actual_qty)
-			while qty_to_pop:
-				if not self.stock_queue:
-					# Get valuation rate from last sle if exists or from valuation rate field in item master
-					allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
-					if not allow_zero_valuation_rate:
-						_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-							sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-							currency=erpnext.get_company_currency(sle.company))
-					else:
-						_rate = 0
-
-					self.stock_queue.append([0, _rate])
-
-				index = None
-				if outgoing_rate > 0:
-					# Find the entry where rate matched with outgoing rate
-					for i, v in enumerate(self.stock_queue):
-						if v[1] == outgoing_rate:
-							index = i
-							break
-
-					# If no entry found with outgoing rate, collapse stack
-					if index == None:
-						new_stock_value = sum((d[0]*d[1] for d in self.stock_queue)) - qty_to_pop*outgoing_rate
-						new_stock_qty = sum((d[0] for d in self.stock_queue)) - qty_to_pop
-						self.stock_queue = [[new_stock_qty, new_stock_value/new_stock_qty if new_stock_qty > 0 else outgoing_rate]]
-						break
-				else:
-					index = 0
-
-				# select first batch or the batch with same rate
-				batch = self.stock_queue[index]
-				if qty_to_pop >= batch[0]:
-					# consume current batch
-					qty_to_pop = qty_to_pop - batch[0]
-					self.stock_queue.pop(index)
-					if not self.stock_queue and qty_to_pop:
-						# stock finished, qty still remains to be withdrawn
-						# negative stock, keep in as a negative batch
-						self.stock_queue.append([-qty_to_pop, outgoing_rate or batch[1]])
-						break
-
+			def rate_generator():
+				# Get valuation rate from last sle if exists or from valuation rate field in item master
+				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
+				if not allow_zero_valuation_rate:
+					return self.get_fallback_valuation_rate(sle)
 				else:
-					# qty found in current batch
-					# consume it and exit
-					batch[0] = batch[0] - qty_to_pop
-					qty_to_pop = 0
+					return 0
 
-		stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
-		stock_qty = sum((flt(batch[0]) for batch in self.stock_queue))
+			self.stock_queue.remove_stock(abs(actual_qty), outgoing_rate, rate_generator)
 
-		if stock_qty:
-			self.valuation_rate = stock_value / flt(stock_qty)
+		if self.stock_queue.qty:
+			self.valuation_rate = self.stock_queue.get_valuation_rate()
 
 		if not self.stock_queue:
 			self.stock_queue.append([0, sle.incoming_rate or sle.outgoing_rate or self.valuation_rate])
 
 	def check_if_allow_zero_valuation_rate(self, voucher_type, voucher_detail_no):
-		ref_item_dt = voucher_type + (" Detail" if voucher_type == "Stock Entry" else " Item")
-		return frappe.db.get_value(ref_item_dt, voucher_detail_no, "allow_zero_valuation_rate")
+		if (voucher_type, voucher_detail_no) not in self.allow_zero_valuation_rate:
+			ref_item_dt = voucher_type + (" Detail" if voucher_type == "Stock Entry" else " Item")
+			self.allow_zero_valuation_rate[(voucher_type, voucher_detail_no)] = \
+				frappe.db.get_value(ref_item_dt, voucher_detail_no, "allow_zero_valuation_rate")
+
+		return self.allow_zero_valuation_rate[(voucher_type, voucher_detail_no)]
+
+	def get_fallback_valuation_rate(self, sle):
+		"""rate for an entry without one: from the entries walked so far, else looked up once per repost"""
+		return get_valuation_rate(sle.item_code, sle.warehouse, sle.voucher_type, sle.voucher_no,
+			self.allow_zero_rate, currency=erpnext.get_company_currency(sle.company),
+			valuation_rate_cache=self.valuation_rate_cache)
 
 	def get_sle_before_datetime(self):
 		"""get previous stock ledger entry before current time-bucket"""
@@ -367,9 +461,29 @@ class update_entries_after(object):
 
 	def get_sle_after_datetime(self):
 		"""get Stock Ledger Entries after a particular datetime, for reposting"""
-		return get_stock_ledger_entries(self.previous_sle or frappe._dict({
-				"item_code": self.args.get("item_code"), "warehouse": self.args.get("warehouse") }),
-			">", "asc", for_update=True)
+		return get_stock_ledger_entries(self.get_repost_start(), ">", "asc", for_update=True)
+
+	def get_sle_after_datetime_in_chunks(self):
+		"""yield Stock Ledger Entries after a particular datetime in chunks of `chunk_size`,
+			each chunk continuing after the (posting_datetime, name) of the last entry of the previous one"""
+		args = self.get_repost_start()
+		seek_after = None
+
+		while True:
+			entries = get_stock_ledger_entries(args, ">", "asc", "limit %d" % cint(self.chunk_size),
+				for_update=True, seek_after=seek_after)
+			if not entries:
+				break
+
+			yield entries
+
+			if len(entries) < cint(self.chunk_size):
+				break
+			seek_after = entries[-1]
+
+	def get_repost_start(self):
+		return self.previous_sle or frappe._dict({
+			"item_code": self.args.get("item_code"), "warehouse": self.args.get("warehouse") })
 
 	def raise_exceptions(self):
 		deficiency = min(e["diff"] for e in self.exceptions)
@@ -410,9 +524,13 @@ def get_previous_sle(args, for_update=False):
 	sle = get_stock_ledger_entries(args, "<=", "desc", "limit 1", for_update=for_update)
 	return sle and sle[0] or {}
 
-def get_stock_ledger_entries(previous_sle, operator=None, order="desc", limit=None, for_update=False, debug=False):
-	"""get stock ledger entries filtered by specific posting datetime conditions"""
-	conditions = " and timestamp(posting_date, posting_time) {0} timestamp(%(posting_date)s, %(posting_time)s)".format(operator)
+def get_stock_ledger_entries(previous_sle, operator=None, order="desc", limit=None, for_update=False,
+	debug=False, seek_after=None):
+	"""get stock ledger entries filtered by specific posting datetime conditions
+
+		:param seek_after: if set, only return entries ordered after this entry (keyset pagination,
+			expects ascending order)"""
+	conditions = " and posting_datetime {0} %(posting_datetime)s".format(operator)
 	if previous_sle.get("warehouse"):
 		conditions += " and warehouse = %(warehouse)s"
 	elif previous_sle.get("warehouse_condition"):
@@ -426,55 +544,69 @@ def get_stock_ledger_entries(previous_sle, operator=None, order="desc", limit=No
 	if operator in (">", "<=") and previous_sle.get("name"):
 		conditions += " and name!=%(name)s"
 
-	return frappe.db.sql("""select *, timestamp(posting_date, posting_time) as "timestamp" from `tabStock Ledger Entry`
+	values = frappe._dict(previous_sle,
+		posting_datetime=get_posting_datetime(previous_sle["posting_date"], previous_sle["posting_time"]))
+
+	if seek_after:
+		# plain range on posting_datetime for the index, row value comparison for the tie on name
+		values.update({"seek_datetime": seek_after.posting_datetime, "seek_name": seek_after.name})
+		conditions += """ and posting_datetime >= %(seek_datetime)s
+			and (posting_datetime, name) > (%(seek_datetime)s, %(seek_name)s)"""
+
+	# served by the (item_code, warehouse, posting_datetime, name) index
+	return frappe.db.sql("""select *, posting_datetime as "timestamp" from `tabStock Ledger Entry`
 		where item_code = %%(item_code)s
 		and ifnull(is_cancelled, 'No')='No'
 		%(conditions)s
-		order by timestamp(posting_date, posting_time) %(order)s, name %(order)s
+		order by posting_datetime %(order)s, name %(order)s
 		%(limit)s %(for_update)s""" % {
 			"conditions": conditions,
 			"limit": limit or "",
 			"for_update": for_update and "for update" or "",
 			"order": order
-		}, previous_sle, as_dict=1, debug=debug)
+		}, values, as_dict=1, debug=debug)
 
-def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
-	allow_zero_rate=False, currency=None, company=None):
-	# Get valuation rate from last sle for the same item and warehouse
-	if not company:
-		company = erpnext.get_default_company()
+def bulk_update_stock_ledger_entries(entries, fields=REPOST_FIELDS):
+	"""write back reposted values of the given entries with a single multi-row update"""
+	entries = [sle for sle in entries if sle.get("reposted")]
+	if not entries:
+		return
 
-	last_valuation_rate = frappe.db.sql("""select valuation_rate
-		from `tabStock Ledger Entry`
-		where item_code = %s and warehouse = %s
-		and valuation_rate >= 0
-		order by posting_date desc, posting_time desc, name desc limit 1""", (item_code, warehouse))
+	values = []
+	set_clauses = []
+	for fieldname in fields:
+		cases = []
+		for sle in entries:
+			cases.append("when %s then %s")
+			value = sle.get(fieldname)
+			if fieldname == "stock_queue" and not isinstance(value, string_types):
+				value = json.dumps(value)
+			values.extend([sle.name, value])
 
-	if not last_valuation_rate:
-		# Get valuation rate from last sle for the item against any warehouse
-		last_valuation_rate = frappe.db.sql("""select valuation_rate
-			from `tabStock Ledger Entry`
-			where item_code = %s and valuation_rate > 0
-			order by posting_date desc, posting_time desc, name desc limit 1""", item_code)
+		set_clauses.append("`{0}` = case name {1} end".format(fieldname, " ".join(cases)))
 
-	if last_valuation_rate:
-		return flt(last_valuation_rate[0][0]) # as there is previous records, it might come with zero rate
+	values.extend([sle.name for sle in entries])
 
-	# If negative stock allowed, and item delivered without any incoming entry,
-	# system does not found any SLE, then take valuation rate from Item
-	valuation_rate = frappe.db.get_value("Item", item_code, "valuation_rate")
+	frappe.db.sql("""update `tabStock Ledger Entry` set {0}
+		where name in ({1})""".format(", ".join(set_clauses), ", ".join(["%s"] * len(entries))),
+		tuple(values))
 
-	if not valuation_rate:
-		# try Item Standard rate
-		valuation_rate = frappe.db.get_value("Item", item_code, "standard_rate")
+def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
+	allow_zero_rate=False, currency=None, company=None, valuation_rate_cache=None):
+	"""
+		Last valuation rate of the item in the warehouse, or in any warehouse, else the rate from
+		the Item master or its buying price. Pass a `ValuationRateCache` to look up the rates
+		of several items of a voucher together and only once.
+	"""
+	if not company:
+		company = erpnext.get_default_company()
 
-		if not valuation_rate:
-			# try in price list
-			valuation_rate = frappe.db.get_value('Item Price',
-				dict(item_code=item_code, buying=1, currency=currency),
-				'price_list_rate')
+	if valuation_rate_cache is None:
+		valuation_rate_cache = ValuationRateCache(currency=currency)
 
-	if not allow_zero_rate and not valuation_rate \
+	valuation_rate = valuation_rate_cache.get_rate(item_code, warehouse)
+
+	if not allow_zero_rate and valuation_rate is None \
 			and cint(erpnext.is_perpetual_inventory_enabled(company)):
 		if is_client_paper(item_code):
 			valuation_rate = 0
@@ -484,6 +616,99 @@ def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
 
 	return valuation_rate
 
+class ValuationRateCache(dict):
+	"""
+		Valuation rate per (item_code, warehouse), as returned by `get_valuation_rates`.
+		On a miss, the rates of all pending pairs are fetched in one batch.
+	"""
+	def __init__(self, item_warehouse_pairs=None, currency=None):
+		super(ValuationRateCache, self).__init__()
+		self.pending = set(item_warehouse_pairs or [])
+		self.currency = currency
+
+	def get_rate(self, item_code, warehouse):
+		if (item_code, warehouse) not in self:
+			self.pending.add((item_code, warehouse))
+			self.update(get_valuation_rates([key for key in self.pending if key not in self], self.currency))
+			self.pending.clear()
+
+		return self[(item_code, warehouse)]
+
+def get_valuation_rates(item_warehouse_pairs, currency=None):
+	"""
+		Returns {(item_code, warehouse): rate} from the last entry of the item in the warehouse
+		(even at zero rate), else the last non-zero rate of the item in any warehouse,
+		else the Item valuation or standard rate, else its buying Item Price. None if not found.
+	"""
+	item_warehouse_pairs = set(item_warehouse_pairs)
+	rates = dict((key, None) for key in item_warehouse_pairs)
+	if not rates:
+		return rates
+
+	items = list(set(key[0] for key in item_warehouse_pairs))
+
+	# as there is previous records, it might come with zero rate
+	for item_code, warehouse, valuation_rate in get_last_valuation_rates(items, ["warehouse"], "valuation_rate >= 0"):
+		if (item_code, warehouse) in item_warehouse_pairs and rates[(item_code, warehouse)] is None:
+			rates[(item_code, warehouse)] = flt(valuation_rate)
+
+	items = list(set(key[0] for key, rate in rates.items() if rate is None))
+	if not items:
+		return rates
+
+	# Get valuation rate from last sle for the item against any warehouse
+	item_rates = {}
+	for item_code, valuation_rate in get_last_valuation_rates(items, [], "valuation_rate > 0"):
+		item_rates.setdefault(item_code, flt(valuation_rate))
+
+	# If negative stock allowed, and item delivered without any incoming entry,
+	# system does not found any SLE, then take valuation rate from Item, else try Item Standard rate
+	items_without_entries = [d for d in items if d not in item_rates]
+	if items_without_entries:
+		for item_code, valuation_rate, standard_rate in frappe.db.sql("""select name, valuation_rate, standard_rate
+			from tabItem where name in ({0})""".format(", ".join(["%s"] * len(items_without_entries))),
+			tuple(items_without_entries)):
+				if flt(valuation_rate) or flt(standard_rate):
+					item_rates[item_code] = flt(valuation_rate) or flt(standard_rate)
+
+	# try in price list
+	items_without_entries = [d for d in items_without_entries if d not in item_rates]
+	if items_without_entries:
+		for item_code, price_list_rate in frappe.db.sql("""select item_code, price_list_rate
+			from `tabItem Price`
+			where buying=1 and ifnull(currency, '')=%s and item_code in ({0})""".format(
+				", ".join(["%s"] * len(items_without_entries))), tuple([cstr(currency)] + items_without_entries)):
+				if flt(price_list_rate):
+					item_rates.setdefault(item_code, flt(price_list_rate))
+
+	for key, rate in rates.items():
+		if rate is None:
+			rates[key] = item_rates.get(key[0])
+
+	return rates
+
+def get_last_valuation_rates(items, group_by, condition):
+	"""rows of (item_code, *group_by, valuation_rate) of the last entry per item (and group_by) matching condition"""
+	group_by = ["item_code"] + group_by
+
+	return frappe.db.sql("""
+		select {select_fields}, sle.valuation_rate
+		from `tabStock Ledger Entry` sle, (
+			select {group_by}, max(posting_datetime) as posting_datetime
+			from `tabStock Ledger Entry`
+			where item_code in ({items}) and {condition}
+			group by {group_by}
+		) last_sle
+		where {join_condition}
+			and sle.posting_datetime = last_sle.posting_datetime
+			and sle.{condition}
+		order by sle.name desc""".format(
+			select_fields=", ".join("sle." + d for d in group_by),
+			group_by=", ".join(group_by),
+			items=", ".join(["%s"] * len(items)),
+			condition=condition,
+			join_condition=" and ".join("sle.{0} = last_sle.{0}".format(d) for d in group_by)), tuple(items))
+
 def is_client_paper(item=None):
 	return frappe.db.exists("Item Variant Attribute",
 		{"parent":item, "attribute" : "Owner", "attribute_value" : ["!=","Amba Offset"]}) and True or False
\ No newline at end of file
@@ -5,10 +5,15 @@ from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
 import json
-from frappe.utils import flt, cstr, nowdate, nowtime
+from datetime import datetime
+from frappe.utils import flt, cstr, nowdate, nowtime, getdate, get_time
 
 class InvalidWarehouseCompany(frappe.ValidationError): pass
 
+def get_posting_datetime(posting_date, posting_time=None):
+	"""value of the stored `posting_datetime` of a Stock Ledger Entry"""
+	return datetime.combine(getdate(posting_date), get_time(cstr(posting_time) or "00:00"))
+
 def get_stock_value_from_bin(warehouse=None, item_code=None):
 	values = {}
 	conditions = ""
@@ -60,7 +65,7 @@ def get_stock_value_on(warehouse=None, posting_date=None, item_code=None):
 		SELECT item_code, stock_value, name, warehouse
 		FROM `tabStock Ledger Entry` sle
 		WHERE posting_date <= %s {0}
-		ORDER BY timestamp(posting_date, posting_time) DESC, name DESC
+		ORDER BY posting_datetime DESC, name DESC
 	""".format(condition), values, as_dict=1)
 
 	sle_map = {}
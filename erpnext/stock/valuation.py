@@ -0,0 +1,150 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+from __future__ import unicode_literals
+
+import json
+from collections import deque
+from frappe.utils import flt
+
+class FIFOValuation(object):
+	"""
+		FIFO stock queue of [qty, rate] batches, oldest batch first.
+
+		Keeps running totals of qty and value so that the stock value after a transaction
+		does not need a pass over the whole queue, and consumes batches from the front of a
+		deque so that issuing stock is O(1) amortised per consumed batch.
+
+		The serialized form is the same JSON list of [qty, rate] pairs as stored in
+		`Stock Ledger Entry.stock_queue`, without whitespace. The encoded form of each batch
+		is kept next to it and only re-encoded when the batch changes, so serializing after
+		a transaction joins the kept strings instead of encoding the whole queue again.
+		Batches must only be changed through the methods of this class.
+	"""
+	def __init__(self, state=None):
+		if state and not isinstance(state, (list, tuple, deque)):
+			state = json.loads(state)
+
+		self.queue = deque([list(batch) for batch in state or []])
+		self.encoded = deque([encode_batch(batch) for batch in self.queue])
+		self.recompute_totals()
+
+	def __len__(self):
+		return len(self.queue)
+
+	def __iter__(self):
+		return iter(self.queue)
+
+	def __getitem__(self, index):
+		return self.queue[index]
+
+	def get_state(self):
+		return [list(batch) for batch in self.queue]
+
+	def serialize(self):
+		return "[" + ",".join(self.encoded) + "]"
+
+	def recompute_totals(self):
+		self.qty = sum(flt(batch[0]) for batch in self.queue)
+		self.value = sum(flt(batch[0]) * flt(batch[1]) for batch in self.queue)
+
+	def get_valuation_rate(self):
+		return self.value / flt(self.qty) if self.qty else None
+
+	def reset(self, qty, rate):
+		"""replace the whole queue by a single batch, e.g. on stock reconciliation"""
+		self.queue = deque([[qty, rate]])
+		self.encoded = deque([encode_batch(self.queue[0])])
+		self.recompute_totals()
+
+	def append(self, batch):
+		self.queue.append(list(batch))
+		self.encoded.append(encode_batch(batch))
+		self.qty += flt(batch[0])
+		self.value += flt(batch[0]) * flt(batch[1])
+
+	def add_stock(self, qty, rate):
+		"""receive `qty` at `rate` at the end of the queue"""
+		if not self.queue:
+			self.queue.append([0, 0])
+			self.encoded.append(encode_batch([0, 0]))
+
+		last = self.queue[-1]
+		if last[1] == rate:
+			# last row has the same rate, just update the qty
+			last[0] += qty
+			self.encoded[-1] = encode_batch(last)
+		elif last[0] > 0:
+			self.queue.append([qty, rate])
+			self.encoded.append(encode_batch([qty, rate]))
+		else:
+			# replace a negative or empty batch
+			self.value += flt(last[0]) * (flt(rate) - flt(last[1]))
+			self.queue[-1] = [last[0] + qty, rate]
+			self.encoded[-1] = encode_batch(self.queue[-1])
+
+		self.qty += qty
+		self.value += qty * flt(rate)
+
+	def remove_stock(self, qty, outgoing_rate=0, rate_generator=None):
+		"""
+			consume `qty` from the oldest batches, or from the batch with the same rate if
+			`outgoing_rate` is given. `rate_generator` returns the rate of a zero batch
+			to consume from when the queue is exhausted.
+		"""
+		qty_to_pop = qty
+		while qty_to_pop:
+			if not self.queue:
+				self.append([0, rate_generator() if rate_generator else 0])
+
+			index = None
+			if outgoing_rate > 0:
+				# Find the entry where rate matched with outgoing rate
+				for i, batch in enumerate(self.queue):
+					if batch[1] == outgoing_rate:
+						index = i
+						break
+
+				# If no entry found with outgoing rate, collapse stack
+				if index is None:
+					new_stock_value = self.value - qty_to_pop * outgoing_rate
+					new_stock_qty = self.qty - qty_to_pop
+					self.reset(new_stock_qty, new_stock_value / new_stock_qty if new_stock_qty > 0 else outgoing_rate)
+					break
+			else:
+				index = 0
+
+			# select first batch or the batch with same rate
+			batch = self.queue[index]
+			if qty_to_pop >= batch[0]:
+				# consume current batch
+				qty_to_pop = qty_to_pop - batch[0]
+				if index == 0:
+					self.queue.popleft()
+					self.encoded.popleft()
+				else:
+					del self.queue[index]
+					del self.encoded[index]
+
+				self.qty -= flt(batch[0])
+				self.value -= flt(batch[0]) * flt(batch[1])
+
+				if not self.queue and qty_to_pop:
+					# stock finished, qty still remains to be withdrawn
+					# negative stock, keep in as a negative batch
+					self.reset(-qty_to_pop, outgoing_rate or batch[1])
+					break
+			else:
+				# qty found in current batch
+				# consume it and exit
+				batch[0] = batch[0] - qty_to_pop
+				self.encoded[index] = encode_batch(batch)
+				self.qty -= qty_to_pop
+				self.value -= qty_to_pop * flt(batch[1])
+				qty_to_pop = 0
+
+		if len(self.queue) <= 1:
+			# drop accumulated floating point error once the queue is (nearly) drained
+			self.recompute_totals()
+
+def encode_batch(batch):
+	return json.dumps(batch, separators=(',', ':'))
@@ -0,0 +1,57 @@
+# Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import cint, now
+
+# rows per multi-row insert statement
+BULK_INSERT_CHUNK_SIZE = 500
+
+def make_autonames_in_bulk(prefix, digits, count):
+	"""reserve `count` consecutive names of the naming series `prefix` with one update"""
+	current = frappe.db.sql("select `current` from `tabSeries` where name=%s for update", prefix)
+	if current and current[0][0] is not None:
+		start = cint(current[0][0])
+		frappe.db.sql("update `tabSeries` set `current` = `current` + %s where name=%s", (count, prefix))
+	else:
+		start = 0
+		frappe.db.sql("insert into `tabSeries` (name, `current`) values (%s, %s)", (prefix, count))
+
+	return [prefix + ("%0" + str(digits) + "d") % (start + i) for i in range(1, count + 1)]
+
+def bulk_insert(doctype, docs, naming_series, digits, docstatus=0, chunk_size=BULK_INSERT_CHUNK_SIZE):
+	"""
+		Insert validated documents of a doctype without child tables with multi-row inserts,
+		naming them from `naming_series`. Sets name, owner and timestamps on the documents.
+	"""
+	if not docs:
+		return
+
+	names = make_autonames_in_bulk(naming_series, digits, len(docs))
+	timestamp, user = now(), frappe.session.user
+
+	rows = []
+	for doc, name in zip(docs, names):
+		doc.update({
+			"name": name,
+			"owner": user,
+			"modified_by": user,
+			"creation": timestamp,
+			"modified": timestamp,
+			"docstatus": docstatus
+		})
+		rows.append(doc.get_valid_dict())
+
+	columns = list(rows[0])
+	for i in range(0, len(rows), chunk_size):
+		chunk = rows[i:i + chunk_size]
+		values = []
+		for row in chunk:
+			values.extend([row.get(column) for column in columns])
+
+		frappe.db.sql("""insert into `tab{doctype}` ({columns}) values {rows}""".format(
+			doctype=doctype,
+			columns=", ".join("`{0}`".format(column) for column in columns),
+			rows=", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(chunk))),
+			tuple(values))